@@ -2,12 +2,13 @@
 from __future__ import annotations
 
 import os
+import shutil
 
 from flask import Blueprint, jsonify, request
 from werkzeug.utils import secure_filename
 
 from backend import config
-from backend.logging_config import get_logger
+from backend.logging_config import get_logger, log_files
 from backend.request_utils import (
     get_json_body,
     require_admin,
@@ -15,11 +16,18 @@ from backend.request_utils import (
     require_admin_query,
     require_username_password_or_error,
 )
+from backend.corpus_collections import collection_dir, corpus_dir_for, list_collections
 from backend.crypto_storage import encrypt_file_in_place
 from backend.file_response import send_decrypted_pdf
+from backend.rescore_jobs import job_status, recent_jobs, start_rescore
 from backend.security import password_error
 from backend.uploads import list_scan_uploads
 from backend.users import create_user, load_users, save_users, update_user_password
+from plag_system.corpus_index import (
+    add_corpus_documents,
+    get_corpus_index,
+    remove_corpus_documents,
+)
 
 admin_bp = Blueprint("admin", __name__)
 logger = get_logger()
@@ -61,11 +69,15 @@ def admin_logs():
     """Return recent log lines."""
     data = request.json or {}
     limit = int(data.get("limit", 200))
-    if not os.path.exists(config.LOG_FILE):
-        return jsonify({"lines": []})
-    with open(config.LOG_FILE, "r", encoding="utf-8") as log_handle:
-        lines = log_handle.readlines()[-limit:]
-    return jsonify({"lines": [line.rstrip("\n") for line in lines]})
+    paths = log_files()
+    lines: list[str] = []
+    for log_path in paths:
+        with open(log_path, "r", encoding="utf-8") as log_handle:
+            lines.extend(log_handle.readlines()[-limit:])
+    if len(paths) > 1:
+        # Per-worker files are merged by their leading timestamp.
+        lines.sort()
+    return jsonify({"lines": [line.rstrip("\n") for line in lines[-limit:]]})
 
 
 @admin_bp.route("/admin/teacher", methods=["POST"])
@@ -204,16 +216,19 @@ def admin_reset_password():
 
 @admin_bp.route("/admin/corpus/list", methods=["POST"])
 def admin_corpus_list():
-    """List corpus files (admin only)."""
+    """List corpus files, or a collection's files (admin only)."""
     data, error = get_json_body()
     if error:
         return error
     _, error = require_admin(data)
     if error:
         return error
+    corpus_dir, message = corpus_dir_for(data.get("collection"))
+    if message:
+        return jsonify({"error": message}), 404
 
     files = sorted(
-        name for name in os.listdir(config.CORPUS_DIR)
+        name for name in os.listdir(corpus_dir)
         if name.lower().endswith(".pdf")
     )
     return jsonify({"files": files})
@@ -221,10 +236,13 @@ def admin_corpus_list():
 
 @admin_bp.route("/admin/corpus/upload", methods=["POST"])
 def admin_corpus_upload():
-    """Upload a PDF into the corpus (admin only)."""
+    """Upload a PDF into the corpus or a collection (admin only)."""
     admin_username, error = require_admin_form()
     if error:
         return error
+    corpus_dir, message = corpus_dir_for(request.form.get("collection"))
+    if message:
+        return jsonify({"error": message}), 404
 
     uploaded = request.files.get("file")
     error = _validate_pdf_upload(uploaded)
@@ -232,45 +250,182 @@ def admin_corpus_upload():
         return error
 
     filename = secure_filename(uploaded.filename)
-    dest_path = os.path.join(config.CORPUS_DIR, filename)
+    dest_path = os.path.join(corpus_dir, filename)
     uploaded.save(dest_path)
     encrypt_file_in_place(dest_path)
+    duplicate_of = None
+    indexed = False
+    try:
+        index = add_corpus_documents(corpus_dir, [filename])
+        duplicate_of = index.aliases.get(filename)
+        indexed = True
+    except OSError as exc:
+        # The next scan reconciles the index with the directory listing.
+        logger.info("Corpus index update failed for %s: %s", filename, exc)
     logger.info("Admin uploaded corpus file: %s by %s", filename, admin_username)
-    return jsonify({"message": "Corpus file uploaded"}), 201
+    if duplicate_of:
+        return jsonify({"message": "Corpus file uploaded", "duplicate_of": duplicate_of}), 201
+    response = {"message": "Corpus file uploaded"}
+    if indexed and config.RESCORE_ON_UPLOAD:
+        # A duplicate adds no postings, so only new documents can change past scans.
+        response["rescore_job"] = start_rescore(request.form.get("collection") or None, [filename])
+    return jsonify(response), 201
 
 
 @admin_bp.route("/admin/corpus/delete", methods=["POST"])
 def admin_corpus_delete():
-    """Delete a corpus PDF (admin only)."""
+    """Delete a corpus PDF, or a collection's PDF (admin only)."""
     data, error = get_json_body()
     if error:
         return error
     admin_username, error = require_admin(data)
     if error:
         return error
+    corpus_dir, message = corpus_dir_for(data.get("collection"))
+    if message:
+        return jsonify({"error": message}), 404
     filename = data.get("filename")
     if not filename:
         return jsonify({"error": "Filename required"}), 400
     if not filename.lower().endswith(".pdf"):
         return jsonify({"error": "Only PDF files are supported"}), 400
 
-    file_path = os.path.join(config.CORPUS_DIR, filename)
+    file_path = os.path.join(corpus_dir, filename)
     if not os.path.exists(file_path):
         return jsonify({"error": "File not found"}), 404
     os.remove(file_path)
+    try:
+        remove_corpus_documents(corpus_dir, [filename])
+    except OSError as exc:
+        logger.info("Corpus index update failed for %s: %s", filename, exc)
     logger.info("Admin deleted corpus file: %s by %s", filename, admin_username)
     return jsonify({"message": "Corpus file deleted"})
 
 
+@admin_bp.route("/admin/corpus/duplicates", methods=["POST"])
+def admin_corpus_duplicates():
+    """Report duplicate and near-duplicate corpus files (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    _, error = require_admin(data)
+    if error:
+        return error
+    corpus_dir, message = corpus_dir_for(data.get("collection"))
+    if message:
+        return jsonify({"error": message}), 404
+    return jsonify(get_corpus_index(corpus_dir).duplicates())
+
+
 @admin_bp.route("/admin/corpus/file/<filename>", methods=["GET"])
 def admin_corpus_file(filename: str):
     """Serve a corpus PDF (admin only)."""
     _, error = require_admin_query()
     if error:
         return error
+    corpus_dir, message = corpus_dir_for(request.args.get("collection"))
+    if message:
+        return jsonify({"error": message}), 404
     if not filename.lower().endswith(".pdf"):
         return jsonify({"error": "Only PDF files are supported"}), 400
-    file_path = os.path.join(config.CORPUS_DIR, filename)
+    file_path = os.path.join(corpus_dir, filename)
     if not os.path.exists(file_path):
         return jsonify({"error": "File not found"}), 404
     return send_decrypted_pdf(file_path)
+
+
+@admin_bp.route("/admin/collections/list", methods=["POST"])
+def admin_collections_list():
+    """List corpus collections with their file counts (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    _, error = require_admin(data)
+    if error:
+        return error
+    collections = []
+    for name in list_collections():
+        files = os.listdir(collection_dir(name))
+        collections.append(
+            {"name": name, "files": sum(1 for file in files if file.lower().endswith(".pdf"))}
+        )
+    return jsonify({"collections": collections})
+
+
+@admin_bp.route("/admin/collections/create", methods=["POST"])
+def admin_collections_create():
+    """Create an empty corpus collection (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    admin_username, error = require_admin(data)
+    if error:
+        return error
+    name = data.get("name")
+    directory = collection_dir(name)
+    if directory is None:
+        return jsonify(
+            {"error": "Collection names are lowercase letters, digits, '-' and '_'"}
+        ), 400
+    if os.path.exists(directory):
+        return jsonify({"error": "Collection already exists"}), 409
+    os.makedirs(directory)
+    logger.info("Admin created collection: %s by %s", name, admin_username)
+    return jsonify({"message": "Collection created"}), 201
+
+
+@admin_bp.route("/admin/collections/delete", methods=["POST"])
+def admin_collections_delete():
+    """Delete a corpus collection with its files and index (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    admin_username, error = require_admin(data)
+    if error:
+        return error
+    name = data.get("name")
+    directory = collection_dir(name)
+    if directory is None or not os.path.isdir(directory):
+        return jsonify({"error": "Collection not found"}), 404
+    shutil.rmtree(directory)
+    logger.info("Admin deleted collection: %s by %s", name, admin_username)
+    return jsonify({"message": "Collection deleted"})
+
+
+@admin_bp.route("/admin/rescore/start", methods=["POST"])
+def admin_rescore_start():
+    """Re-score past scans against corpus files, in the background (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    admin_username, error = require_admin(data)
+    if error:
+        return error
+    collection = data.get("collection") or None
+    corpus_dir, message = corpus_dir_for(collection)
+    if message:
+        return jsonify({"error": message}), 404
+    files = data.get("files") or sorted(
+        name for name in os.listdir(corpus_dir) if name.lower().endswith(".pdf")
+    )
+    job_id = start_rescore(collection, list(files))
+    logger.info("Admin started re-score job %s by %s", job_id, admin_username)
+    return jsonify({"job_id": job_id}), 202
+
+
+@admin_bp.route("/admin/rescore/status", methods=["POST"])
+def admin_rescore_status():
+    """Report progress of one re-score job, or of the recent ones (admin only)."""
+    data, error = get_json_body()
+    if error:
+        return error
+    _, error = require_admin(data)
+    if error:
+        return error
+    job_id = data.get("job_id")
+    if not job_id:
+        return jsonify({"jobs": recent_jobs()})
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
@@ -1,18 +1,69 @@
 """Flask application factory."""
 from __future__ import annotations
 
-from flask import Flask
+import os
+import re
+import time
 
+from flask import Flask, g, request
+
+from backend import config, metrics
 from backend.admin_routes import admin_bp
 from backend.auth_routes import auth_bp
 from backend.frontend_routes import frontend_bp
+from backend.logging_config import get_logger
+from backend.metrics_routes import metrics_bp
 from backend.scan_routes import scan_bp
 from backend.teacher_routes import teacher_bp
 
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
 
 def create_app() -> Flask:
     """Create and configure the Flask app."""
     app = Flask(__name__)
+    logger = get_logger()
+
+    @app.before_request
+    def start_request_timer():
+        incoming = request.headers.get("X-Request-ID", "")
+        g.request_id = (
+            incoming if _REQUEST_ID_PATTERN.match(incoming) else os.urandom(8).hex()
+        )
+        g.request_start = time.perf_counter()
+        metrics.IN_FLIGHT.inc()
+
+    @app.after_request
+    def log_request_timing(response):
+        response.headers["X-Request-ID"] = g.get("request_id", "")
+        if config.ACCESS_LOG and g.get("request_start") is not None:
+            duration_ms = round((time.perf_counter() - g.request_start) * 1000, 3)
+            logger.info(
+                "%s %s %s %.3fms",
+                request.method,
+                request.path,
+                response.status_code,
+                duration_ms,
+                extra={"duration_ms": duration_ms, "status": response.status_code},
+            )
+        return response
+
+    @app.after_request
+    def record_request_metrics(response):
+        if g.get("request_start") is not None:
+            endpoint = request.endpoint or "unmatched"
+            metrics.REQUESTS.inc(
+                endpoint=endpoint, method=request.method, status=response.status_code
+            )
+            metrics.REQUEST_SECONDS.observe(
+                time.perf_counter() - g.request_start, endpoint=endpoint
+            )
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(_exc):
+        if g.get("request_start") is not None:
+            metrics.IN_FLIGHT.dec()
 
     @app.after_request
     def add_cors_headers(response):
@@ -25,6 +76,7 @@ def create_app() -> Flask:
     app.register_blueprint(scan_bp)
     app.register_blueprint(admin_bp)
     app.register_blueprint(teacher_bp)
+    app.register_blueprint(metrics_bp)
     app.register_blueprint(frontend_bp)
 
     return app
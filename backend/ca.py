@@ -1,19 +1,24 @@
-"""Certificate authority helpers."""
+"""Certificate authority helpers.
+
+cryptography is imported inside the functions, on the first login or
+certificate check, so importing the app does not load it.
+"""
 from __future__ import annotations
 
 import os
 from datetime import datetime, timedelta
 
-from cryptography import x509
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.x509.oid import NameOID
-
 from backend import config
 
 
 def ensure_ca():
     """Ensure a local CA exists and return (private_key, certificate)."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
     ca_key_path = os.path.join(config.CA_DIR, "ca.key")
     ca_cert_path = os.path.join(config.CA_DIR, "ca.crt")
 
@@ -60,6 +65,12 @@ def ensure_ca():
 
 def generate_certificate(username: str, role: str) -> str:
     """Generate a certificate for a user and return path to cert file."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
     ca_key, ca_cert = ensure_ca()
     user_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
 
@@ -102,6 +113,11 @@ def generate_certificate(username: str, role: str) -> str:
 
 def verify_certificate(cert_bytes: bytes, username: str, role: str) -> str | None:
     """Validate a user certificate against the local CA."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography import x509
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.x509.oid import NameOID
+
     ca_cert_path = os.path.join(config.CA_DIR, "ca.crt")
     if not os.path.exists(ca_cert_path):
         return "CA certificate not found"
@@ -1,4 +1,4 @@
-"""Configuration for backend paths."""
+"""Configuration for backend paths and runtime settings."""
 from __future__ import annotations
 
 import os
@@ -8,12 +8,60 @@ USERS_FILE = os.path.join(BASE_DIR, "users.json")
 CA_DIR = os.path.join(BASE_DIR, "ca")
 CERT_DIR = os.path.join(BASE_DIR, "certs")
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
+# Cached corpus PDFs highlighted for one scan.
+HIGHLIGHT_DIR = os.path.join(UPLOAD_DIR, "highlights")
 LOG_FILE = os.path.join(BASE_DIR, "app.log")
 CORPUS_DIR = os.path.join(BASE_DIR, "plag_system", "corpus")
+# Named per-course corpus collections, one sub-directory (and index) each.
+COLLECTIONS_DIR = os.getenv(
+    "PLAG_COLLECTIONS_DIR", os.path.join(BASE_DIR, "plag_system", "collections")
+)
 FRONTEND_DIST = os.path.join(BASE_DIR, "frontend", "dist")
 MASTER_KEY_FILE = os.path.join(BASE_DIR, "keys", "master.key")
+# PKCS#12 keystore that signs scan reports.
+SIGNING_KEY_DIR = os.getenv(
+    "PLAG_SIGNING_KEY_DIR", os.path.join(BASE_DIR, "plag_system", "keys")
+)
 
 os.makedirs(CA_DIR, exist_ok=True)
 os.makedirs(CERT_DIR, exist_ok=True)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(CORPUS_DIR, exist_ok=True)
+os.makedirs(COLLECTIONS_DIR, exist_ok=True)
+
+# Logging: "text" keeps the classic line format, "json" writes JSON lines.
+LOG_FORMAT = os.getenv("PLAG_LOG_FORMAT", "text").lower()
+# Write one log file per worker process instead of a shared, flock-guarded file.
+LOG_PER_WORKER = os.getenv("PLAG_LOG_PER_WORKER", "") == "1"
+# Emit one timing line per request (method, path, status, duration_ms).
+ACCESS_LOG = os.getenv("PLAG_ACCESS_LOG", "") == "1"
+
+# Pre-fork server (`plag-checker serve`).
+SERVER_HOST = os.getenv("PLAG_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("PLAG_PORT", "5000"))
+SERVER_WORKERS = int(os.getenv("PLAG_WORKERS", str(min(os.cpu_count() or 1, 4))))
+SERVER_THREADS = int(os.getenv("PLAG_THREADS", "4"))
+SERVER_TIMEOUT = float(os.getenv("PLAG_TIMEOUT", "60"))
+SERVER_GRACEFUL_TIMEOUT = float(os.getenv("PLAG_GRACEFUL_TIMEOUT", "30"))
+CORPUS_RELOAD_INTERVAL = float(os.getenv("PLAG_CORPUS_RELOAD_INTERVAL", "10"))
+
+# Return per-stage scan timings in every /scan response, not only on request.
+SCAN_TIMINGS = os.getenv("PLAG_SCAN_TIMINGS", "") == "1"
+
+# Prometheus /metrics. Worker processes share samples through one file each in
+# this directory, which `plag-checker serve` clears when it starts and stops.
+METRICS_ENABLED = os.getenv("PLAG_METRICS", "1") == "1"
+METRICS_DIR = os.getenv("PLAG_METRICS_DIR", os.path.join(BASE_DIR, "metrics"))
+# Seconds between samples of each worker's memory, log queue and cache counts.
+METRICS_SAMPLE_INTERVAL = float(os.getenv("PLAG_METRICS_SAMPLE_INTERVAL", "5"))
+
+# Re-score past scans in the background when an admin uploads a corpus file.
+RESCORE_ON_UPLOAD = os.getenv("PLAG_RESCORE_ON_UPLOAD", "1") == "1"
+
+# Corpus directory watcher for PDFs dropped into the corpus outside the admin API.
+CORPUS_WATCH = os.getenv("PLAG_CORPUS_WATCH", "") == "1"
+CORPUS_WATCH_INTERVAL = float(os.getenv("PLAG_CORPUS_WATCH_INTERVAL", "2"))
+# Quiet period before a batch of changes is indexed, and the longest a batch may wait.
+CORPUS_WATCH_DEBOUNCE = float(os.getenv("PLAG_CORPUS_WATCH_DEBOUNCE", "5"))
+CORPUS_WATCH_MAX_DELAY = float(os.getenv("PLAG_CORPUS_WATCH_MAX_DELAY", "300"))
+CORPUS_WATCH_INOTIFY = os.getenv("PLAG_CORPUS_WATCH_INOTIFY", "1") == "1"
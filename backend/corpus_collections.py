@@ -0,0 +1,56 @@
+"""Named corpus collections (per course or assignment).
+
+Each collection is a sub-directory of ``config.COLLECTIONS_DIR`` holding
+its own corpus PDFs, and therefore its own index. A scan that names
+collections only consults their postings instead of the whole default
+corpus.
+"""
+from __future__ import annotations
+
+import os
+import re
+
+from backend import config
+
+COLLECTION_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+def collection_dir(name: str) -> str | None:
+    """Return the directory of collection ``name``, or None when the name is invalid."""
+    if not isinstance(name, str) or not COLLECTION_PATTERN.match(name):
+        return None
+    return os.path.join(config.COLLECTIONS_DIR, name)
+
+
+def list_collections() -> list[str]:
+    """Return the names of the existing collections."""
+    if not os.path.isdir(config.COLLECTIONS_DIR):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(config.COLLECTIONS_DIR)
+        if COLLECTION_PATTERN.match(name)
+        and os.path.isdir(os.path.join(config.COLLECTIONS_DIR, name))
+    )
+
+
+def resolve_collections(names: list[str]) -> tuple[list[str], str | None]:
+    """Return the directories of existing collections ``names``, or an error message."""
+    directories = []
+    for name in names:
+        directory = collection_dir(name)
+        if directory is None or not os.path.isdir(directory):
+            return [], f"Unknown collection: {name}"
+        if directory not in directories:
+            directories.append(directory)
+    return directories, None
+
+
+def corpus_dir_for(collection: str | None) -> tuple[str | None, str | None]:
+    """Return the corpus directory of an optional collection, or an error message."""
+    if not collection:
+        return config.CORPUS_DIR, None
+    directories, error = resolve_collections([collection])
+    if error:
+        return None, error
+    return directories[0], None
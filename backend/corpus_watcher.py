@@ -0,0 +1,283 @@
+"""Watch the corpus directory for files changed outside the admin API.
+
+Deployments often mount the corpus as a volume and drop PDFs into it
+directly. The watcher polls the directory listing (woken early by inotify
+where available), waits until the directory has been quiet for a debounce
+period, encrypts plaintext arrivals and applies everything that changed as
+one incremental index update.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import threading
+import time
+from pathlib import Path
+
+from backend import config
+from backend.crypto_storage import MAGIC, encrypt_file_in_place
+from backend.logging_config import get_logger
+from plag_system.corpus_index import (
+    corpus_signature,
+    get_corpus_index,
+    set_listing_verification,
+    update_corpus_index,
+)
+
+logger = get_logger()
+
+# inotify(7) events that can change the PDF listing of a directory.
+_IN_ATTRIB = 0x004
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_INOTIFY_MASK = (
+    _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+)
+
+
+def _inotify_fd(directory: str) -> int | None:
+    """Return a non-blocking inotify descriptor watching ``directory``, if supported."""
+    library = ctypes.util.find_library("c")
+    if not library:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), _INOTIFY_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_encrypted(path: Path) -> bool:
+    with path.open("rb") as handle:
+        return handle.read(len(MAGIC)) == MAGIC
+
+
+class CorpusWatcher:
+    """Batch out-of-band corpus changes into incremental index updates."""
+
+    def __init__(
+        self,
+        corpus_dir: str = config.CORPUS_DIR,
+        poll_interval: float = config.CORPUS_WATCH_INTERVAL,
+        debounce: float = config.CORPUS_WATCH_DEBOUNCE,
+        max_delay: float = config.CORPUS_WATCH_MAX_DELAY,
+        use_inotify: bool = config.CORPUS_WATCH_INOTIFY,
+    ) -> None:
+        self.corpus_dir = Path(corpus_dir)
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.use_inotify = use_inotify
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._hashes: dict[str, str] = {}
+        self._dirty: set[str] = set()
+        self._first_change = 0.0
+        self._last_change = 0.0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._inotify: int | None = None
+
+    def _listing(self) -> dict[str, tuple[int, int]]:
+        return {
+            name: (size, mtime_ns) for name, size, mtime_ns in corpus_signature(self.corpus_dir)
+        }
+
+    def _indexed_signature(self):
+        # Reconciling here would index the very files this watcher is batching.
+        return get_corpus_index(self.corpus_dir, verify_listing=False).signature
+
+    def _mark(self, names, now: float) -> None:
+        if not self._dirty:
+            self._first_change = now
+        self._dirty.update(names)
+        self._last_change = now
+
+    def prime(self) -> None:
+        """Record the current listing and queue whatever the index has missed."""
+        self._stats = self._listing()
+        indexed = {name: (size, mtime_ns) for name, size, mtime_ns in self._indexed_signature()}
+        pending = {name for name, stat in self._stats.items() if indexed.get(name) != stat}
+        pending.update(name for name in indexed if name not in self._stats)
+        for name in self._stats:
+            try:
+                if not _is_encrypted(self.corpus_dir / name):
+                    pending.add(name)
+            except OSError:
+                continue
+        if pending:
+            self._mark(pending, time.monotonic())
+
+    def poll(self) -> int:
+        """Compare the listing with the last one; return how many files changed."""
+        listing = self._listing()
+        changed = {name for name, stat in listing.items() if self._stats.get(name) != stat}
+        changed.update(name for name in self._stats if name not in listing)
+        self._stats = listing
+        if changed:
+            self._mark(changed, time.monotonic())
+        return len(changed)
+
+    def due(self, now: float | None = None) -> bool:
+        """Return True once the directory has been quiet for the debounce period."""
+        if not self._dirty:
+            return False
+        now = time.monotonic() if now is None else now
+        return (
+            now - self._last_change >= self.debounce
+            or now - self._first_change >= self.max_delay
+        )
+
+    def flush(self) -> tuple[list[str], list[str]]:
+        """Encrypt and index every pending change in one update.
+
+        Returns the ``(added, removed)`` file names sent to the index.
+        """
+        names = sorted(self._dirty)
+        self._dirty.clear()
+        added: list[str] = []
+        removed: list[str] = []
+        encrypted = 0
+        for name in names:
+            path = self.corpus_dir / name
+            if name not in self._stats:
+                self._hashes.pop(name, None)
+                removed.append(name)
+                continue
+            try:
+                if not _is_encrypted(path):
+                    encrypt_file_in_place(path)
+                    encrypted += 1
+                stat = path.stat()
+                digest = _file_hash(path)
+            except FileNotFoundError:
+                self._stats.pop(name, None)
+                self._hashes.pop(name, None)
+                removed.append(name)
+                continue
+            except OSError as exc:
+                logger.info("Corpus watcher could not read %s: %s", name, exc)
+                continue
+            # Keep the post-encryption stat so our own rewrite is not seen as a change.
+            self._stats[name] = (stat.st_size, stat.st_mtime_ns)
+            if self._hashes.get(name) == digest:
+                continue
+            self._hashes[name] = digest
+            added.append(name)
+
+        # Admin uploads index their files themselves; skip what is already current.
+        indexed = {name: (size, mtime_ns) for name, size, mtime_ns in self._indexed_signature()}
+        added = [name for name in added if indexed.get(name) != self._stats.get(name)]
+        removed = [name for name in removed if name in indexed]
+        if added or removed:
+            index = update_corpus_index(self.corpus_dir, added=added, removed=removed)
+            logger.info(
+                "Corpus watcher indexed %d added, %d removed (%d encrypted), generation %d",
+                len(added),
+                len(removed),
+                encrypted,
+                index.generation,
+            )
+        return added, removed
+
+    def _wait(self, timeout: float) -> None:
+        if self._inotify is None:
+            self._stop.wait(timeout)
+            return
+        ready, _, _ = select.select([self._inotify], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self._inotify, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _run(self) -> None:
+        try:
+            self.prime()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Corpus watcher failed to read the initial listing")
+        while not self._stop.is_set():
+            self._wait(self.poll_interval)
+            if self._stop.is_set():
+                break
+            try:
+                self.poll()
+                if self.due():
+                    self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Corpus watcher update failed")
+
+    def run(self) -> None:
+        """Watch on the calling thread until :meth:`stop` is called."""
+        if self.use_inotify:
+            self._inotify = _inotify_fd(str(self.corpus_dir))
+        logger.info(
+            "Watching %s for corpus changes (%s)",
+            self.corpus_dir,
+            "inotify" if self._inotify is not None else "polling",
+        )
+        try:
+            self._run()
+        finally:
+            if self._inotify is not None:
+                os.close(self._inotify)
+                self._inotify = None
+
+    def start(self) -> None:
+        """Start watching on a daemon thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching; pending changes are picked up on the next start.
+
+        Only sets a flag when watching on the calling thread, so it is safe
+        to call from a signal handler.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+
+def start_corpus_watcher(
+    corpus_dir: str = config.CORPUS_DIR,
+    thread: bool = True,
+) -> CorpusWatcher | None:
+    """Start a watcher when ``PLAG_CORPUS_WATCH`` is enabled.
+
+    The watcher becomes the only source of out-of-band changes, so scans stop
+    comparing the watched directory's listing with its index and never index
+    a half-copied batch. Collections are still compared. Without ``thread``
+    the watcher is returned unstarted, for a caller that runs it in its own
+    process with :meth:`CorpusWatcher.run`.
+    """
+    if not config.CORPUS_WATCH:
+        return None
+    set_listing_verification(False, corpus_dir)
+    watcher = CorpusWatcher(corpus_dir)
+    if thread:
+        watcher.start()
+    return watcher
@@ -1,19 +1,181 @@
-"""Logging configuration for the backend."""
+"""Logging configuration for the backend.
+
+Records are handed to a ``QueueHandler`` on the request path and written to
+disk by a ``QueueListener`` thread, so route handlers never block on file I/O.
+"""
 from __future__ import annotations
 
+import atexit
+import glob
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from flask import g, has_request_context, request
 
 from backend import config
 
+LOGGER_NAME = "plag_checker"
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+_RESERVED_FIELDS = (
+    "request_id",
+    "method",
+    "path",
+    "elapsed_ms",
+    "duration_ms",
+    "status",
+    "timings",
+)
+
+_STATE_LOCK = threading.Lock()
+_STATE: dict = {"queue": None, "handler": None, "listener": None}
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the active request id and elapsed time to each record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if has_request_context():
+            if not hasattr(record, "request_id"):
+                record.request_id = g.get("request_id")
+            if not hasattr(record, "method"):
+                record.method = request.method
+            if not hasattr(record, "path"):
+                record.path = request.path
+            start = g.get("request_start")
+            if start is not None and not hasattr(record, "elapsed_ms"):
+                record.elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+        return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc)
+        payload = {
+            "ts": timestamp.isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for field in _RESERVED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        return json.dumps(payload, sort_keys=False)
+
+
+class LockedFileHandler(logging.FileHandler):
+    """File handler that serialises writes across processes with ``flock``."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            self.stream = self._open()
+        if fcntl is None:
+            super().emit(record)
+            return
+        fileno = self.stream.fileno()
+        fcntl.flock(fileno, fcntl.LOCK_EX)
+        try:
+            super().emit(record)
+        finally:
+            fcntl.flock(fileno, fcntl.LOCK_UN)
+
+
+def worker_log_file(pid: int | None = None) -> str:
+    """Return the log path used by this process."""
+    if not config.LOG_PER_WORKER:
+        return config.LOG_FILE
+    root, ext = os.path.splitext(config.LOG_FILE)
+    return f"{root}.{pid or os.getpid()}{ext}"
+
+
+def log_files() -> list[str]:
+    """Return every log file the admin log view should read."""
+    paths = [config.LOG_FILE] if os.path.exists(config.LOG_FILE) else []
+    if config.LOG_PER_WORKER:
+        root, ext = os.path.splitext(config.LOG_FILE)
+        paths.extend(sorted(glob.glob(f"{glob.escape(root)}.*{ext}")))
+    return paths
+
+
+def _build_file_handler() -> logging.Handler:
+    handler = LockedFileHandler(worker_log_file(), delay=True)
+    if config.LOG_FORMAT == "json":
+        handler.setFormatter(JsonLinesFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def _start_listener(log_queue: queue.Queue) -> logging.handlers.QueueListener:
+    listener = logging.handlers.QueueListener(
+        log_queue,
+        _build_file_handler(),
+        respect_handler_level=True,
+    )
+    listener.start()
+    return listener
+
+
+def queued_records() -> int:
+    """Records waiting for the background writer in this process."""
+    log_queue = _STATE["queue"]
+    return log_queue.qsize() if log_queue is not None else 0
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the background writer."""
+    with _STATE_LOCK:
+        listener = _STATE["listener"]
+        _STATE["listener"] = None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+def _reinit_after_fork() -> None:
+    """Give a forked child its own queue and writer thread."""
+    # The parent's listener thread does not exist in the child and the old
+    # queue and state lock may have been held mid-operation at fork time.
+    global _STATE_LOCK  # pylint: disable=global-statement
+    _STATE_LOCK = threading.Lock()
+    handler = _STATE["handler"]
+    if handler is None:
+        return
+    _STATE["listener"] = None
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler.queue = log_queue
+    _STATE["queue"] = log_queue
+    _STATE["listener"] = _start_listener(log_queue)
+
 
 def get_logger() -> logging.Logger:
     """Return a configured logger for the app."""
-    logger = logging.getLogger("plag_checker")
+    logger = logging.getLogger(LOGGER_NAME)
     logger.setLevel(logging.INFO)
-    if not logger.handlers:
-        handler = logging.FileHandler(config.LOG_FILE)
-        handler.setFormatter(
-            logging.Formatter("%(asctime)s %(levelname)s %(message)s")
-        )
-        logger.addHandler(handler)
+    with _STATE_LOCK:
+        if not logger.handlers:
+            log_queue: queue.Queue = queue.Queue(-1)
+            handler = logging.handlers.QueueHandler(log_queue)
+            handler.addFilter(RequestContextFilter())
+            logger.addHandler(handler)
+            _STATE["queue"] = log_queue
+            _STATE["handler"] = handler
+            _STATE["listener"] = _start_listener(log_queue)
+            atexit.register(stop_logging)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(after_in_child=_reinit_after_fork)
     return logger
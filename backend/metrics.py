@@ -0,0 +1,483 @@
+"""
+Prometheus metrics shared by every worker process.
+
+Each process adds to its own memory-mapped file of samples under
+``PLAG_METRICS_DIR`` (``<pid>.db``), and ``/metrics`` sums the files of all
+processes, so whichever worker answers a scrape reports the whole server.
+Counters and histograms of exited workers keep counting; gauges only count
+for processes that are still running. Values that describe the server as a
+whole, such as the corpus size, are read when the metrics are rendered.
+Process samples (memory, log queue, cache counts) are taken by a timer in
+each worker and by the worker answering a scrape, never per request.
+
+A process that exits normally removes its own file; workers leave theirs so
+their counts survive them, and ``plag-checker serve`` clears the directory
+when it starts and stops. A process given the pid of an exited worker keeps
+that worker's counts but zeroes its gauges. Servers whose workers do not
+share the default directory should set ``PLAG_METRICS_DIR`` to the same
+directory for each.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Iterable
+
+from backend import config
+from backend.logging_config import queued_records
+from plag_system.corpus_index import get_corpus_index, index_cache_stats
+from plag_system.page_cache import page_cache_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_HEADER = struct.Struct("<Q")  # Bytes of the file in use.
+_LENGTH = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+_INITIAL_SIZE = 64 * 1024
+
+_REGISTRY: dict[str, "_Metric"] = {}
+
+
+def _entries(buffer, used: int) -> Iterable[tuple[str, int]]:
+    """Yield ``(key, value offset)`` of every slot: a length-prefixed key padded
+    to 8 bytes, then a double."""
+    position = _HEADER.size
+    while position < used:
+        (length,) = _LENGTH.unpack_from(buffer, position)
+        key_end = position + _LENGTH.size + length
+        value_offset = key_end + (-key_end % 8)
+        yield bytes(buffer[position + _LENGTH.size : key_end]).decode("utf-8"), value_offset
+        position = value_offset + _VALUE.size
+
+
+class _ValueFile:
+    """Samples of the current process, one slot per key, appended on first use."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = os.fstat(self._fd).st_size
+        if size < _INITIAL_SIZE:
+            os.ftruncate(self._fd, _INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self._map = mmap.mmap(self._fd, size)
+        (self._used,) = _HEADER.unpack_from(self._map, 0)
+        if not self._used:
+            self._used = _HEADER.size
+            _HEADER.pack_into(self._map, 0, self._used)
+        self._offsets = dict(_entries(self._map, self._used))
+
+    def _slot(self, key: str) -> int:
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+        encoded = key.encode("utf-8")
+        key_end = self._used + _LENGTH.size + len(encoded)
+        offset = key_end + (-key_end % 8)
+        end = offset + _VALUE.size
+        if end > len(self._map):
+            size = len(self._map)
+            while end > size:
+                size *= 2
+            self._map.close()
+            os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        _LENGTH.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _LENGTH.size : key_end] = encoded
+        _VALUE.pack_into(self._map, offset, 0.0)
+        # Readers only parse up to the header, so the slot is complete first.
+        self._used = end
+        _HEADER.pack_into(self._map, 0, end)
+        self._offsets[key] = offset
+        return offset
+
+    def keys(self) -> list[str]:
+        """The keys with a slot in the file."""
+        with self._lock:
+            return list(self._offsets)
+
+    def add(self, key: str, amount: float) -> None:
+        """Add ``amount`` to the slot of ``key``."""
+        with self._lock:
+            offset = self._slot(key)
+            (value,) = _VALUE.unpack_from(self._map, offset)
+            _VALUE.pack_into(self._map, offset, value + amount)
+
+    def set(self, key: str, value: float) -> None:
+        """Overwrite the slot of ``key``."""
+        with self._lock:
+            _VALUE.pack_into(self._map, self._slot(key), value)
+
+
+def _read_values(path: str) -> dict[str, float]:
+    with open(path, "rb") as handle:
+        data = handle.read()
+    if len(data) < _HEADER.size:
+        return {}
+    (used,) = _HEADER.unpack_from(data, 0)
+    return {
+        key: _VALUE.unpack_from(data, offset)[0]
+        for key, offset in _entries(data, min(used, len(data)))
+    }
+
+
+_STATE: dict = {"file": None}
+_STATE_LOCK = threading.Lock()
+
+
+def _values() -> _ValueFile:
+    """The current process's file; a forked worker opens its own."""
+    path = os.path.join(config.METRICS_DIR, f"{os.getpid()}.db")
+    values = _STATE["file"]
+    if values is None or values.path != path:
+        with _STATE_LOCK:
+            if _STATE["file"] is None or _STATE["file"].path != path:
+                _STATE["file"] = _ValueFile(path)
+                # An exited worker with the same pid may have left the file: its
+                # counts still count, but its gauges described that worker.
+                for key in _STATE["file"].keys():
+                    if _is_live(key):
+                        _STATE["file"].set(key, 0.0)
+                # Skipped by workers, which leave through os._exit.
+                atexit.register(_remove_file, path)
+            values = _STATE["file"]
+    return values
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def reset() -> None:
+    """Remove the samples of earlier runs (called when a server starts)."""
+    with _STATE_LOCK:
+        _STATE["file"] = None
+    if not os.path.isdir(config.METRICS_DIR):
+        return
+    for name in os.listdir(config.METRICS_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(config.METRICS_DIR, name))
+
+
+class _Metric:
+    """A named family of samples; ``live`` families drop exited processes."""
+
+    kind = ""
+    live = False
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        _REGISTRY[name] = self
+
+    def _key(self, suffix: str, labels: dict, **extra: str) -> str:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames)}")
+        values = {name: str(value) for name, value in labels.items()}
+        values.update(extra)
+        return json.dumps([self.name + suffix, values], sort_keys=True)
+
+    def _record(self, key: str, amount: float, overwrite: bool = False) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        values = _values()
+        if overwrite:
+            values.set(key, amount)
+        else:
+            values.add(key, amount)
+
+
+class Counter(_Metric):
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Add ``amount`` to this process's count."""
+        self._record(self._key("", labels), amount)
+
+    def set_total(self, value: float, **labels) -> None:
+        """Set this process's count, for counts kept elsewhere (cache statistics)."""
+        self._record(self._key("", labels), value, overwrite=True)
+
+
+class Gauge(_Metric):
+    """A value of the running processes, summed across them."""
+
+    kind = "gauge"
+    live = True
+
+    def set(self, value: float, **labels) -> None:
+        """Set this process's value."""
+        self._record(self._key("", labels), value, overwrite=True)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """Add ``amount`` to this process's value."""
+        self._record(self._key("", labels), amount)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        """Subtract ``amount`` from this process's value."""
+        self._record(self._key("", labels), -amount)
+
+
+class Histogram(_Metric):
+    """Observations counted into buckets, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        """Record one observation."""
+        bound = next(bound for bound in self.buckets if value <= bound)
+        # Stored per bucket; rendering makes the counts cumulative.
+        self._record(self._key("_bucket", labels, le=_format_value(bound)), 1.0)
+        self._record(self._key("_sum", labels), value)
+        self._record(self._key("_count", labels), 1.0)
+
+
+class CallbackGauge(_Metric):
+    """A gauge computed when the metrics are rendered.
+
+    ``function`` receives the summed samples and returns ``(labels, value)``
+    pairs.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        function: Callable[[dict[str, float]], Iterable[tuple[dict, float]]],
+    ):
+        super().__init__(name, documentation)
+        self.function = function
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect() -> dict[str, float]:
+    """Sum the samples of every process's file."""
+    totals: dict[str, float] = {}
+    if not os.path.isdir(config.METRICS_DIR):
+        return totals
+    for name in os.listdir(config.METRICS_DIR):
+        stem, extension = os.path.splitext(name)
+        if extension != ".db" or not stem.isdigit():
+            continue
+        try:
+            values = _read_values(os.path.join(config.METRICS_DIR, name))
+        except OSError:
+            continue
+        alive = None
+        for key, value in values.items():
+            metric = _REGISTRY.get(_family(json.loads(key)[0]))
+            if metric is None:
+                continue
+            if metric.live:
+                alive = _alive(int(stem)) if alive is None else alive
+                if not alive:
+                    continue
+            totals[key] = totals.get(key, 0.0) + value
+    return totals
+
+
+def _is_live(key: str) -> bool:
+    metric = _REGISTRY.get(_family(json.loads(key)[0]))
+    return metric is not None and metric.live
+
+
+def _family(sample_name: str) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        if sample_name.endswith(suffix) and sample_name[: -len(suffix)] in _REGISTRY:
+            return sample_name[: -len(suffix)]
+    return sample_name
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _sample(name: str, labels: dict, value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(str(labels[key]))}"' for key in sorted(labels))
+        name = f"{name}{{{rendered}}}"
+    return f"{name} {_format_value(float(value))}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    totals = collect()
+    samples: dict[str, list[tuple[str, dict, float]]] = {}
+    for key, value in totals.items():
+        sample_name, labels = json.loads(key)
+        samples.setdefault(_family(sample_name), []).append((sample_name, labels, value))
+
+    lines = []
+    for name, metric in _REGISTRY.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        if isinstance(metric, CallbackGauge):
+            lines.extend(_sample(name, labels, value) for labels, value in metric.function(totals))
+        elif isinstance(metric, Histogram):
+            lines.extend(_histogram_lines(metric, samples.get(name, [])))
+        else:
+            lines.extend(
+                _sample(sample_name, labels, value)
+                for sample_name, labels, value in sorted(
+                    samples.get(name, []), key=lambda item: sorted(item[1].items())
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(metric: Histogram, samples: list[tuple[str, dict, float]]) -> list[str]:
+    series: dict[str, dict] = {}
+    for sample_name, labels, value in samples:
+        base = {key: item for key, item in labels.items() if key != "le"}
+        entry = series.setdefault(json.dumps(base, sort_keys=True), {"buckets": {}})
+        if sample_name.endswith("_bucket"):
+            entry["buckets"][labels["le"]] = value
+        else:
+            entry[sample_name[len(metric.name) :]] = value
+    lines = []
+    for base_key in sorted(series):
+        base, entry = json.loads(base_key), series[base_key]
+        cumulative = 0.0
+        for bound in metric.buckets:
+            le = _format_value(bound)
+            cumulative += entry["buckets"].get(le, 0.0)
+            lines.append(_sample(f"{metric.name}_bucket", {**base, "le": le}, cumulative))
+        lines.append(_sample(f"{metric.name}_sum", base, entry.get("_sum", 0.0)))
+        lines.append(_sample(f"{metric.name}_count", base, entry.get("_count", 0.0)))
+    return lines
+
+
+def _resident_memory() -> int | None:
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as handle:
+            return int(handle.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None  # No /proc on this platform.
+
+
+def _hit_ratios(totals: dict[str, float]) -> Iterable[tuple[dict, float]]:
+    counts: dict[str, list[float]] = {}
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        if name in (CACHE_HITS.name, CACHE_MISSES.name):
+            counts.setdefault(labels["cache"], [0.0, 0.0])[name == CACHE_MISSES.name] += value
+    for cache, (hits, misses) in sorted(counts.items()):
+        if hits + misses:
+            yield {"cache": cache}, hits / (hits + misses)
+
+
+def _corpus_size(_totals: dict[str, float]) -> Iterable[tuple[dict, float]]:
+    try:
+        index = get_corpus_index(config.CORPUS_DIR, verify_listing=False)
+    except Exception:  # pylint: disable=broad-except
+        return []  # An unreadable index must not fail the scrape.
+    return [
+        ({"state": "live"}, len(index.documents)),
+        ({"state": "deleted"}, index.dead_documents),
+    ]
+
+
+REQUESTS = Counter(
+    "plag_http_requests_total",
+    "HTTP requests by endpoint (blueprint.view), method and status.",
+    ("endpoint", "method", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "plag_http_request_duration_seconds", "HTTP request latency by endpoint.", ("endpoint",)
+)
+IN_FLIGHT = Gauge("plag_http_requests_in_flight", "Requests being handled.")
+SCAN_STAGE_SECONDS = Histogram(
+    "plag_scan_stage_duration_seconds", "Duration of each stage of a /scan.", ("stage",)
+)
+CORPUS_DOCUMENTS = CallbackGauge(
+    "plag_corpus_documents", "Documents in the corpus index, live and deleted.", _corpus_size
+)
+CACHE_HITS = Counter("plag_cache_hits_total", "Cache lookups that hit.", ("cache",))
+CACHE_MISSES = Counter("plag_cache_misses_total", "Cache lookups that missed.", ("cache",))
+CACHE_HIT_RATIO = CallbackGauge(
+    "plag_cache_hit_ratio", "Share of cache lookups that hit, across processes.", _hit_ratios
+)
+QUEUE_DEPTH = Gauge(
+    "plag_queue_depth", "Items waiting: queued log records and re-score jobs.", ("queue",)
+)
+RESIDENT_MEMORY = Gauge(
+    "plag_process_resident_memory_bytes", "Resident memory of each process.", ("pid", "role")
+)
+
+
+def sample_process(role: str = "worker") -> None:
+    """Record this process's memory and, in workers, its log queue and caches."""
+    if not config.METRICS_ENABLED:
+        return
+    memory = _resident_memory()
+    if memory is not None:
+        RESIDENT_MEMORY.set(memory, pid=os.getpid(), role=role)
+    if role != "worker":
+        return
+    QUEUE_DEPTH.set(queued_records(), queue="log")
+    for cache, (hits, misses) in (
+        ("page", page_cache_stats()),
+        ("corpus_index", index_cache_stats()),
+    ):
+        CACHE_HITS.set_total(hits, cache=cache)
+        CACHE_MISSES.set_total(misses, cache=cache)
+
+
+def start_sampler(interval: float | None = None) -> threading.Event:
+    """Call :func:`sample_process` every ``interval`` seconds on a daemon thread.
+
+    Setting the returned event stops the sampler.
+    """
+    interval = config.METRICS_SAMPLE_INTERVAL if interval is None else interval
+    stop = threading.Event()
+    if not config.METRICS_ENABLED or interval <= 0:
+        return stop
+
+    def _run() -> None:
+        while not stop.is_set():
+            sample_process()
+            stop.wait(interval)
+
+    threading.Thread(target=_run, name="plag-metrics-sampler", daemon=True).start()
+    return stop
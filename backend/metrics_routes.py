@@ -0,0 +1,17 @@
+"""Prometheus metrics endpoint."""
+from __future__ import annotations
+
+from flask import Blueprint, Response, jsonify
+
+from backend import config, metrics
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Return the metrics of every worker in the Prometheus text format."""
+    if not config.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    metrics.sample_process()
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
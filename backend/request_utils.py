@@ -5,7 +5,7 @@ from typing import Any
 
 from flask import jsonify, request
 
-from backend.security import verify_admin, verify_teacher
+from backend.security import verify_admin, verify_teacher, verify_user
 
 
 def get_json_body() -> tuple[dict[str, Any] | None, tuple[Any, int] | None]:
@@ -77,6 +77,17 @@ def require_admin_form() -> tuple[str | None, tuple[Any, int] | None]:
     return admin_username, None
 
 
+def verified_form_user() -> str | None:
+    """Return the form's username if its password verifies, else None."""
+    username = request.form.get("username")
+    password = request.form.get("password")
+    if not username or not password:
+        return None
+    if not verify_user(username, password):
+        return None
+    return username
+
+
 def require_admin_query() -> tuple[str | None, tuple[Any, int] | None]:
     """Validate admin credentials from query parameters."""
     admin_username = request.args.get("admin_username")
@@ -86,3 +97,14 @@ def require_admin_query() -> tuple[str | None, tuple[Any, int] | None]:
     if not verify_admin(admin_username, admin_password):
         return None, (jsonify({"error": "Unauthorized"}), 401)
     return admin_username, None
+
+
+def require_teacher_query() -> tuple[tuple[str, str] | None, tuple[Any, int] | None]:
+    """Validate teacher credentials from query parameters."""
+    username = request.args.get("username")
+    password = request.args.get("password")
+    if not username or not password:
+        return None, (jsonify({"error": "Credentials required"}), 401)
+    if not verify_teacher(username, password):
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    return (username, password), None
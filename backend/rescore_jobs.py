@@ -0,0 +1,361 @@
+"""Background re-scoring of past scans after corpus additions.
+
+``/scan`` keeps each submission's token positions (``scan_<id>.pos``,
+encrypted) and a Bloom filter of its n-grams (``scan_<id>.bloom``). When
+documents are added to a corpus, a job tests their n-grams against the
+filters of the submissions scanned against that corpus, decrypts only the
+positions of those that may share some, and re-scores the ones that do:
+their summaries get the new percentage and the new sources' passages, and
+their annotated PDF and highlighted sources are dropped so they are rendered
+again with the new matches. Past scans are never extracted again.
+
+Jobs run one at a time on a background thread; an ``flock`` on
+``rescore.lock`` serialises them across worker processes. Progress is
+written to ``.rescore_jobs/<job_id>.json`` in the upload directory so any
+worker can report it.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from backend import config, metrics
+from backend.corpus_collections import COLLECTION_PATTERN, corpus_dir_for
+from backend.crypto_storage import decrypt_to_temp, encrypt_file_in_place
+from backend.logging_config import get_logger
+from backend.scan_reports import SCAN_ID_PATTERN
+from plag_system.bloom import BloomFilter, read_bloom, write_bloom
+from plag_system.checker import rescore_submission, write_matched_grams
+from plag_system.corpus_index import get_corpus_index, merge_lookups
+from plag_system.mmap_index import IndexFormatError
+from plag_system.positions import TokenPositions, read_positions
+from plag_system.sharding import configured_shards, query_shards
+from plag_system.simhash import simhash
+
+logger = get_logger()
+
+# Hidden, so it is never mistaken for a collection when both share a directory.
+JOBS_DIR_NAME = ".rescore_jobs"
+# Seconds between progress writes while a job runs.
+PROGRESS_INTERVAL = 1.0
+_EXECUTOR: ThreadPoolExecutor | None = None
+_EXECUTOR_LOCK = threading.Lock()
+# Serialises jobs within a process where flock is unavailable.
+_JOB_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class _Paths:
+    """Directories of one job, captured when it is queued."""
+    uploads: str
+    corpus: str
+    collections: str
+    highlights: str
+
+    def scan(self, scan_id: str, suffix: str) -> str:
+        """Path of one of a scan's stored files."""
+        return os.path.join(self.uploads, f"scan_{scan_id}{suffix}")
+
+    def collection(self, name: str) -> str | None:
+        """Directory of an existing collection, or None."""
+        directory = os.path.join(self.collections, name)
+        if not COLLECTION_PATTERN.match(name) or not os.path.isdir(directory):
+            return None
+        return directory
+
+
+def write_gram_filter(positions: TokenPositions, filter_path: str) -> None:
+    """Write the Bloom filter of a scan's n-grams.
+
+    The filter only holds hashed bits, so it is stored unencrypted and jobs
+    can rule a scan out without decrypting anything.
+    """
+    grams = set(positions.grams)
+    bloom = BloomFilter.for_capacity(len(grams))
+    bloom.update(grams)
+    write_bloom(filter_path, bloom)
+
+
+def _jobs_dir(upload_dir: str | None = None) -> str:
+    return os.path.join(upload_dir or config.UPLOAD_DIR, JOBS_DIR_NAME)
+
+
+def _status_path(job_id: str, upload_dir: str | None = None) -> str:
+    return os.path.join(_jobs_dir(upload_dir), f"{job_id}.json")
+
+
+def _write_json(path: str, payload: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            json.dump(payload, handle)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def job_status(job_id: str) -> dict | None:
+    """Return the progress of a re-score job, or None when it is unknown."""
+    if not SCAN_ID_PATTERN.match(job_id):
+        return None
+    try:
+        with open(_status_path(job_id), "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def recent_jobs(limit: int = 20) -> list[dict]:
+    """Return the most recently created jobs, newest first."""
+    if not os.path.isdir(_jobs_dir()):
+        return []
+    jobs = [
+        job_status(name[: -len(".json")])
+        for name in os.listdir(_jobs_dir())
+        if name.endswith(".json")
+    ]
+    jobs = [job for job in jobs if job is not None]
+    jobs.sort(key=lambda job: job["created_at"], reverse=True)
+    return jobs[:limit]
+
+
+def start_rescore(collection: str | None, documents: list[str]) -> str:
+    """Queue a job re-scoring past scans against ``documents`` of a corpus.
+
+    ``collection`` names the collection the documents were added to; None
+    is the default corpus. Returns the job id.
+    """
+    global _EXECUTOR  # pylint: disable=global-statement
+    corpus_dir, error = corpus_dir_for(collection)
+    if error:
+        raise ValueError(error)
+    paths = _Paths(config.UPLOAD_DIR, corpus_dir, config.COLLECTIONS_DIR, config.HIGHLIGHT_DIR)
+    job_id = os.urandom(8).hex()
+    status = {
+        "job_id": job_id,
+        "status": "queued",
+        "collection": collection,
+        "documents": sorted(documents),
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "scans_total": 0,
+        "scans_checked": 0,
+        "scans_updated": 0,
+        "scans_per_second": 0.0,
+        "error": None,
+    }
+    _write_json(_status_path(job_id), status)
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plag-rescore")
+        metrics.QUEUE_DEPTH.inc(queue="rescore")
+        _EXECUTOR.submit(_run, status, paths)
+    return job_id
+
+
+@contextlib.contextmanager
+def _exclusive(paths: _Paths) -> Iterator[None]:
+    os.makedirs(_jobs_dir(paths.uploads), exist_ok=True)
+    with open(os.path.join(_jobs_dir(paths.uploads), "rescore.lock"), "a+b") as lock_handle:
+        with _JOB_LOCK if fcntl is None else contextlib.nullcontext():
+            if fcntl is not None:
+                fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+            yield
+
+
+def _stored_scans(paths: _Paths, collection: str | None) -> list[tuple[str, dict]]:
+    """Return ``(scan_id, summary)`` of the scans with stored positions compared
+    against ``collection`` (the default corpus when None)."""
+    scans = []
+    for name in sorted(os.listdir(paths.uploads)):
+        if not (name.startswith("scan_") and name.endswith(".pos")):
+            continue
+        scan_id = name[len("scan_") : -len(".pos")]
+        if not SCAN_ID_PATTERN.match(scan_id):
+            continue
+        try:
+            with open(paths.scan(scan_id, ".json"), "r", encoding="utf-8") as handle:
+                summary = json.load(handle)
+        except (OSError, json.JSONDecodeError):
+            continue
+        scanned = summary.get("collections") or []
+        if (collection is None and not scanned) or collection in scanned:
+            scans.append((scan_id, summary))
+    return scans
+
+
+def _may_share(paths: _Paths, scan_id: str, grams: set[int]) -> bool:
+    """Return False when a scan's gram filter rules out every gram of ``grams``."""
+    try:
+        bloom = read_bloom(paths.scan(scan_id, ".bloom"))
+    except (OSError, IndexFormatError):
+        # Scans stored before gram filters existed are always decrypted.
+        return True
+    return any(gram in bloom for gram in grams)
+
+
+def _load_positions(paths: _Paths, scan_id: str) -> TokenPositions:
+    plain = decrypt_to_temp(paths.scan(scan_id, ".pos"), suffix=".pos")
+    try:
+        return read_positions(plain)
+    finally:
+        plain.unlink()
+
+
+def _lookup(paths: _Paths, summary: dict, grams: set[int]):
+    directories = [
+        directory
+        for directory in map(paths.collection, summary.get("collections") or [])
+        if directory is not None
+    ]
+    fingerprint = simhash(grams)
+    shards = configured_shards()
+    if directories:
+        return merge_lookups(
+            [
+                get_corpus_index(directory).lookup(grams, fingerprint)
+                for directory in directories
+            ]
+        )
+    if shards:
+        # The same scatter-gather as /scan; too few shards answering fails the job.
+        return query_shards(paths.corpus, shards, grams, fingerprint)
+    return get_corpus_index(paths.corpus).lookup(grams, fingerprint)
+
+
+def _rescore(
+    paths: _Paths,
+    scan_id: str,
+    summary: dict,
+    positions: TokenPositions,
+    sources: set[str],
+) -> bool:
+    """Update one scan's summary; returns False when no new source matched it."""
+    lookup = _lookup(paths, summary, set(positions.grams))
+    result = rescore_submission(positions, lookup, sources)
+    if not result["passages"]:
+        return False
+    summary["plagiarism_percentage"] = result["plagiarism_percentage"]
+    summary_sources = summary.setdefault("sources", {})
+    for path, passages in result["passages"].items():
+        if passages:
+            summary_sources[Path(path).name] = [
+                [passage["source"]["start"], passage["source"]["end"]] for passage in passages
+            ]
+    summary["rescored"] = {
+        "at": time.time(),
+        "new_sources": sorted(Path(path).name for path in result["passages"]),
+    }
+    _write_json(paths.scan(scan_id, ".json"), summary)
+    _invalidate_renders(paths, scan_id, lookup.matched)
+    return True
+
+
+def _invalidate_renders(paths: _Paths, scan_id: str, matched: set[int]) -> None:
+    """Drop the annotated PDF and highlighted sources rendered from the old matches.
+
+    The matched grams are rewritten so the next PDF request renders the new
+    matches; the flock on the stored upload keeps a concurrent render out.
+    """
+    if os.path.isdir(paths.highlights):
+        for name in os.listdir(paths.highlights):
+            if name.startswith(f"{scan_id}_"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(paths.highlights, name))
+    upload_path = paths.scan(scan_id, ".upload")
+    try:
+        upload_handle = open(upload_path, "rb")  # pylint: disable=consider-using-with
+    except FileNotFoundError:
+        logger.info("Re-scored scan %s has no stored upload; keeping its PDF", scan_id)
+        return
+    with upload_handle:
+        if fcntl is not None:
+            fcntl.flock(upload_handle.fileno(), fcntl.LOCK_EX)
+        fd, temp_path = tempfile.mkstemp(dir=paths.uploads, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_matched_grams(temp_path, matched)
+            encrypt_file_in_place(temp_path)
+            os.replace(temp_path, paths.scan(scan_id, ".grams"))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(paths.scan(scan_id, ".pdf"))
+
+
+def _run(status: dict, paths: _Paths) -> None:
+    try:
+        with _exclusive(paths):
+            _execute(status, paths)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.exception("Re-score job %s failed", status["job_id"])
+        status.update(status="failed", error=str(exc), finished_at=time.time())
+        with contextlib.suppress(OSError):
+            _write_json(_status_path(status["job_id"], paths.uploads), status)
+    finally:
+        metrics.QUEUE_DEPTH.dec(queue="rescore")
+
+
+def _execute(status: dict, paths: _Paths) -> None:
+    started = time.time()
+    status.update(status="running", started_at=started)
+    index = get_corpus_index(paths.corpus)
+    added = [doc for doc in index.documents if Path(doc.path).name in status["documents"]]
+    new_grams: set[int] = set()
+    for document in added:
+        positions = index.positions(document)
+        if positions is not None:
+            new_grams.update(gram for gram in positions.grams if not index.is_stopgram(gram))
+    sources = {document.path for document in added}
+    scans = _stored_scans(paths, status["collection"]) if new_grams else []
+    status["scans_total"] = len(scans)
+    status_path = _status_path(status["job_id"], paths.uploads)
+    _write_json(status_path, status)
+
+    last_write = time.monotonic()
+    for scan_id, summary in scans:
+        # Only scans sharing n-grams with the new documents can change.
+        if _may_share(paths, scan_id, new_grams):
+            try:
+                positions = _load_positions(paths, scan_id)
+            except (OSError, ValueError) as exc:
+                logger.info("Re-score skipped scan %s: %s", scan_id, exc)
+            else:
+                if not new_grams.isdisjoint(positions.grams):
+                    status["scans_updated"] += _rescore(
+                        paths, scan_id, summary, positions, sources
+                    )
+        status["scans_checked"] += 1
+        elapsed = time.time() - started
+        if elapsed:
+            status["scans_per_second"] = round(status["scans_checked"] / elapsed, 2)
+        if time.monotonic() - last_write >= PROGRESS_INTERVAL:
+            _write_json(status_path, status)
+            last_write = time.monotonic()
+    status.update(status="done", finished_at=time.time())
+    _write_json(status_path, status)
+    logger.info(
+        "Re-score job %s: %d of %d scans updated for %s",
+        status["job_id"],
+        status["scans_updated"],
+        status["scans_total"],
+        ", ".join(status["documents"]),
+    )
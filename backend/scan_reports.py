@@ -0,0 +1,100 @@
+"""Annotated scan PDFs, rendered on first request.
+
+Most students only read the JSON report, so ``/scan`` keeps the encrypted
+upload and the matched gram hashes instead of annotating the PDF up front.
+The first request for the PDF renders it from those, encrypts it and drops
+the gram hashes; an ``flock`` on the stored upload makes concurrent first
+requests (from any worker process) render it once. The upload is kept so a
+re-scored scan (see :mod:`backend.rescore_jobs`) can be rendered again.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from backend import config
+from backend.crypto_storage import decrypt_to_temp, encrypt_file_in_place
+from backend.logging_config import get_logger
+from plag_system.checker import (
+    annotate_near_duplicate,
+    annotate_pdf,
+    is_corpus_copy,
+    read_matched_grams,
+)
+
+logger = get_logger()
+
+SCAN_ID_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+# Files a scan may keep in the uploads directory, ``scan_<id><suffix>``.
+SCAN_SUFFIXES = (".upload", ".grams", ".pos", ".bloom", ".json", ".pdf")
+# Serialises renders within a process where flock is unavailable.
+_RENDER_LOCK = threading.Lock()
+
+
+def scan_path(scan_id: str, suffix: str) -> str:
+    """Return the path of one of a scan's files in the uploads directory."""
+    return os.path.join(config.UPLOAD_DIR, f"scan_{scan_id}{suffix}")
+
+
+def _near_duplicate(scan_id: str) -> dict | None:
+    try:
+        with open(scan_path(scan_id, ".json"), "r", encoding="utf-8") as summary_handle:
+            return json.load(summary_handle).get("near_duplicate")
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _render(scan_id: str, pdf_path: str) -> None:
+    upload_path = grams_path = temp_path = None
+    try:
+        upload_path = decrypt_to_temp(scan_path(scan_id, ".upload"))
+        grams_path = decrypt_to_temp(scan_path(scan_id, ".grams"), suffix=".grams")
+        fd, temp_path = tempfile.mkstemp(dir=config.UPLOAD_DIR, suffix=".tmp")
+        os.close(fd)
+        near_duplicate = _near_duplicate(scan_id)
+        if is_corpus_copy(near_duplicate):
+            annotate_near_duplicate(upload_path, near_duplicate, temp_path)
+        else:
+            annotate_pdf(upload_path, output_path=temp_path, matched=read_matched_grams(grams_path))
+        encrypt_file_in_place(temp_path)
+        os.replace(temp_path, pdf_path)
+    finally:
+        for path in (upload_path, grams_path, temp_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+
+def annotated_scan_pdf(scan_id: str) -> str | None:
+    """Return the encrypted annotated PDF of a scan, rendering it if needed.
+
+    Returns None for unknown scans.
+    """
+    if not SCAN_ID_PATTERN.match(scan_id):
+        return None
+    pdf_path = scan_path(scan_id, ".pdf")
+    if os.path.exists(pdf_path):
+        return pdf_path
+    upload_path = scan_path(scan_id, ".upload")
+    try:
+        upload_handle = open(upload_path, "rb")  # pylint: disable=consider-using-with
+    except FileNotFoundError:
+        # Another request may have just finished rendering it.
+        return pdf_path if os.path.exists(pdf_path) else None
+    with upload_handle, _RENDER_LOCK if fcntl is None else contextlib.nullcontext():
+        if fcntl is not None:
+            fcntl.flock(upload_handle.fileno(), fcntl.LOCK_EX)
+        if not os.path.exists(pdf_path):
+            _render(scan_id, pdf_path)
+            logger.info("Rendered annotated PDF for scan %s", scan_id)
+            if os.path.exists(scan_path(scan_id, ".grams")):
+                os.remove(scan_path(scan_id, ".grams"))
+    return pdf_path
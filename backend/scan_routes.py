@@ -8,11 +8,18 @@ import tempfile
 from flask import Blueprint, jsonify, request
 from werkzeug.utils import secure_filename
 
-from backend import config
+from backend import config, metrics
+from backend.corpus_collections import resolve_collections
 from backend.crypto_storage import encrypt_file_in_place
 from backend.file_response import send_decrypted_pdf
 from backend.logging_config import get_logger
-from plag_system.checker import analyze_and_sign
+from backend.request_utils import verified_form_user
+from backend.rescore_jobs import write_gram_filter
+from backend.scan_reports import SCAN_SUFFIXES, annotated_scan_pdf, scan_path
+from plag_system.checker import DEFAULT_RANKING_METRIC, analyze_and_sign, record_submission
+from plag_system.positions import read_positions
+from plag_system.sharding import ShardUnavailableError
+from plag_system.timings import StageTimings
 
 scan_bp = Blueprint("scan", __name__)
 logger = get_logger()
@@ -35,6 +42,17 @@ def scan():
     if uploaded.mimetype not in ("application/pdf", "application/x-pdf"):
         logger.info("Scan failed: invalid mimetype (%s)", uploaded.mimetype)
         return jsonify({"error": "Invalid file type"}), 400
+    # Optional collections to compare against, repeated or comma-separated.
+    collections = [
+        name.strip()
+        for value in request.form.getlist("collections")
+        for name in value.split(",")
+        if name.strip()
+    ]
+    collection_dirs, message = resolve_collections(collections)
+    if message:
+        logger.info("Scan failed: %s", message)
+        return jsonify({"error": message}), 400
 
     filename = secure_filename(uploaded.filename)
     with tempfile.NamedTemporaryFile(
@@ -46,14 +64,53 @@ def scan():
         temp_path = temp_file.name
 
     scan_id = os.urandom(8).hex()
-    annotated_path = os.path.join(config.UPLOAD_DIR, f"scan_{scan_id}.pdf")
-    summary_path = os.path.join(config.UPLOAD_DIR, f"scan_{scan_id}.json")
+    timings = StageTimings()
+    # Only verified credentials may claim earlier submissions as the uploader's own.
+    submitter = verified_form_user()
+    grams_path = scan_path(scan_id, ".grams")
+    positions_path = scan_path(scan_id, ".pos")
     try:
-        report = analyze_and_sign(temp_path, annotated_pdf_path=annotated_path)
-        encrypt_file_in_place(annotated_path)
+        # The annotated PDF is rendered from these on first request.
+        report = analyze_and_sign(
+            temp_path,
+            corpus_dir=config.CORPUS_DIR,
+            key_dir=config.SIGNING_KEY_DIR,
+            submission_id=scan_id,
+            # Who submitted it, so their own later drafts are not flagged as copies.
+            submitter=submitter,
+            metric=request.form.get("metric", DEFAULT_RANKING_METRIC),
+            matched_grams_path=grams_path,
+            collection_dirs=collection_dirs or None,
+            # Kept so the scan can be re-scored when the corpus grows.
+            positions_path=positions_path,
+            timings=timings,
+            # Recorded below, once the scan is stored.
+            record=False,
+        )
+        positions = read_positions(positions_path)
+        with timings.stage("storage"):
+            write_gram_filter(positions, scan_path(scan_id, ".bloom"))
+        upload_path = scan_path(scan_id, ".upload")
+        with timings.stage("encryption"):
+            os.replace(temp_path, upload_path)
+            for path in (grams_path, positions_path, upload_path):
+                timings.count("bytes_encrypted", os.path.getsize(path))
+                encrypt_file_in_place(path)
+        with open(scan_path(scan_id, ".json"), "w", encoding="utf-8") as summary_handle:
+            json.dump(_summary(scan_id, filename, report, collections), summary_handle)
+        record_submission(config.CORPUS_DIR, scan_id, positions, submitter)
     except ValueError as exc:
         logger.info("Scan failed: %s", exc)
+        _remove_scan_files(scan_id)
         return jsonify({"error": str(exc)}), 400
+    except ShardUnavailableError as exc:
+        logger.warning("Scan failed: %s", exc)
+        _remove_scan_files(scan_id)
+        return jsonify({"error": "Corpus shards are unavailable"}), 503
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Scan failed: %s", filename)
+        _remove_scan_files(scan_id)
+        return jsonify({"error": "Scan failed"}), 500
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
@@ -61,28 +118,51 @@ def scan():
     response = dict(report)
     base_url = request.host_url.rstrip("/")
     response["pdf_url"] = f"{base_url}/scan/{scan_id}/pdf"
-    logger.info("Scan success: %s", filename)
-    summary = {
+    response["collections"] = collections
+    # Not part of the signed report; opt in with the form field or PLAG_SCAN_TIMINGS.
+    if config.SCAN_TIMINGS or request.form.get("timings", "") in ("1", "true"):
+        response["timings"] = timings.to_json()
+    logger.info("Scan success: %s", filename, extra={"timings": timings.to_json()})
+    for stage, seconds in timings.stages.items():
+        metrics.SCAN_STAGE_SECONDS.observe(seconds, stage=stage)
+    return jsonify(response)
+
+
+def _summary(scan_id: str, filename: str, report: dict, collections: list[str]) -> dict:
+    """The stored summary of a scan, read by the listings, re-scoring and highlights."""
+    return {
         "scan_id": scan_id,
         "file": filename,
         "matching_sentences": report.get("matching_sentences"),
         "total_sentences": report.get("total_sentences"),
         "plagiarism_percentage": report.get("plagiarism_percentage"),
+        "near_duplicate": report.get("near_duplicate"),
+        "collections": collections,
+        # Source spans of the matched passages, for highlighted source copies.
+        "sources": {
+            os.path.basename(match["path"]): [
+                [passage["source"]["start"], passage["source"]["end"]]
+                for passage in match["passages"]
+            ]
+            for match in report.get("matches", [])
+            if match.get("passages")
+        },
     }
-    try:
-        with open(summary_path, "w", encoding="utf-8") as summary_handle:
-            json.dump(summary, summary_handle)
-    except OSError:
-        logger.info("Scan summary write failed: %s", summary_path)
-    return jsonify(response)
+
+
+def _remove_scan_files(scan_id: str) -> None:
+    """Remove whatever a failed scan had stored, so no partial scan is left behind."""
+    for suffix in SCAN_SUFFIXES:
+        path = scan_path(scan_id, suffix)
+        if os.path.exists(path):
+            os.remove(path)
 
 
 @scan_bp.route("/scan/<scan_id>/pdf", methods=["GET"])
 def scan_pdf(scan_id: str):
-    """Serve annotated PDF for a completed scan."""
-    filename = f"scan_{scan_id}.pdf"
-    pdf_path = os.path.join(config.UPLOAD_DIR, filename)
-    if not os.path.exists(pdf_path):
+    """Serve annotated PDF for a completed scan, rendering it on first access."""
+    pdf_path = annotated_scan_pdf(scan_id)
+    if pdf_path is None:
         logger.info("Scan PDF not found: %s", scan_id)
         return jsonify({"error": "Scan not found"}), 404
     return send_decrypted_pdf(pdf_path)
@@ -93,7 +173,7 @@ def upload_file(filename: str):
     """Serve uploaded scan PDF files."""
     if not filename.startswith("scan_") or not filename.endswith(".pdf"):
         return jsonify({"error": "Not found"}), 404
-    file_path = os.path.join(config.UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+    file_path = annotated_scan_pdf(filename[len("scan_") : -len(".pdf")])
+    if file_path is None:
         return jsonify({"error": "Not found"}), 404
     return send_decrypted_pdf(file_path)
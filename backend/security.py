@@ -37,6 +37,15 @@ def verify_admin(admin_username: str, admin_password: str) -> bool:
     return bcrypt.checkpw(admin_password.encode("utf-8"), stored_password)
 
 
+def verify_user(username: str, password: str) -> bool:
+    """Check credentials of a user of any role."""
+    users = load_users()
+    if username not in users:
+        return False
+    stored_password = users[username]["password"].encode("utf-8")
+    return bcrypt.checkpw(password.encode("utf-8"), stored_password)
+
+
 def verify_teacher(username: str, password: str) -> bool:
     """Check teacher credentials (or admin)."""
     users = load_users()
@@ -0,0 +1,369 @@
+"""Pre-fork multi-worker WSGI server.
+
+The master process binds the listening socket, creates the Flask app and
+loads the corpus index, then forks workers that inherit all of it
+copy-on-write. Each worker serves requests from a bounded thread pool.
+``SIGHUP`` reloads the corpus in the master and replaces the workers
+gracefully; ``SIGTERM``/``SIGINT`` shut everything down. Corpus changes are
+picked up by the workers' incremental index updates, and the master refreshes
+its own view periodically so respawned workers start warm. With
+``PLAG_CORPUS_WATCH=1`` the master also forks a corpus watcher process.
+
+The master never runs threads of its own besides the log writer, which
+forked children replace: the watcher lives in its own process and index
+compaction finishes before the master forks.
+"""
+from __future__ import annotations
+
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from backend import config, metrics
+from backend.logging_config import get_logger, stop_logging
+
+logger = get_logger()
+
+
+@dataclass
+class ServerOptions:
+    """Tunables for :class:`PreforkServer`."""
+    host: str = config.SERVER_HOST
+    port: int = config.SERVER_PORT
+    workers: int = config.SERVER_WORKERS
+    threads: int = config.SERVER_THREADS
+    timeout: float = config.SERVER_TIMEOUT
+    graceful_timeout: float = config.SERVER_GRACEFUL_TIMEOUT
+    reload_interval: float = config.CORPUS_RELOAD_INTERVAL
+    corpus_dir: str = config.CORPUS_DIR
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """WSGI server that handles connections on a fixed-size thread pool.
+
+    A worker stops accepting while all of its threads are busy, which leaves
+    pending connections in the shared backlog for idle workers to pick up.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        host: str,
+        port: int,
+        app,
+        threads: int,
+        timeout: float,
+        fd: int | None = None,
+    ) -> None:
+        handler = type(
+            "TimeoutRequestHandler",
+            (WSGIRequestHandler,),
+            # HTTP/1.0 closes each connection so idle keep-alives never pin a thread.
+            {"timeout": timeout, "protocol_version": "HTTP/1.0"},
+        )
+        self._pool: ThreadPoolExecutor | None = None
+        # The base initialiser calls server_close() on its own socket when given an fd.
+        super().__init__(host, port, app, handler=handler, fd=fd)
+        self._slots = threading.BoundedSemaphore(max(threads, 1))
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(threads, 1),
+            thread_name_prefix="plag-request",
+        )
+
+    def get_request(self):
+        self._slots.acquire()  # pylint: disable=consider-using-with
+        try:
+            return super().get_request()
+        except OSError:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pylint: disable=broad-except
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        super().server_close()
+
+
+def _preload_corpus(corpus_dir: str) -> None:
+    """Load corpus fingerprints so forked workers share them."""
+    # pylint: disable=import-outside-toplevel
+    from plag_system.corpus_index import preload_corpus_index
+
+    try:
+        preload_corpus_index(corpus_dir)
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.info("Corpus preload failed, workers will load lazily: %s", exc)
+
+
+def _start_watcher(corpus_dir: str, thread: bool = True):
+    # pylint: disable=import-outside-toplevel
+    from backend.corpus_watcher import start_corpus_watcher
+
+    return start_corpus_watcher(corpus_dir, thread=thread)
+
+
+def _corpus_signature(corpus_dir: str):
+    # pylint: disable=import-outside-toplevel
+    from plag_system.corpus_index import corpus_signature
+
+    return corpus_signature(corpus_dir)
+
+
+class PreforkServer:
+    """Master process that supervises a generation of forked workers."""
+
+    def __init__(self, app_factory: Callable, options: ServerOptions | None = None) -> None:
+        self.app_factory = app_factory
+        self.options = options or ServerOptions()
+        self.app = None
+        self.socket: socket.socket | None = None
+        self.workers: dict[int, int] = {}
+        self.watcher = None
+        self.watcher_pid: int | None = None
+        self.generation = 0
+        self._signals: list[int] = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._corpus_signature = None
+
+    # -- master -----------------------------------------------------------
+
+    def run(self) -> None:
+        """Bind, preload, fork workers and supervise them until shutdown."""
+        self.socket = socket.create_server(
+            (self.options.host, self.options.port),
+            backlog=128,
+        )
+        self.socket.setblocking(False)
+        metrics.reset()
+        self.app = self.app_factory()
+        self._load_corpus()
+        # One process watches the corpus; a thread in the master would be forked mid-update.
+        self.watcher = _start_watcher(self.options.corpus_dir, thread=False)
+        self._install_master_signals()
+        if self.watcher is not None:
+            self._spawn_watcher()
+        logger.info(
+            "Serving on %s:%s with %d workers x %d threads",
+            self.options.host,
+            self.options.port,
+            self.options.workers,
+            self.options.threads,
+        )
+        self._spawn_generation()
+        try:
+            self._supervise()
+        finally:
+            stopping = list(self.workers)
+            if self.watcher_pid is not None:
+                stopping.append(self.watcher_pid)
+            self._stop_workers(stopping, self.options.graceful_timeout)
+            self.socket.close()
+            metrics.reset()
+
+    def _load_corpus(self) -> None:
+        _preload_corpus(self.options.corpus_dir)
+        self._corpus_signature = _corpus_signature(self.options.corpus_dir)
+
+    def _install_master_signals(self) -> None:
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._queue_signal)
+
+    def _queue_signal(self, signum, _frame) -> None:
+        self._signals.append(signum)
+        try:
+            os.write(self._wakeup_w, b"!")
+        except OSError:
+            pass
+
+    def _supervise(self) -> None:
+        last_check = time.monotonic()
+        metrics.sample_process(role="master")
+        while True:
+            timeout = self.options.reload_interval or 5.0
+            try:
+                ready, _, _ = select.select([self._wakeup_r], [], [], timeout)
+            except InterruptedError:
+                ready = []
+            if ready:
+                os.read(self._wakeup_r, 1024)
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    logger.info("Shutting down workers")
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload("SIGHUP")
+            self._reap_workers()
+            metrics.sample_process(role="master")
+            if self.options.reload_interval and (
+                time.monotonic() - last_check >= self.options.reload_interval
+            ):
+                last_check = time.monotonic()
+                if _corpus_signature(self.options.corpus_dir) != self._corpus_signature:
+                    # Workers apply index updates themselves; refreshing the
+                    # master's view keeps respawned workers warm.
+                    self._load_corpus()
+
+    def reload(self, reason: str) -> None:
+        """Reload corpus state and gracefully replace every worker."""
+        logger.info("Reloading workers: %s", reason)
+        old_workers = list(self.workers)
+        self._load_corpus()
+        self._spawn_generation()
+        self._stop_workers(old_workers, self.options.graceful_timeout)
+
+    def _spawn_generation(self) -> None:
+        self.generation += 1
+        for _ in range(self.options.workers):
+            self._spawn_worker()
+
+    def _spawn_worker(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_worker()
+            except BaseException:  # pylint: disable=broad-except
+                logger.exception("Worker %s crashed", os.getpid())
+                exit_code = 1
+            finally:
+                stop_logging()
+                os._exit(exit_code)  # pylint: disable=protected-access
+        self.workers[pid] = self.generation
+
+    def _spawn_watcher(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_watcher()
+            except BaseException:  # pylint: disable=broad-except
+                logger.exception("Corpus watcher %s crashed", os.getpid())
+                exit_code = 1
+            finally:
+                stop_logging()
+                os._exit(exit_code)  # pylint: disable=protected-access
+        self.watcher_pid = pid
+
+    def _reap_workers(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid == self.watcher_pid:
+                logger.info("Corpus watcher %s exited (status %s), respawning", pid, status)
+                self._spawn_watcher()
+                continue
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation:
+                logger.info("Worker %s exited (status %s), respawning", pid, status)
+                self._spawn_worker()
+
+    def _stop_workers(self, pids: list[int], graceful_timeout: float) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.workers.pop(pid, None)
+        deadline = time.monotonic() + graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    remaining.discard(pid)
+                    self.workers.pop(pid, None)
+            time.sleep(0.05)
+        for pid in remaining:
+            logger.info("Worker %s did not stop in time, killing", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.workers.pop(pid, None)
+
+    # -- children ---------------------------------------------------------
+
+    def _reset_child_signals(self) -> None:
+        for signum in (signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _run_watcher(self) -> None:
+        self._reset_child_signals()
+        self.socket.close()
+        signal.signal(signal.SIGTERM, lambda _signum, _frame: self.watcher.stop())
+        self.watcher.run()
+
+    def _run_worker(self) -> None:
+        self._reset_child_signals()
+        server = PooledWSGIServer(
+            self.options.host,
+            self.options.port,
+            self.app,
+            threads=self.options.threads,
+            timeout=self.options.timeout,
+            fd=self.socket.fileno(),
+        )
+        server.socket.setblocking(False)
+
+        def _graceful_stop(_signum, _frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, _graceful_stop)
+        metrics.start_sampler()
+        server.serve_forever(poll_interval=0.5)
+
+
+def serve(app_factory: Callable, options: ServerOptions | None = None) -> None:
+    """Run the app with pre-forked workers (threads only where fork is unavailable)."""
+    options = options or ServerOptions()
+    if not hasattr(os, "fork") or options.workers < 1:
+        metrics.reset()
+        _preload_corpus(options.corpus_dir)
+        _start_watcher(options.corpus_dir)
+        server = PooledWSGIServer(
+            options.host,
+            options.port,
+            app_factory(),
+            threads=options.threads,
+            timeout=options.timeout,
+        )
+        metrics.start_sampler()
+        try:
+            server.serve_forever()
+        finally:
+            metrics.reset()
+        return
+    PreforkServer(app_factory, options).run()
@@ -0,0 +1,107 @@
+"""Corpus PDFs with the passages matched by one scan highlighted.
+
+A scan's summary records the source character spans of its matched
+passages. The first request for a (scan, source) pair looks the source up
+in the corpus index (or, with ``PLAG_SHARDS``, asks the shard servers for
+it), draws the word boxes stored with its positions onto the PDF and keeps
+the encrypted result, so later requests only decrypt it.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from backend import config
+from backend.corpus_collections import resolve_collections
+from backend.crypto_storage import MAGIC, decrypt_to_temp, encrypt_file_in_place
+from backend.logging_config import get_logger
+from backend.scan_reports import SCAN_ID_PATTERN, scan_path
+from plag_system.checker import annotate_source_pdf
+from plag_system.corpus_index import get_corpus_index
+from plag_system.positions import TokenPositions
+from plag_system.sharding import ShardUnavailableError, configured_shards, shard_positions
+
+logger = get_logger()
+
+
+class SourceHighlightError(Exception):
+    """Raised when a highlighted source cannot be produced; carries an HTTP status."""
+
+    def __init__(self, message: str, status: int = 404) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def _scan_passages(scan_id: str, source: str) -> tuple[list[tuple[int, int]], list[str]]:
+    if not SCAN_ID_PATTERN.match(scan_id):
+        raise SourceHighlightError("Scan not found")
+    try:
+        with open(scan_path(scan_id, ".json"), "r", encoding="utf-8") as summary_handle:
+            summary = json.load(summary_handle)
+    except (OSError, json.JSONDecodeError) as exc:
+        raise SourceHighlightError("Scan not found") from exc
+    spans = (summary.get("sources") or {}).get(source)
+    if not spans:
+        raise SourceHighlightError("Source not matched by this scan")
+    return [(int(start), int(end)) for start, end in spans], summary.get("collections") or []
+
+
+def _cache_path(scan_id: str, source: str) -> str:
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(config.HIGHLIGHT_DIR, f"{scan_id}_{digest}.pdf")
+
+
+def _locate(source: str, collections: list[str]) -> tuple[str, TokenPositions | None]:
+    """Return the path of corpus file ``source`` and its stored word positions."""
+    # Scans restricted to collections matched sources from those collections.
+    corpus_dirs, _ = resolve_collections(collections)
+    shards = configured_shards()
+    if shards and not corpus_dirs:
+        # The scan matched the source through the shards, which keep its positions.
+        path = os.path.join(config.CORPUS_DIR, source)
+        if not os.path.exists(path):
+            raise SourceHighlightError("Source is no longer in the corpus")
+        try:
+            return path, shard_positions(shards, source)
+        except ShardUnavailableError as exc:
+            raise SourceHighlightError("Corpus shards are unavailable", 503) from exc
+    for corpus_dir in corpus_dirs or [config.CORPUS_DIR]:
+        index = get_corpus_index(corpus_dir)
+        document = next((doc for doc in index.documents if Path(doc.path).name == source), None)
+        if document is not None:
+            return document.path, index.positions(document)
+    raise SourceHighlightError("Source is no longer in the corpus")
+
+
+def highlighted_source(scan_id: str, source: str) -> str:
+    """Return the encrypted, highlighted copy of corpus file ``source`` for a scan."""
+    spans, collections = _scan_passages(scan_id, source)
+    cache_path = _cache_path(scan_id, source)
+    if os.path.exists(cache_path):
+        return cache_path
+
+    document_path, positions = _locate(source, collections)
+    if positions is None or positions.boxes is None:
+        raise SourceHighlightError("No stored word positions for this source", 409)
+
+    with open(document_path, "rb") as source_handle:
+        encrypted = source_handle.read(len(MAGIC)) == MAGIC
+    source_path = decrypt_to_temp(document_path) if encrypted else Path(document_path)
+    os.makedirs(config.HIGHLIGHT_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=config.HIGHLIGHT_DIR, suffix=".tmp")
+    os.close(fd)
+    try:
+        annotate_source_pdf(source_path, positions, spans, temp_path)
+        encrypt_file_in_place(temp_path)
+        # Concurrent renders of the same pair produce the same file.
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if encrypted and source_path.exists():
+            source_path.unlink()
+    logger.info("Rendered highlighted source %s for scan %s", source, scan_id)
+    return cache_path
@@ -3,10 +3,14 @@ from __future__ import annotations
 
 from flask import Blueprint, jsonify, request
 
-from backend.request_utils import get_json_body, require_teacher
+from backend.file_response import send_decrypted_pdf
+from backend.logging_config import get_logger
+from backend.request_utils import get_json_body, require_teacher, require_teacher_query
+from backend.source_highlights import SourceHighlightError, highlighted_source
 from backend.uploads import list_scan_uploads
 
 teacher_bp = Blueprint("teacher", __name__)
+logger = get_logger()
 
 
 @teacher_bp.route("/teacher/uploads", methods=["POST"])
@@ -20,3 +24,17 @@ def teacher_uploads():
         return error
 
     return jsonify({"files": list_scan_uploads(request, include_summary=True)})
+
+
+@teacher_bp.route("/teacher/scan/<scan_id>/source/<source>", methods=["GET"])
+def teacher_scan_source(scan_id: str, source: str):
+    """Serve a corpus PDF with the passages a scan matched highlighted."""
+    _, error = require_teacher_query()
+    if error:
+        return error
+    try:
+        pdf_path = highlighted_source(scan_id, source)
+    except SourceHighlightError as exc:
+        logger.info("Highlighted source unavailable (%s, %s): %s", scan_id, source, exc)
+        return jsonify({"error": str(exc)}), exc.status
+    return send_decrypted_pdf(pdf_path)
@@ -1,19 +1,34 @@
 """
 Unit tests for the authentication module.
 """
+import io
 import json
+import logging
 import os
+import subprocess
 import sys
 import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
 import pytest
+from reportlab.pdfgen import canvas
 
 # Add parent directory to path to allow imports
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # pylint: disable=wrong-import-position,import-error
+from backend import metrics
 from backend.app import create_app
 from backend.ca import generate_certificate
-from backend.users import load_users
+from backend.corpus_watcher import CorpusWatcher
+from backend.crypto_storage import MAGIC, decrypt_to_temp
+from backend.logging_config import JsonLinesFormatter
+from backend.server import PooledWSGIServer
+from backend.source_highlights import SourceHighlightError, highlighted_source
+from backend.users import create_user, load_users
+from benchmarks.load_test import LoadTest, parse_mix
 
 
 @pytest.fixture(name='test_client')
@@ -25,6 +40,17 @@ def fixture_client():
         yield client
 
 
+@pytest.fixture(name='metrics_dir', autouse=True)
+def fixture_metrics_dir(monkeypatch, tmp_path):
+    """Keep the metric files of each test, and of servers it starts, in a temp dir."""
+    # pylint: disable=import-outside-toplevel
+    import backend.config as config_module
+    metrics_dir = str(tmp_path / 'metrics')
+    monkeypatch.setattr(config_module, 'METRICS_DIR', metrics_dir)
+    monkeypatch.setenv('PLAG_METRICS_DIR', metrics_dir)
+    return metrics_dir
+
+
 @pytest.fixture(name='users_file')
 def fixture_temp_users_file():
     """Create a temporary users file for testing."""
@@ -200,6 +226,637 @@ class TestCors:
         assert response.headers.get('Access-Control-Allow-Origin') == '*'
 
 
+class TestLogging:
+    """Tests for queued, structured request logging."""
+
+    def test_request_id_header_generated(self, test_client):
+        """Every response should carry a request id."""
+        response = test_client.options('/signup')
+        assert response.headers.get('X-Request-ID')
+
+    def test_request_id_header_echoed(self, test_client):
+        """A well-formed incoming request id should be reused."""
+        response = test_client.options('/signup', headers={'X-Request-ID': 'abc-123'})
+        assert response.headers.get('X-Request-ID') == 'abc-123'
+
+    def test_json_formatter_includes_request_fields(self):
+        """JSON lines should include request id and timing fields."""
+        record = logging.LogRecord(
+            'plag_checker', logging.INFO, __file__, 1, 'Scan success: %s', ('a.pdf',), None
+        )
+        record.request_id = 'req-1'
+        record.elapsed_ms = 12.5
+        payload = json.loads(JsonLinesFormatter().format(record))
+        assert payload['message'] == 'Scan success: a.pdf'
+        assert payload['request_id'] == 'req-1'
+        assert payload['elapsed_ms'] == 12.5
+        assert payload['level'] == 'INFO'
+
+
+class TestPooledServer:
+    """Tests for the worker-side WSGI server."""
+
+    def test_serves_requests_from_pool(self):
+        """The pooled server should answer requests and shut down cleanly."""
+        server = PooledWSGIServer('127.0.0.1', 0, create_app(), threads=2, timeout=5)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            request = urllib.request.Request(
+                f'http://127.0.0.1:{server.port}/signup', method='OPTIONS'
+            )
+            with urllib.request.urlopen(request, timeout=5) as response:  # nosec B310
+                assert response.status == 200
+                assert response.headers.get('X-Request-ID')
+        finally:
+            server.shutdown()
+            thread.join(timeout=5)
+        assert not thread.is_alive()
+
+
+class TestLoadTest:
+    """Tests for the deadline load-test harness."""
+
+    def test_reports_latency_errors_and_rss_per_endpoint(self, users_file):
+        """Clients should replay the mix and the report should cover each endpoint."""
+        # pylint: disable=unused-argument
+        create_user('load_student', 'Student-pass-123', 'student')
+        create_user('load_teacher', 'Teacher-pass-123', 'teacher')
+        server = PooledWSGIServer('127.0.0.1', 0, create_app(), threads=2, timeout=5)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            test = LoadTest(
+                f'http://127.0.0.1:{server.port}',
+                parse_mix('login=1,teacher_uploads=1'),
+                [],
+                ('load_student', 'Student-pass-123'),
+                ('load_teacher', 'Wrong-pass-123'),
+                server_pid=os.getpid(),
+            )
+            report = test.run(clients=2, duration=1, ramp=0)
+        finally:
+            server.shutdown()
+            thread.join(timeout=5)
+
+        login = report['endpoints']['login']
+        assert login['requests'] and login['errors'] == 0
+        assert login['p50_ms'] <= login['p95_ms'] <= login['p99_ms']
+        teacher = report['endpoints']['teacher_uploads']
+        assert teacher['error_rate'] == 1.0
+        assert report['peak_rss_mb'] > 0
+        with pytest.raises(ValueError):
+            parse_mix('login=1,upload=2')
+
+
+class TestCorpusWatcher:
+    """Tests for batching out-of-band corpus changes."""
+
+    @staticmethod
+    def _write_pdf(path, content):
+        canvas_obj = canvas.Canvas(str(path))
+        canvas_obj.drawString(72, 720, content)
+        canvas_obj.save()
+
+    def test_bulk_copy_becomes_one_encrypted_update(self):
+        """Dropped PDFs should be encrypted and indexed in a single batch."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus_dir = Path(tmpdir)
+            self._write_pdf(corpus_dir / 'first.pdf', 'the first corpus document text')
+            watcher = CorpusWatcher(str(corpus_dir), debounce=60, max_delay=600)
+            watcher.prime()
+            watcher.flush()
+            assert (corpus_dir / 'first.pdf').read_bytes().startswith(MAGIC)
+
+            for number in range(3):
+                self._write_pdf(corpus_dir / f'bulk{number}.pdf', f'bulk document number {number}')
+            assert watcher.poll() == 3
+            assert not watcher.due()
+            assert watcher.due(now=time.monotonic() + 61)
+            added, removed = watcher.flush()
+            assert added == ['bulk0.pdf', 'bulk1.pdf', 'bulk2.pdf']
+            assert not removed
+            assert all(
+                (corpus_dir / name).read_bytes().startswith(MAGIC) for name in added
+            )
+            # Encrypting in place must not look like another change.
+            assert watcher.poll() == 0
+
+            (corpus_dir / 'bulk1.pdf').unlink()
+            os.utime(corpus_dir / 'bulk2.pdf', ns=(1, 1))
+            assert watcher.poll() == 2
+            added, removed = watcher.flush()
+            assert not added
+            assert removed == ['bulk1.pdf']
+
+
+class TestStartup:
+    """Tests for the cost of importing the app."""
+
+    def test_app_import_defers_pdf_and_crypto_libraries(self):
+        """Worker boot does not load the PDF and crypto libraries."""
+        code = (
+            "import sys, backend.app; "
+            "print(sorted({name.split('.')[0] for name in sys.modules} & "
+            "{'pdfplumber', 'PyPDF2', 'reportlab', 'cryptography'}))"
+        )
+        root = Path(__file__).resolve().parents[1]
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == '[]'
+
+
+class TestLazyScanPdf:
+    """Tests for rendering the annotated scan PDF on first request."""
+
+    def test_scan_defers_annotation_until_pdf_is_requested(self, test_client, monkeypatch):
+        """The scan keeps its inputs; the first PDF request renders and caches it."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            buffer = io.BytesIO()
+            canvas_obj = canvas.Canvas(buffer)
+            canvas_obj.drawString(72, 720, 'a short essay about threat modelling')
+            canvas_obj.save()
+            buffer.seek(0)
+            response = test_client.post(
+                '/scan',
+                data={'file': (buffer, 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 200
+            scan_id = response.get_json()['pdf_url'].rsplit('/', 2)[-2]
+            pending = sorted(os.listdir(tmpdir))
+            assert pending == [
+                f'scan_{scan_id}.{ext}' for ext in ('bloom', 'grams', 'json', 'pos', 'upload')
+            ]
+
+            response = test_client.get(f'/scan/{scan_id}/pdf')
+            assert response.status_code == 200
+            assert response.data.startswith(b'%PDF')
+            assert sorted(os.listdir(tmpdir)) == [
+                f'scan_{scan_id}.{ext}' for ext in ('bloom', 'json', 'pdf', 'pos', 'upload')
+            ]
+            assert Path(tmpdir, f'scan_{scan_id}.pdf').read_bytes().startswith(MAGIC)
+            assert test_client.get(f'/uploads/scan_{scan_id}.pdf').status_code == 200
+            assert test_client.get('/scan/0000000000000000/pdf').status_code == 404
+
+
+    def test_failed_render_leaves_no_plaintext_temp(self, test_client, monkeypatch):
+        """A render that fails part-way removes the decrypted upload it already wrote."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        from backend.scan_reports import annotated_scan_pdf, scan_path
+        with tempfile.TemporaryDirectory() as tmpdir:
+            upload_dir = Path(tmpdir) / 'uploads'
+            upload_dir.mkdir()
+            temp_dir = Path(tmpdir) / 'tmp'
+            temp_dir.mkdir()
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', str(upload_dir))
+            text = 'a short essay about threat modelling and attack trees'
+            response = test_client.post(
+                '/scan',
+                data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            scan_id = response.get_json()['pdf_url'].rsplit('/', 2)[-2]
+            os.remove(scan_path(scan_id, '.grams'))
+            monkeypatch.setattr(tempfile, 'tempdir', str(temp_dir))
+            with pytest.raises(FileNotFoundError):
+                annotated_scan_pdf(scan_id)
+            assert not os.listdir(temp_dir)
+            assert not list(upload_dir.glob('*.tmp'))
+
+
+class TestScanFailures:
+    """Tests for scans that fail part-way through."""
+
+    def test_failed_scan_leaves_no_files_or_fingerprint(self, test_client, monkeypatch):
+        """A failure after analysis removes every stored file and records no submission."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        import backend.scan_routes as scan_routes_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus_dir = Path(tmpdir) / 'corpus'
+            corpus_dir.mkdir()
+            upload_dir = Path(tmpdir) / 'uploads'
+            upload_dir.mkdir()
+            monkeypatch.setattr(config_module, 'CORPUS_DIR', str(corpus_dir))
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', str(upload_dir))
+
+            def _fail(_path):
+                raise OSError('disk full')
+
+            monkeypatch.setattr(scan_routes_module, 'encrypt_file_in_place', _fail)
+            text = 'a short essay about threat modelling and attack trees'
+            response = test_client.post(
+                '/scan',
+                data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 500
+            assert not os.listdir(upload_dir)
+            submissions = list(corpus_dir.rglob('submissions.jsonl'))
+            assert not any(path.read_text() for path in submissions)
+
+            monkeypatch.undo()
+            monkeypatch.setattr(config_module, 'CORPUS_DIR', str(corpus_dir))
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', str(upload_dir))
+            response = test_client.post(
+                '/scan',
+                data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 200
+            scan_id = response.get_json()['pdf_url'].rsplit('/', 2)[-2]
+            (submissions,) = corpus_dir.rglob('submissions.jsonl')
+            assert json.loads(submissions.read_text())['id'] == scan_id
+
+    def test_scan_without_shard_quorum_is_unavailable(self, test_client, monkeypatch):
+        """When no shard answers, /scan returns 503 instead of an empty report."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            monkeypatch.setenv('PLAG_SHARDS', f'unix:{tmpdir}/missing.sock')
+            text = 'a short essay about threat modelling and attack trees'
+            response = test_client.post(
+                '/scan',
+                data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 503
+            assert not os.listdir(tmpdir)
+
+
+class TestScanSubmitter:
+    """Tests for which uploader a scan is recorded under."""
+
+    def test_unverified_username_does_not_suppress_near_duplicate(
+        self, test_client, users_file, monkeypatch
+    ):
+        """Only a verified password lets a resubmission count as the uploader's own draft."""
+        # pylint: disable=import-outside-toplevel,unused-argument
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus_dir = Path(tmpdir) / 'corpus'
+            corpus_dir.mkdir()
+            monkeypatch.setattr(config_module, 'CORPUS_DIR', str(corpus_dir))
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            create_user('alice', 'Student-pass-123', 'student')
+            text = 'my essay explains photosynthesis in leaves using light and water'
+
+            def _scan(**form):
+                response = test_client.post(
+                    '/scan',
+                    data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf'), **form},
+                    content_type='multipart/form-data',
+                )
+                assert response.status_code == 200
+                return response.get_json()['near_duplicate']
+
+            assert _scan(username='alice', password='Student-pass-123') is None
+            assert _scan(username='alice')['kind'] == 'submission'
+            assert _scan(username='alice', password='wrong-pass')['kind'] == 'submission'
+
+
+class TestScanTimings:
+    """Tests for the per-stage timings of a scan."""
+
+    def test_timings_are_returned_only_on_request(self, test_client, monkeypatch):
+        """The response carries stage timings when asked, the signed report never does."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            responses = []
+            for form in ({}, {'timings': '1'}):
+                buffer = io.BytesIO()
+                canvas_obj = canvas.Canvas(buffer)
+                canvas_obj.drawString(72, 720, 'a short essay about threat modelling')
+                canvas_obj.save()
+                buffer.seek(0)
+                response = test_client.post(
+                    '/scan',
+                    data={**form, 'file': (buffer, 'essay.pdf', 'application/pdf')},
+                    content_type='multipart/form-data',
+                )
+                assert response.status_code == 200
+                responses.append(response.get_json())
+
+        assert 'timings' not in responses[0]
+        timings = responses[1]['timings']
+        assert {'extraction', 'comparison', 'signing', 'encryption'} <= set(timings['stages_ms'])
+        assert timings['pages'] == 1
+        assert timings['bytes_encrypted'] > timings['bytes_processed'] > 0
+
+
+class TestMetrics:
+    """Tests for the Prometheus /metrics endpoint."""
+
+    def test_metrics_report_requests_per_endpoint(self, test_client, monkeypatch):
+        """Request counts and latency histograms are exposed in the text format."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        test_client.post('/login', json={'username': 'nobody', 'password': 'wrong'})
+
+        response = test_client.get('/metrics')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain; version=0.0.4')
+        lines = response.get_data(as_text=True).splitlines()
+        assert (
+            'plag_http_requests_total{endpoint="auth.login",method="POST",status="401"} 1'
+            in lines
+        )
+        assert 'plag_http_request_duration_seconds_count{endpoint="auth.login"} 1' in lines
+        assert (
+            'plag_http_request_duration_seconds_bucket{endpoint="auth.login",le="+Inf"} 1'
+            in lines
+        )
+        assert '# TYPE plag_scan_stage_duration_seconds histogram' in lines
+        assert any(line.startswith('plag_process_resident_memory_bytes{') for line in lines)
+
+        monkeypatch.setattr(config_module, 'METRICS_ENABLED', False)
+        assert test_client.get('/metrics').status_code == 404
+
+    def test_processes_are_sampled_on_a_timer(self, test_client, monkeypatch):
+        """Requests never sample the process; scrapes and the sampler thread do."""
+        calls = []
+        monkeypatch.setattr(metrics, 'sample_process', lambda role='worker': calls.append(role))
+        test_client.post('/login', json={'username': 'nobody', 'password': 'wrong'})
+        assert not calls
+        test_client.get('/metrics')
+        assert calls == ['worker']
+
+        stop = metrics.start_sampler(0.01)
+        deadline = time.monotonic() + 5
+        while len(calls) < 3:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        stop.set()
+
+    def test_samples_of_worker_processes_are_summed(self, metrics_dir):
+        """Counters of exited workers still count; their gauges do not."""
+        metrics.REQUESTS.inc(endpoint='scan.scan', method='POST', status=200)
+        metrics.IN_FLIGHT.inc()
+        pid = os.fork()
+        if pid == 0:
+            metrics.REQUESTS.inc(endpoint='scan.scan', method='POST', status=200)
+            metrics.IN_FLIGHT.inc(2)
+            os._exit(0)  # pylint: disable=protected-access
+        os.waitpid(pid, 0)
+
+        lines = metrics.render().splitlines()
+        assert len(os.listdir(metrics_dir)) == 2
+        assert (
+            'plag_http_requests_total{endpoint="scan.scan",method="POST",status="200"} 2'
+            in lines
+        )
+        assert 'plag_http_requests_in_flight 1' in lines
+        metrics.IN_FLIGHT.dec()
+
+    def test_reused_pid_starts_with_no_gauges(self, monkeypatch):
+        """A process reusing an exited worker's pid keeps its counts but not its gauges."""
+        metrics.REQUESTS.inc(endpoint='scan.scan', method='POST', status=200)
+        metrics.IN_FLIGHT.inc(3)
+        # The worker exits through os._exit and leaves its file behind.
+        monkeypatch.setitem(metrics._STATE, 'file', None)  # pylint: disable=protected-access
+
+        metrics.IN_FLIGHT.inc()
+        lines = metrics.render().splitlines()
+        assert (
+            'plag_http_requests_total{endpoint="scan.scan",method="POST",status="200"} 1'
+            in lines
+        )
+        assert 'plag_http_requests_in_flight 1' in lines
+        metrics.IN_FLIGHT.dec()
+
+
+class TestSourceHighlights:
+    """Tests for highlighting matched passages on corpus PDFs."""
+
+    def test_source_is_highlighted_from_stored_positions(self, monkeypatch):
+        """The first request renders and caches the highlighted copy."""
+        # pylint: disable=import-outside-toplevel
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus_dir = Path(tmpdir) / 'corpus'
+            upload_dir = Path(tmpdir) / 'uploads'
+            corpus_dir.mkdir()
+            upload_dir.mkdir()
+            canvas_obj = canvas.Canvas(str(corpus_dir / 'source.pdf'))
+            canvas_obj.drawString(72, 720, 'shared passage about rivers and mountains here')
+            canvas_obj.save()
+            monkeypatch.setattr(config_module, 'CORPUS_DIR', str(corpus_dir))
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', str(upload_dir))
+            monkeypatch.setattr(config_module, 'HIGHLIGHT_DIR', str(upload_dir / 'highlights'))
+            scan_id = '0123456789abcdef'
+            summary = {'scan_id': scan_id, 'sources': {'source.pdf': [[0, 14]]}}
+            (upload_dir / f'scan_{scan_id}.json').write_text(json.dumps(summary))
+
+            with pytest.raises(SourceHighlightError):
+                highlighted_source(scan_id, 'other.pdf')
+            cached = highlighted_source(scan_id, 'source.pdf')
+            assert Path(cached).read_bytes().startswith(MAGIC)
+            assert highlighted_source(scan_id, 'source.pdf') == cached
+            plain = decrypt_to_temp(cached)
+            try:
+                assert plain.read_bytes().startswith(b'%PDF')
+                assert plain.read_bytes() != (corpus_dir / 'source.pdf').read_bytes()
+            finally:
+                plain.unlink()
+
+
+class TestCorpusCollections:
+    """Tests for per-course corpus collections."""
+
+    @staticmethod
+    def _pdf(text):
+        buffer = io.BytesIO()
+        canvas_obj = canvas.Canvas(buffer)
+        canvas_obj.drawString(72, 720, text)
+        canvas_obj.save()
+        buffer.seek(0)
+        return buffer
+
+    def test_scan_only_consults_requested_collections(self, test_client, users_file, monkeypatch):
+        """Admins manage collections; a scan naming one is scored against it alone."""
+        # pylint: disable=import-outside-toplevel,unused-argument
+        import backend.config as config_module
+        with tempfile.TemporaryDirectory() as tmpdir:
+            monkeypatch.setattr(config_module, 'COLLECTIONS_DIR', tmpdir)
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            create_user('root', 'Admin-pass-123', 'admin')
+            admin = {'admin_username': 'root', 'admin_password': 'Admin-pass-123'}
+
+            for name in ('net-101', 'crypto-201'):
+                response = test_client.post(
+                    '/admin/collections/create', json={**admin, 'name': name}
+                )
+                assert response.status_code == 201
+            assert test_client.post(
+                '/admin/collections/create', json={**admin, 'name': '../corpus'}
+            ).status_code == 400
+            assert test_client.post(
+                '/admin/collections/create', json={**admin, 'name': 'net-101'}
+            ).status_code == 409
+            texts = {
+                'net-101': 'routers forward packets between networks using routing tables',
+                'crypto-201': 'block ciphers encrypt fixed size blocks with a secret key',
+            }
+            for name, text in texts.items():
+                response = test_client.post(
+                    '/admin/corpus/upload',
+                    data={**admin, 'collection': name, 'file': (self._pdf(text), f'{name}.pdf')},
+                    content_type='multipart/form-data',
+                )
+                assert response.status_code == 201
+            listing = test_client.post('/admin/collections/list', json=admin).get_json()
+            assert listing == {
+                'collections': [{'name': 'crypto-201', 'files': 1}, {'name': 'net-101', 'files': 1}]
+            }
+            files = test_client.post(
+                '/admin/corpus/list', json={**admin, 'collection': 'net-101'}
+            ).get_json()
+            assert files == {'files': ['net-101.pdf']}
+
+            essay = 'my essay: routers forward packets between networks and block ciphers encrypt'
+            response = test_client.post(
+                '/scan',
+                data={'file': (self._pdf(essay), 'essay.pdf', 'application/pdf'),
+                      'collections': 'net-101'},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 200
+            report = response.get_json()
+            assert report['collections'] == ['net-101']
+            assert [Path(match['path']).name for match in report['matches']] == ['net-101.pdf']
+
+            response = test_client.post(
+                '/scan',
+                data={'file': (self._pdf(essay), 'essay.pdf', 'application/pdf'),
+                      'collections': 'net-101,missing'},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 400
+            assert test_client.post(
+                '/admin/collections/delete', json={**admin, 'name': 'crypto-201'}
+            ).status_code == 200
+            assert not os.path.exists(os.path.join(tmpdir, 'crypto-201'))
+
+
+class TestRescoreJobs:
+    """Tests for re-scoring past scans after corpus additions."""
+
+    def test_corpus_upload_rescores_stored_scans(self, test_client, users_file, monkeypatch):
+        """A new corpus document updates the summaries of scans that share its passages."""
+        # pylint: disable=import-outside-toplevel,unused-argument
+        import backend.config as config_module
+        from backend import rescore_jobs
+        from backend.rescore_jobs import job_status
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus_dir = Path(tmpdir) / 'corpus'
+            corpus_dir.mkdir()
+            monkeypatch.setattr(config_module, 'CORPUS_DIR', str(corpus_dir))
+            monkeypatch.setattr(config_module, 'UPLOAD_DIR', tmpdir)
+            create_user('root', 'Admin-pass-123', 'admin')
+            admin = {'admin_username': 'root', 'admin_password': 'Admin-pass-123'}
+            text = 'glaciers carve deep valleys into the mountains over many thousands of years'
+            response = test_client.post(
+                '/scan',
+                data={'file': (TestCorpusCollections._pdf(text), 'essay.pdf', 'application/pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.get_json()['plagiarism_percentage'] == 0.0
+            scan_id = response.get_json()['pdf_url'].rsplit('/', 2)[-2]
+            response = test_client.post(
+                '/scan',
+                data={
+                    'file': (
+                        TestCorpusCollections._pdf('an unrelated note on baking sourdough bread'),
+                        'other.pdf',
+                        'application/pdf',
+                    )
+                },
+                content_type='multipart/form-data',
+            )
+            other_id = response.get_json()['pdf_url'].rsplit('/', 2)[-2]
+            assert test_client.get(f'/scan/{scan_id}/pdf').status_code == 200
+            highlights = Path(tmpdir) / 'highlights'
+            monkeypatch.setattr(config_module, 'HIGHLIGHT_DIR', str(highlights))
+            highlights.mkdir()
+            (highlights / f'{scan_id}_0123456789abcdef.pdf').write_bytes(b'stale')
+            decrypted = []
+            monkeypatch.setattr(
+                rescore_jobs, 'decrypt_to_temp',
+                lambda path, suffix='.pdf': decrypted.append(os.path.basename(path))
+                or decrypt_to_temp(path, suffix),
+            )
+
+            response = test_client.post(
+                '/admin/corpus/upload',
+                data={**admin, 'file': (TestCorpusCollections._pdf(text), 'glaciers.pdf')},
+                content_type='multipart/form-data',
+            )
+            assert response.status_code == 201
+            job_id = response.get_json()['rescore_job']
+            deadline = time.monotonic() + 30
+            while job_status(job_id)['status'] not in ('done', 'failed'):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            status = test_client.post(
+                '/admin/rescore/status', json={**admin, 'job_id': job_id}
+            ).get_json()
+            assert status['status'] == 'done'
+            assert (status['scans_total'], status['scans_checked'], status['scans_updated']) == (
+                2, 2, 1
+            )
+            summary = json.loads(Path(tmpdir, f'scan_{scan_id}.json').read_text())
+            assert summary['plagiarism_percentage'] == 100.0
+            assert summary['rescored']['new_sources'] == ['glaciers.pdf']
+            assert list(summary['sources']) == ['glaciers.pdf']
+            # The unrelated scan is ruled out by its gram filter without decryption.
+            assert decrypted == [f'scan_{scan_id}.pos']
+            assert not Path(tmpdir, f'scan_{other_id}.json').read_text().count('rescored')
+            # The stale annotated PDF is dropped and rendered again from the new matches.
+            assert not Path(tmpdir, f'scan_{scan_id}.pdf').exists()
+            assert not list(highlights.iterdir())
+            assert Path(tmpdir, f'scan_{scan_id}.grams').exists()
+            assert test_client.get(f'/scan/{scan_id}/pdf').status_code == 200
+            jobs = test_client.post('/admin/rescore/status', json=admin).get_json()['jobs']
+            assert [job['job_id'] for job in jobs] == [job_id]
+
+
+class TestCryptoStorage:
+    """Tests for the encrypted storage helpers."""
+
+    def test_concurrent_first_use_agrees_on_one_master_key(self, monkeypatch, tmp_path):
+        """Racing processes never overwrite each other's key or read a partial one."""
+        # pylint: disable=import-outside-toplevel,protected-access
+        import backend.config as config_module
+        from backend import crypto_storage
+        key_file = tmp_path / 'keys' / 'master.key'
+        monkeypatch.setattr(config_module, 'MASTER_KEY_FILE', str(key_file))
+        barrier = threading.Barrier(8)
+        keys = []
+
+        def _first_use():
+            barrier.wait()
+            keys.append(crypto_storage._ensure_master_key())
+
+        threads = [threading.Thread(target=_first_use) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(keys)) == 1
+        assert keys[0] == key_file.read_bytes()
+        assert len(keys[0]) == crypto_storage.DATA_KEY_SIZE
+        assert os.listdir(key_file.parent) == ['master.key']
+
+
 class TestGenerateCertificate:
     """Tests for certificate generation."""
 
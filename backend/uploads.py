@@ -13,9 +13,13 @@ from backend import config
 def list_scan_uploads(request: Request, include_summary: bool = False) -> list[dict[str, Any]]:
     """Return scan PDF metadata for the uploads directory."""
     uploads: list[dict[str, Any]] = []
-    for name in sorted(os.listdir(config.UPLOAD_DIR)):
-        if not (name.startswith("scan_") and name.endswith(".pdf")):
-            continue
+    # Annotated PDFs are rendered on first request; pending scans keep their upload.
+    names = {
+        f"{name.rsplit('.', 1)[0]}.pdf"
+        for name in os.listdir(config.UPLOAD_DIR)
+        if name.startswith("scan_") and name.endswith((".pdf", ".upload"))
+    }
+    for name in sorted(names):
         item: dict[str, Any] = {
             "name": name,
             "url": f"{request.host_url.rstrip('/')}/uploads/{name}",
@@ -34,6 +38,7 @@ def list_scan_uploads(request: Request, include_summary: bool = False) -> list[d
                     "matching_sentences": summary.get("matching_sentences"),
                     "total_sentences": summary.get("total_sentences"),
                     "plagiarism_percentage": summary.get("plagiarism_percentage"),
+                    "sources": sorted(summary.get("sources") or {}),
                 }
             )
         uploads.append(item)
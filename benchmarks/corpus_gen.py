@@ -0,0 +1,163 @@
+"""Synthetic PDF corpora with planted copied passages, for benchmarks.
+
+Words are drawn from a fixed pseudo-word vocabulary with a Zipf-like
+distribution, so common n-grams occur across many documents the way
+boilerplate does in a real corpus. Submissions mix fresh text with
+passages copied verbatim from corpus documents; the returned manifest
+names the source of every planted passage.
+
+    python -m benchmarks.corpus_gen /tmp/synthetic --documents 50 --submissions 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from reportlab.pdfgen import canvas
+
+SYLLABLES = (
+    "ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa",
+    "do", "fe", "gi", "hu", "ja", "be", "co", "qui", "wy", "xe",
+)
+VOCABULARY_SIZE = 5000
+WORDS_PER_LINE = 12
+FONT_SIZE = 9
+LINE_HEIGHT = 11
+TOP_MARGIN = 800
+LEFT_MARGIN = 56
+
+
+@dataclass
+class Submission:
+    """A generated submission and the corpus documents it copies from."""
+    path: str
+    words: int
+    sources: list[str] = field(default_factory=list)
+
+
+@dataclass
+class SyntheticCorpus:
+    """Paths and sizes of a generated corpus and its submissions."""
+    corpus_dir: str
+    submissions_dir: str
+    documents: int
+    pages: int
+    words_per_page: int
+    submissions: list[Submission] = field(default_factory=list)
+
+    def to_json(self) -> dict:
+        """The manifest as plain JSON data."""
+        return asdict(self)
+
+
+def _vocabulary(rng: random.Random) -> list[str]:
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _text(
+    rng: random.Random, vocabulary: list[str], weights: list[float], count: int
+) -> list[str]:
+    return rng.choices(vocabulary, weights=weights, k=count)
+
+
+def write_pdf(path: Path, words: list[str], words_per_page: int) -> None:
+    """Write ``words`` as a PDF of ``words_per_page``-word pages."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pdf = canvas.Canvas(str(path))
+    for page_start in range(0, max(len(words), 1), words_per_page):
+        page = words[page_start : page_start + words_per_page]
+        pdf.setFont("Helvetica", FONT_SIZE)
+        for line_number, line_start in enumerate(range(0, len(page), WORDS_PER_LINE)):
+            line = " ".join(page[line_start : line_start + WORDS_PER_LINE])
+            pdf.drawString(LEFT_MARGIN, TOP_MARGIN - line_number * LINE_HEIGHT, line)
+        pdf.showPage()
+    pdf.save()
+
+
+def generate(  # pylint: disable=too-many-arguments,too-many-locals
+    output_dir: Path | str,
+    documents: int = 20,
+    pages: int = 2,
+    words_per_page: int = 300,
+    submissions: int = 5,
+    passages: int = 2,
+    passage_words: int = 40,
+    seed: int = 0,
+) -> SyntheticCorpus:
+    """Write ``documents`` corpus PDFs and ``submissions`` submission PDFs.
+
+    Each submission is ``pages`` pages long and holds ``passages`` runs of
+    ``passage_words`` words copied from random corpus documents. The same
+    ``seed`` always produces the same files.
+    """
+    rng = random.Random(seed)
+    vocabulary = _vocabulary(rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    output_dir = Path(output_dir)
+    corpus_dir = output_dir / "corpus"
+    submissions_dir = output_dir / "submissions"
+    words_per_document = pages * words_per_page
+
+    corpus_words = {}
+    for number in range(documents):
+        name = f"source_{number:05d}.pdf"
+        corpus_words[name] = _text(rng, vocabulary, weights, words_per_document)
+        write_pdf(corpus_dir / name, corpus_words[name], words_per_page)
+
+    manifest = SyntheticCorpus(
+        str(corpus_dir), str(submissions_dir), documents, pages, words_per_page
+    )
+    names = sorted(corpus_words)
+    for number in range(submissions):
+        words = _text(rng, vocabulary, weights, words_per_document)
+        sources = sorted(rng.sample(names, min(passages, len(names))))
+        for source in sources:
+            copied = corpus_words[source]
+            start = rng.randrange(max(len(copied) - passage_words, 1))
+            at = rng.randrange(len(words) + 1)
+            words[at:at] = copied[start : start + passage_words]
+        path = submissions_dir / f"submission_{number:04d}.pdf"
+        write_pdf(path, words, words_per_page)
+        manifest.submissions.append(Submission(str(path), len(words), sources))
+    (output_dir / "manifest.json").write_text(
+        json.dumps(manifest.to_json(), indent=2) + "\n", encoding="utf-8"
+    )
+    return manifest
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Generate a synthetic corpus from the command line."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic PDF corpus.")
+    parser.add_argument("output", help="Directory for corpus/, submissions/ and manifest.json.")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--submissions", type=int, default=5)
+    parser.add_argument("--passages", type=int, default=2, help="Copied passages per submission.")
+    parser.add_argument("--passage-words", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    manifest = generate(
+        args.output,
+        documents=args.documents,
+        pages=args.pages,
+        words_per_page=args.words_per_page,
+        submissions=args.submissions,
+        passages=args.passages,
+        passage_words=args.passage_words,
+        seed=args.seed,
+    )
+    print(
+        f"Wrote {manifest.documents} corpus documents and "
+        f"{len(manifest.submissions)} submissions to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
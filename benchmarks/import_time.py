@@ -0,0 +1,153 @@
+"""Measure the import cost of the app's entry modules with ``python -X importtime``.
+
+Each module is imported in fresh interpreters, so every run pays the full
+cost a worker boot or a CLI invocation pays. The report gives the median
+cumulative import time, the heaviest sub-imports, and whether one of the
+PDF/crypto libraries (which should load on first use only) was imported.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --runs 9 --json import_time.json
+    python benchmarks/import_time.py --budget backend.app=300
+
+Exits with status 1 when a module exceeds its ``--budget`` (milliseconds)
+or loads a heavy library at import time.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_MODULES = ("plag_system", "plag_system.checker", "backend.app")
+# Libraries that must only be imported when a PDF is read, signed or annotated.
+HEAVY_MODULES = ("pdfplumber", "PyPDF2", "reportlab", "cryptography")
+
+
+def parse_importtime(stderr: str, module: str) -> list[tuple[str, int, int]]:
+    """Return ``(name, self_us, cumulative_us)`` of ``module`` and the imports it
+    triggered, from ``-X importtime`` output; ``module`` comes last."""
+    entries: list[tuple[str, int, int]] = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # The column header.
+        name = fields[2].strip()
+        depth = len(fields[2]) - len(fields[2].lstrip())
+        if depth == 1:
+            # A top-level import: interpreter startup, or the module itself.
+            if name == module:
+                return entries + [(name, int(fields[0]), int(fields[1]))]
+            entries = []
+            continue
+        entries.append((name, int(fields[0]), int(fields[1])))
+    return entries
+
+
+def measure(module: str) -> tuple[list[tuple[str, int, int]], set[str]]:
+    """Import ``module`` in a fresh interpreter.
+
+    Returns its importtime entries and the top-level packages loaded
+    (``-X importtime`` also lists imports that failed).
+    """
+    env = dict(os.environ, PYTHONPATH=str(ROOT_DIR))
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(ROOT_DIR),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    loaded = {name.split(".")[0] for name in result.stdout.split()}
+    return parse_importtime(result.stderr, module), loaded
+
+
+def benchmark(module: str, runs: int, top: int) -> dict:
+    """Median import cost of ``module`` over ``runs`` fresh interpreters."""
+    measurements = [measure(module) for _ in range(runs)]
+    totals = [entries[-1][2] if entries else 0 for entries, _ in measurements]
+    median_run, loaded = measurements[totals.index(sorted(totals)[len(totals) // 2])]
+    heaviest = sorted(median_run[:-1], key=lambda entry: entry[2], reverse=True)
+    return {
+        "module": module,
+        "runs": runs,
+        "median_ms": round(statistics.median(totals) / 1000, 1),
+        "min_ms": round(min(totals) / 1000, 1),
+        "max_ms": round(max(totals) / 1000, 1),
+        "modules_imported": len(median_run),
+        "heavy_imports": sorted(name for name in HEAVY_MODULES if name in loaded),
+        "heaviest": [
+            {
+                "module": name,
+                "self_ms": round(own / 1000, 1),
+                "cumulative_ms": round(total / 1000, 1),
+            }
+            for name, own, total in heaviest[:top]
+        ],
+    }
+
+
+def _parse_budgets(values: list[str]) -> dict[str, float]:
+    budgets = {}
+    for value in values:
+        module, _, milliseconds = value.partition("=")
+        try:
+            budgets[module] = float(milliseconds)
+        except ValueError:
+            raise SystemExit(f"Invalid --budget {value!r}; expected MODULE=MILLISECONDS") from None
+    return budgets
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmark and print a table (and optionally JSON)."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module.")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest sub-imports to list.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        help="MODULE=MILLISECONDS; exceeding the median fails the run.",
+    )
+    args = parser.parse_args(argv)
+    budgets = _parse_budgets(args.budget)
+
+    results = [benchmark(module, max(args.runs, 1), args.top) for module in args.modules]
+    failed = False
+    for result in results:
+        print(
+            f"{result['module']}: median {result['median_ms']} ms "
+            f"(min {result['min_ms']}, max {result['max_ms']}, "
+            f"{result['modules_imported']} modules)"
+        )
+        for entry in result["heaviest"]:
+            print(f"    {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+        if result["heavy_imports"]:
+            print(f"    heavy libraries imported: {', '.join(result['heavy_imports'])}")
+            failed = True
+        budget = budgets.get(result["module"])
+        if budget is not None and result["median_ms"] > budget:
+            print(f"    over budget: {result['median_ms']} ms > {budget} ms")
+            failed = True
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps({"python": sys.version.split()[0], "results": results}, indent=2) + "\n",
+            encoding="utf-8",
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
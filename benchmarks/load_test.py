@@ -0,0 +1,507 @@
+"""Load test for the HTTP API, simulating a submission deadline.
+
+By default the app is started locally with ``plag-checker serve`` against
+a sandbox (a generated corpus, its own users, uploads and signing
+keystore in a temporary directory), so the checkout's data is left
+alone. Concurrent clients then replay a weighted mix of
+
+    login            POST /login as a student
+    scan             POST /scan with one of the generated submissions
+    scan_pdf         GET /scan/<id>/pdf of a scan made during the run
+    teacher_uploads  POST /teacher/uploads as a teacher
+
+Clients start over ``--ramp`` seconds and run for ``--duration`` seconds.
+For every endpoint the report gives the throughput, p50/p95/p99 latency,
+the error rate and the peak RSS of the server's processes while one of
+its requests was in flight.
+
+    python -m benchmarks.load_test --clients 200 --duration 600 --ramp 60
+    python -m benchmarks.load_test --mix scan=1 --workers 4 --output load.json
+    python -m benchmarks.load_test --url http://staging:5000 --pid 4242 \\
+        --student alice:secret --teacher bob:secret
+
+With ``--url`` the requests go to a server that is already running; its
+students, teachers and corpus are used, and RSS is only sampled when
+``--pid`` names its master process on this machine.
+"""
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from urllib.parse import urlsplit
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional dependency
+    psutil = None
+
+from benchmarks.corpus_gen import generate
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+ENDPOINTS = ("login", "scan", "scan_pdf", "teacher_uploads")
+DEFAULT_MIX = "login=2,scan=5,scan_pdf=3,teacher_uploads=1"
+SANDBOX_STUDENT = ("loadtest-student", "Student-pass-123")
+SANDBOX_TEACHER = ("loadtest-teacher", "Teacher-pass-123")
+RSS_INTERVAL = 0.2
+READY_TIMEOUT = 60.0
+
+
+# ---------------------------------------------------------------------------
+# Sandbox server
+
+
+def serve_sandbox(sandbox: Path, port: int, workers: int, threads: int) -> None:
+    """Run the app on ``port`` with every data path inside ``sandbox``."""
+    # pylint: disable=import-outside-toplevel
+    from backend import config
+
+    for name, path in {
+        "USERS_FILE": sandbox / "users.json",
+        "CA_DIR": sandbox / "ca",
+        "CERT_DIR": sandbox / "certs",
+        "UPLOAD_DIR": sandbox / "uploads",
+        "HIGHLIGHT_DIR": sandbox / "uploads" / "highlights",
+        "CORPUS_DIR": sandbox / "corpus",
+        "COLLECTIONS_DIR": sandbox / "collections",
+        "SIGNING_KEY_DIR": sandbox / "keys",
+        "MASTER_KEY_FILE": sandbox / "keys" / "master.key",
+        "LOG_FILE": sandbox / "app.log",
+    }.items():
+        if name not in ("USERS_FILE", "MASTER_KEY_FILE", "LOG_FILE"):
+            path.mkdir(parents=True, exist_ok=True)
+        setattr(config, name, str(path))
+
+    from backend.app import create_app
+    from backend.server import ServerOptions, serve
+    from backend.users import create_user, load_users
+
+    if SANDBOX_STUDENT[0] not in load_users():
+        create_user(*SANDBOX_STUDENT, "student")
+        create_user(*SANDBOX_TEACHER, "teacher")
+    serve(
+        create_app,
+        ServerOptions(
+            host="127.0.0.1",
+            port=port,
+            workers=workers,
+            threads=threads,
+            corpus_dir=config.CORPUS_DIR,
+        ),
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _start_sandbox(
+    sandbox: Path, workers: int, threads: int, verbose: bool
+) -> tuple[subprocess.Popen, int]:
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=str(ROOT_DIR))
+    env.setdefault("PLAG_KEYSTORE_PASSWORD", "load-test-password")
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [
+            sys.executable, "-m", "benchmarks.load_test", "--serve-sandbox", str(sandbox),
+            "--port", str(port), "--workers", str(workers), "--threads", str(threads),
+        ],
+        cwd=str(ROOT_DIR),
+        env=env,
+        # The dev server logs every request to stderr.
+        stderr=None if verbose else subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"Server exited with status {process.returncode}; see --verbose"
+            )
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start listening in time")
+
+
+def _stop(process: subprocess.Popen) -> None:
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# ---------------------------------------------------------------------------
+# Resident memory of the server's process tree
+
+
+def _children(pid: int) -> list[int]:
+    parents: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="utf-8") as handle:
+                stat = handle.read()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after its ")".
+        parent = int(stat.rsplit(")", 1)[1].split()[1])
+        parents.setdefault(parent, []).append(int(entry))
+    found, pending = [], [pid]
+    while pending:
+        for child in parents.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def _proc_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass  # The process exited between listing and reading.
+    return 0
+
+
+def tree_rss(pid: int) -> int | None:
+    """Total resident memory of ``pid`` and its descendants, or None when unknown."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process, *process.children(recursive=True)]
+            return sum(child.memory_info().rss for child in processes)
+        except psutil.Error:
+            return None
+    try:
+        return sum(_proc_rss(child) for child in [pid, *_children(pid)])
+    except OSError:
+        return None  # No /proc on this platform.
+
+
+# ---------------------------------------------------------------------------
+# Clients
+
+
+def _multipart(field_name: str, filename: str, payload: bytes) -> tuple[bytes, str]:
+    boundary = f"plag-load-{os.urandom(8).hex()}"
+    body = b"".join(
+        [
+            f"--{boundary}\r\n".encode(),
+            (
+                f'Content-Disposition: form-data; name="{field_name}"; '
+                f'filename="{filename}"\r\n'
+            ).encode(),
+            b"Content-Type: application/pdf\r\n\r\n",
+            payload,
+            f"\r\n--{boundary}--\r\n".encode(),
+        ]
+    )
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+@dataclass
+class EndpointStats:
+    """Latencies and failures of one endpoint."""
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    peak_rss: int | None = None
+    in_flight: int = 0
+
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """Concurrent clients replaying a weighted endpoint mix against one server."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        base_url: str,
+        mix: dict[str, float],
+        submissions: list[Path],
+        student: tuple[str, str],
+        teacher: tuple[str, str],
+        server_pid: int | None = None,
+    ):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.mix = mix
+        self.submissions = [(path.name, path.read_bytes()) for path in submissions]
+        self.student = student
+        self.teacher = teacher
+        self.server_pid = server_pid
+        self.stats = {endpoint: EndpointStats() for endpoint in ENDPOINTS}
+        self.scan_ids: list[str] = []
+        self.peak_rss: int | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=300)
+        return http.client.HTTPConnection(self.host, self.port, timeout=300)
+
+    def _request(self, connection, endpoint: str, rng: random.Random) -> tuple[int, bytes]:
+        headers = {"Content-Type": "application/json"}
+        if endpoint == "login":
+            username, password = self.student
+            method, path = "POST", "/login"
+            body = json.dumps({"username": username, "password": password}).encode()
+        elif endpoint == "teacher_uploads":
+            username, password = self.teacher
+            method, path = "POST", "/teacher/uploads"
+            body = json.dumps({"username": username, "password": password}).encode()
+        elif endpoint == "scan_pdf":
+            with self._lock:
+                scan_id = rng.choice(self.scan_ids)
+            method, path, body, headers = "GET", f"/scan/{scan_id}/pdf", None, {}
+        else:
+            name, payload = rng.choice(self.submissions)
+            body, content_type = _multipart("file", name, payload)
+            method, path, headers = "POST", "/scan", {"Content-Type": content_type}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def _pick(self, rng: random.Random) -> str:
+        endpoints = list(self.mix)
+        endpoint = rng.choices(endpoints, weights=[self.mix[name] for name in endpoints])[0]
+        if endpoint == "scan_pdf" and not self.scan_ids:
+            return "scan"  # Nothing to fetch until a scan has finished.
+        return endpoint
+
+    def _client(self, delay: float, deadline: float, seed: int) -> None:
+        rng = random.Random(seed)
+        if self._stop.wait(delay):
+            return
+        connection = self._connection()
+        while time.monotonic() < deadline and not self._stop.is_set():
+            endpoint = self._pick(rng)
+            stats = self.stats[endpoint]
+            with self._lock:
+                stats.in_flight += 1
+            started = time.perf_counter()
+            try:
+                status, body = self._request(connection, endpoint, rng)
+            except (OSError, http.client.HTTPException):
+                status, body = 0, b""
+                connection.close()
+                connection = self._connection()
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats.in_flight -= 1
+                stats.latencies.append(elapsed)
+                if not 200 <= status < 300:
+                    stats.errors += 1
+                elif endpoint == "scan":
+                    pdf_url = json.loads(body).get("pdf_url", "")
+                    self.scan_ids.append(pdf_url.rstrip("/").rsplit("/", 2)[-2])
+        connection.close()
+
+    def _sample_rss(self) -> None:
+        while not self._stop.wait(RSS_INTERVAL):
+            rss = tree_rss(self.server_pid)
+            if rss is None:
+                continue
+            with self._lock:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+                for stats in self.stats.values():
+                    if stats.in_flight:
+                        stats.peak_rss = max(stats.peak_rss or 0, rss)
+
+    def run(self, clients: int, duration: float, ramp: float) -> dict:
+        """Run the clients and return the report."""
+        started = time.monotonic()
+        deadline = started + ramp + duration
+        threads = [
+            threading.Thread(
+                target=self._client,
+                args=(ramp * number / max(clients, 1), deadline, number),
+                daemon=True,
+            )
+            for number in range(clients)
+        ]
+        sampler = None
+        if self.server_pid is not None:
+            sampler = threading.Thread(target=self._sample_rss, daemon=True)
+            sampler.start()
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        finally:
+            self._stop.set()
+            if sampler is not None:
+                sampler.join()
+        return self.report(time.monotonic() - started)
+
+    def report(self, elapsed: float) -> dict:
+        """Throughput, latency percentiles, error rate and peak RSS per endpoint."""
+        endpoints = {}
+        for endpoint, stats in self.stats.items():
+            if not stats.latencies:
+                continue
+            latencies = sorted(stats.latencies)
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": stats.errors,
+                "error_rate": round(stats.errors / len(latencies), 4),
+                "throughput_per_s": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+                "peak_rss_mb": _megabytes(stats.peak_rss),
+            }
+        total = sum(result["requests"] for result in endpoints.values())
+        return {
+            "elapsed_s": round(elapsed, 1),
+            "requests": total,
+            "throughput_per_s": round(total / elapsed, 2) if elapsed else 0.0,
+            "peak_rss_mb": _megabytes(self.peak_rss),
+            "endpoints": endpoints,
+        }
+
+
+def _megabytes(value: int | None) -> float | None:
+    return round(value / (1024 * 1024), 1) if value is not None else None
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parse ``endpoint=weight,...`` into weights."""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The mix needs at least one positive weight")
+    return mix
+
+
+def _credentials(value: str | None, default: tuple[str, str]) -> tuple[str, str]:
+    if not value:
+        return default
+    username, _, password = value.partition(":")
+    return username, password
+
+
+def _print_report(report: dict) -> None:
+    print(
+        f"{report['requests']} requests in {report['elapsed_s']} s "
+        f"({report['throughput_per_s']}/s), peak RSS {report['peak_rss_mb']} MB"
+    )
+    print(f"{'endpoint':<16}{'req':>7}{'err%':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'RSS MB':>9}")
+    for endpoint, result in report["endpoints"].items():
+        print(
+            f"{endpoint:<16}{result['requests']:>7}{result['error_rate'] * 100:>7.1f}"
+            f"{result['throughput_per_s']:>8}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+            f"{result['p99_ms']:>9}{str(result['peak_rss_mb']):>9}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run a load test and print (and optionally save) the report."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent clients.")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds at full load.")
+    parser.add_argument("--ramp", type=float, default=10, help="Seconds to start all clients.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint=weight,...")
+    parser.add_argument("--workers", type=int, default=2, help="Sandbox server workers.")
+    parser.add_argument("--threads", type=int, default=4, help="Sandbox server threads.")
+    parser.add_argument("--documents", type=int, default=50, help="Sandbox corpus size.")
+    parser.add_argument("--submissions", type=int, default=10, help="Distinct PDFs to upload.")
+    parser.add_argument("--url", help="Test a running server instead of a sandbox.")
+    parser.add_argument("--pid", type=int, help="Master process of the --url server.")
+    parser.add_argument("--student", help="username:password for /login (with --url).")
+    parser.add_argument("--teacher", help="username:password for /teacher (with --url).")
+    parser.add_argument("--output", help="Also write the report to this JSON file.")
+    parser.add_argument("--verbose", action="store_true", help="Show the server's log.")
+    parser.add_argument("--serve-sandbox", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.serve_sandbox:
+        serve_sandbox(Path(args.serve_sandbox), args.port, args.workers, args.threads)
+        return 0
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    with tempfile.TemporaryDirectory(prefix="plag-load-") as work_dir:
+        sandbox = Path(work_dir)
+        corpus = generate(
+            sandbox,
+            documents=0 if args.url else args.documents,
+            submissions=args.submissions,
+        )
+        if not args.url:
+            # Index the corpus up front so the first scans do not all build it.
+            # pylint: disable=import-outside-toplevel
+            from plag_system.corpus_index import update_corpus_index
+
+            update_corpus_index(Path(corpus.corpus_dir))
+        submissions = [Path(submission.path) for submission in corpus.submissions]
+        server = None
+        if args.url:
+            base_url, pid = args.url, args.pid
+            student = _credentials(args.student, SANDBOX_STUDENT)
+            teacher = _credentials(args.teacher, SANDBOX_TEACHER)
+        else:
+            server, port = _start_sandbox(
+                sandbox, args.workers, args.threads, args.verbose
+            )
+            base_url, pid = f"http://127.0.0.1:{port}", server.pid
+            student, teacher = SANDBOX_STUDENT, SANDBOX_TEACHER
+        try:
+            test = LoadTest(base_url, mix, submissions, student, teacher, server_pid=pid)
+            report = test.run(args.clients, args.duration, args.ramp)
+        finally:
+            if server is not None:
+                _stop(server)
+    report["config"] = {
+        "clients": args.clients,
+        "duration_s": args.duration,
+        "ramp_s": args.ramp,
+        "mix": mix,
+        "url": args.url,
+        "workers": None if args.url else args.workers,
+        "threads": None if args.url else args.threads,
+    }
+    _print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    return 1 if any(result["errors"] for result in report["endpoints"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
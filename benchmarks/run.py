@@ -0,0 +1,194 @@
+"""Benchmark the checker on synthetic corpora of several sizes.
+
+For every scale a corpus with planted copied passages is generated (see
+:mod:`benchmarks.corpus_gen`) and these are timed:
+
+    index_build_s       building the corpus index from scratch
+    read_text_pages_per_s  plag_system.text.read_text over the submissions
+    analyze_file_s      median plag_system.checker.analyze_file per submission
+    analyze_and_sign_s  median analyze_and_sign (page texts already cached)
+    annotate_pdf_s      median annotate_pdf, looking every n-gram up in the index
+    encrypt_mb_per_s / decrypt_mb_per_s  storage encryption of one payload
+                        (64 KiB, 1 MiB or 8 MiB depending on the scale)
+
+``planted_recall`` is the share of planted sources found among the
+reported matches; a drop means a change made the checker miss copies.
+
+Results are written as JSON. ``--baseline`` compares them with an
+earlier results file and exits with status 1 when a metric is worse by
+more than ``--tolerance`` (a fraction; default 0.25).
+
+    python -m benchmarks.run --scales small,medium --output results.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.corpus_gen import SyntheticCorpus, generate
+
+# documents, pages per document, submissions, encryption payload bytes
+SCALES = {
+    "small": (20, 2, 5, 64 * 1024),
+    "medium": (100, 3, 10, 1024 * 1024),
+    "large": (400, 4, 20, 8 * 1024 * 1024),
+}
+# Metrics where a higher value is better; for all others lower is better.
+HIGHER_IS_BETTER = {
+    "read_text_pages_per_s",
+    "encrypt_mb_per_s",
+    "decrypt_mb_per_s",
+    "planted_recall",
+}
+# Bytes encrypted and decrypted per measurement, whatever the payload size.
+CRYPTO_VOLUME = 64 * 1024 * 1024
+
+
+def _timed(function: Callable, *args, **kwargs) -> tuple[float, object]:
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def _median(durations: list[float]) -> float:
+    return round(statistics.median(durations), 4) if durations else 0.0
+
+
+def _crypto_throughput(payload_size: int) -> dict:
+    # pylint: disable=import-outside-toplevel
+    from plag_system.crypto_storage import decrypt_if_needed, encrypt_bytes
+
+    payload = os.urandom(payload_size)
+    encrypted = encrypt_bytes(payload)
+    rounds = max(CRYPTO_VOLUME // payload_size, 1)
+    encrypt_time = sum(_timed(encrypt_bytes, payload)[0] for _ in range(rounds))
+    decrypt_time = sum(_timed(decrypt_if_needed, encrypted)[0] for _ in range(rounds))
+    megabytes = payload_size * rounds / 1e6
+    return {
+        "encrypt_mb_per_s": round(megabytes / encrypt_time, 1),
+        "decrypt_mb_per_s": round(megabytes / decrypt_time, 1),
+    }
+
+
+def run_scale(corpus: SyntheticCorpus, work_dir: Path) -> dict:
+    """Time every operation on one generated corpus."""
+    # pylint: disable=import-outside-toplevel,too-many-locals
+    from plag_system.checker import analyze_and_sign, analyze_file, annotate_pdf
+    from plag_system.corpus_index import update_corpus_index
+    from plag_system.text import read_text
+
+    corpus_dir = Path(corpus.corpus_dir)
+    submissions = [Path(submission.path) for submission in corpus.submissions]
+    index_time, _ = _timed(update_corpus_index, corpus_dir)
+
+    read_time = sum(_timed(read_text, path)[0] for path in submissions)
+    pages = corpus.pages * len(submissions)
+
+    analyze_times, sign_times, annotate_times = [], [], []
+    found = planted = 0
+    for submission, path in zip(corpus.submissions, submissions):
+        duration, report = _timed(analyze_file, path, corpus_dir=corpus_dir)
+        analyze_times.append(duration)
+        matched = {Path(match["path"]).name for match in report["matches"]}
+        planted += len(submission.sources)
+        found += len(matched & set(submission.sources))
+        duration, _ = _timed(
+            analyze_and_sign, path, corpus_dir=corpus_dir, key_dir=work_dir / "keys"
+        )
+        sign_times.append(duration)
+        duration, _ = _timed(
+            annotate_pdf, path, corpus_dir=corpus_dir, output_path=work_dir / f"{path.stem}.pdf"
+        )
+        annotate_times.append(duration)
+    return {
+        "documents": corpus.documents,
+        "pages_per_document": corpus.pages,
+        "submissions": len(submissions),
+        "index_build_s": round(index_time, 3),
+        "read_text_pages_per_s": round(pages / read_time, 1) if read_time else 0.0,
+        "analyze_file_s": _median(analyze_times),
+        "analyze_and_sign_s": _median(sign_times),
+        "annotate_pdf_s": _median(annotate_times),
+        "planted_recall": round(found / planted, 3) if planted else 1.0,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return a line for every metric worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for scale, metrics in results["scales"].items():
+        previous = baseline.get("scales", {}).get(scale, {})
+        for name, value in metrics.items():
+            before = previous.get(name)
+            if not isinstance(value, float) or not isinstance(before, (int, float)) or not before:
+                continue
+            change = (value - before) / before
+            if name in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{scale}.{name}: {before} -> {value} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmarks and print, save and compare the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument(
+        "--scales",
+        default="small",
+        help=f"Comma-separated scales to run: {', '.join(SCALES)}.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with an earlier results file.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale {', '.join(unknown)}")
+    os.environ.setdefault("PLAG_KEYSTORE_PASSWORD", "benchmark-password")
+
+    results = {
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scales": {},
+    }
+    for scale in scales:
+        documents, pages, submissions, payload_size = SCALES[scale]
+        with tempfile.TemporaryDirectory(prefix=f"plag-bench-{scale}-") as work_dir:
+            corpus = generate(
+                work_dir,
+                documents=documents,
+                pages=pages,
+                submissions=submissions,
+                seed=args.seed,
+            )
+            metrics = run_scale(corpus, Path(work_dir))
+        metrics.update(_crypto_throughput(payload_size))
+        results["scales"][scale] = metrics
+        print(f"{scale}: " + ", ".join(f"{name}={value}" for name, value in metrics.items()))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if not args.baseline:
+        return 0
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -31,6 +31,16 @@ function ReportPage() {
     }
     return null
   })()
+  const nearDuplicate = (() => {
+    const value = report?.near_duplicate
+    if (value && typeof value === 'object') {
+      const { kind, source } = value as { kind?: unknown; source?: unknown }
+      if (typeof kind === 'string' && typeof source === 'string') {
+        return `${kind} ${source.split('/').pop()}`
+      }
+    }
+    return null
+  })()
   const sentenceMatchPercent =
     matchingSentences !== null && totalSentences
       ? Math.round((matchingSentences / totalSentences) * 100)
@@ -78,6 +88,9 @@ function ReportPage() {
                 <p className="report-subtitle">
                   {sentenceMatchPercent !== null ? `${sentenceMatchPercent}% matched` : 'Match rate N/A'}
                 </p>
+                {nearDuplicate ? (
+                  <p className="scan-error">Near-duplicate of {nearDuplicate}</p>
+                ) : null}
               </div>
             </div>
           ) : (
@@ -12,6 +12,7 @@ function TeacherDashboard() {
       matching_sentences?: number
       total_sentences?: number
       plagiarism_percentage?: number
+      sources?: string[]
     }[]
   >([])
   const [checked, setChecked] = useState<Record<string, boolean>>({})
@@ -37,6 +38,7 @@ function TeacherDashboard() {
           matching_sentences?: number
           total_sentences?: number
           plagiarism_percentage?: number
+          sources?: string[]
         }[]
         error?: string
       }
@@ -134,6 +136,26 @@ function TeacherDashboard() {
                         ? ` • ${file.plagiarism_percentage}% plagiarized`
                         : ''}
                     </p>
+                    {file.sources?.length ? (
+                      <p className="report-subtitle">
+                        Sources:{' '}
+                        {file.sources.map((source) => (
+                          <a
+                            className="upload-link"
+                            key={source}
+                            href={`${apiBase}/teacher/scan/${file.name.replace(
+                              /^scan_|\.pdf$/g,
+                              '',
+                            )}/source/${encodeURIComponent(source)}?username=${encodeURIComponent(
+                              username,
+                            )}&password=${encodeURIComponent(password)}`}
+                            target="_blank"
+                          >
+                            {source}{' '}
+                          </a>
+                        ))}
+                      </p>
+                    ) : null}
                   </div>
                   <label className="checkbox">
                     <input
@@ -4,6 +4,8 @@ import { navigate, routes } from '../routes'
 function UploadPage() {
   const [menuOpen, setMenuOpen] = useState(false)
   const [selectedFile, setSelectedFile] = useState<File | null>(null)
+  const [collections, setCollections] = useState('')
+  const [password, setPassword] = useState('')
   const [loading, setLoading] = useState(false)
   const [report, setReport] = useState<Record<string, unknown> | null>(null)
   const [error, setError] = useState<string | null>(null)
@@ -43,6 +45,13 @@ function UploadPage() {
         window.location.origin
       const formData = new FormData()
       formData.append('file', selectedFile)
+      if (username && password) {
+        formData.append('username', username)
+        formData.append('password', password)
+      }
+      if (collections.trim()) {
+        formData.append('collections', collections.trim())
+      }
       const res = await fetch(`${apiBase}/scan`, {
         method: 'POST',
         body: formData,
@@ -127,6 +136,26 @@ function UploadPage() {
               {selectedFile ? 'Change file' : 'Select file'}
             </label>
             {selectedFile ? <p className="file-name">{selectedFile.name}</p> : null}
+            <label className="field">
+              <span>Course collections (optional, comma-separated)</span>
+              <input
+                type="text"
+                value={collections}
+                onChange={(event) => setCollections(event.target.value)}
+                placeholder="net-101"
+              />
+            </label>
+            {username ? (
+              <label className="field">
+                <span>Password (optional, so your earlier drafts are not flagged)</span>
+                <input
+                  type="password"
+                  value={password}
+                  onChange={(event) => setPassword(event.target.value)}
+                  placeholder="••••••••"
+                />
+              </label>
+            ) : null}
             <button className="scan-button" type="button" onClick={handleScan} disabled={loading}>
               {loading ? 'Scanning...' : 'Run scan'}
             </button>
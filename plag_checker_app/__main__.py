@@ -1,10 +1,224 @@
 """Entry point for running the Plag Checker app."""
-from backend.app import create_app
+from __future__ import annotations
 
+import argparse
+import contextlib
+import json
+import logging
+import sys
+
+from backend import config
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="plag-checker")
+    commands = parser.add_subparsers(dest="command")
+
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Run the pre-fork multi-worker production server.",
+    )
+    serve_parser.add_argument("--host", default=config.SERVER_HOST)
+    serve_parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=config.SERVER_WORKERS,
+        help="Worker processes to fork (0 serves from a single process).",
+    )
+    serve_parser.add_argument(
+        "--threads",
+        type=int,
+        default=config.SERVER_THREADS,
+        help="Request threads per worker.",
+    )
+    serve_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=config.SERVER_TIMEOUT,
+        help="Socket timeout in seconds for reading and writing a request.",
+    )
+    serve_parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=config.SERVER_GRACEFUL_TIMEOUT,
+        help="Seconds a stopping worker may spend finishing in-flight requests.",
+    )
+    serve_parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=config.CORPUS_RELOAD_INTERVAL,
+        help="Seconds between corpus change checks (0 disables; SIGHUP always reloads).",
+    )
+    shard_parser = commands.add_parser(
+        "shard",
+        help="Serve one shard of the corpus index to scans configured with PLAG_SHARDS.",
+    )
+    shard_parser.add_argument("--shard", required=True, help="Shard to serve, as i/n.")
+    shard_parser.add_argument(
+        "--listen",
+        required=True,
+        help="unix:/path/to/socket or host:port.",
+    )
+    shard_parser.add_argument("--corpus", default=config.CORPUS_DIR)
+    export_parser = commands.add_parser(
+        "export-index",
+        help="Write a checksummed snapshot of the corpus index for another node.",
+    )
+    export_parser.add_argument("output", help="Snapshot file to write.")
+    import_parser = commands.add_parser(
+        "import-index",
+        help="Replace the corpus index with a snapshot made by export-index.",
+    )
+    import_parser.add_argument("snapshot", help="Snapshot file to read.")
+    for snapshot_parser in (export_parser, import_parser):
+        snapshot_parser.add_argument("--corpus", default=config.CORPUS_DIR)
+        snapshot_parser.add_argument("--shard", help="Shard of the index, as i/n.")
+    scan_parser = commands.add_parser(
+        "scan",
+        help="Scan PDFs offline and write one signed JSON report per line.",
+    )
+    scan_parser.add_argument("inputs", nargs="+", help="PDF files, directories or globs.")
+    scan_parser.add_argument("--corpus", default=config.CORPUS_DIR)
+    scan_parser.add_argument(
+        "--output",
+        "-o",
+        default="-",
+        help="JSON Lines file to write (default: stdout).",
+    )
+    scan_parser.add_argument("--keys", help="Directory of the signing keystore.")
+    scan_parser.add_argument("--annotate", help="Directory for annotated PDFs.")
+    scan_parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=0,
+        help="Worker processes (default: one per CPU).",
+    )
+    scan_parser.add_argument("--metric", default=None, help="Ranking metric.")
+    scan_parser.add_argument(
+        "--threshold",
+        type=float,
+        help="Exit with status 1 when any file reaches this plagiarism percentage.",
+    )
+    return parser
+
+
+def _snapshot(args: argparse.Namespace) -> None:
+    # pylint: disable=import-outside-toplevel
+    from plag_system.sharding import parse_shard
+    from plag_system.snapshot import SnapshotError, export_snapshot, import_snapshot
+
+    shard = parse_shard(args.shard) if args.shard else None
+    try:
+        if args.command == "export-index":
+            header = export_snapshot(args.corpus, args.output, shard=shard)
+            print(
+                f"Exported generation {header['generation']} "
+                f"({len(header['documents'])} documents) to {args.output}"
+            )
+        else:
+            header = import_snapshot(args.snapshot, args.corpus, shard=shard)
+            print(
+                f"Imported generation {header['generation']}: {header['matched']} of "
+                f"{len(header['documents'])} corpus files already indexed"
+            )
+    except SnapshotError as exc:
+        raise SystemExit(f"plag-checker: {exc}") from exc
+
+
+def _scan(args: argparse.Namespace) -> int:
+    """Stream the reports; exit 2 on unusable input, else 1 at the threshold."""
+    # pylint: disable=import-outside-toplevel
+    from plag_system.batch_scan import expand_inputs, scan_files
+    from plag_system.checker import DEFAULT_KEYS_DIR, DEFAULT_RANKING_METRIC, RANKING_METRICS
+
+    metric = args.metric or DEFAULT_RANKING_METRIC
+    if metric not in RANKING_METRICS:
+        raise SystemExit(f"plag-checker: unknown ranking metric {metric}")
+    paths, unmatched = expand_inputs(args.inputs)
+    for item in unmatched:
+        print(f"plag-checker: no PDF matches {item}", file=sys.stderr)
+    failed = bool(unmatched)
+    flagged = False
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout
+        if args.output != "-":
+            output = stack.enter_context(open(args.output, "w", encoding="utf-8"))
+        results = scan_files(
+            paths,
+            corpus_dir=args.corpus,
+            key_dir=args.keys or DEFAULT_KEYS_DIR,
+            metric=metric,
+            annotate_dir=args.annotate,
+            jobs=args.jobs or None,
+        )
+        try:
+            for result in results:
+                output.write(json.dumps(result.to_json(), sort_keys=True) + "\n")
+                output.flush()
+                if result.error is not None:
+                    print(f"plag-checker: {result.path}: {result.error}", file=sys.stderr)
+                    failed = True
+                elif args.threshold is not None:
+                    flagged |= result.report["plagiarism_percentage"] >= args.threshold
+        except (OSError, ValueError) as exc:
+            # Per-file errors are reported above; this is the corpus or the signing key.
+            print(f"plag-checker: {exc}", file=sys.stderr)
+            return 2
+    if failed:
+        return 2
+    return 1 if flagged else 0
+
+
+def _serve_shard(args: argparse.Namespace) -> None:
+    # pylint: disable=import-outside-toplevel
+    from plag_system.sharding import parse_shard, serve_shard
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    serve_shard(args.corpus, parse_shard(args.shard), args.listen)
+
+
+def _serve(args: argparse.Namespace) -> None:
+    # pylint: disable=import-outside-toplevel
+    from backend.app import create_app
+    from backend.server import ServerOptions, serve
+
+    serve(
+        create_app,
+        ServerOptions(
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            threads=args.threads,
+            timeout=args.timeout,
+            graceful_timeout=args.graceful_timeout,
+            reload_interval=args.reload_interval,
+        ),
+    )
+
+
+def main(argv: list[str] | None = None):
+    """Run the Flask development server, or a subcommand such as ``serve``."""
+    args = _build_parser().parse_args(argv)
+    if args.command == "serve":
+        _serve(args)
+        return
+    if args.command == "shard":
+        _serve_shard(args)
+        return
+    if args.command in ("export-index", "import-index"):
+        _snapshot(args)
+        return
+    if args.command == "scan":
+        sys.exit(_scan(args))
+    # pylint: disable=import-outside-toplevel
+    from backend.app import create_app
+    from backend.corpus_watcher import start_corpus_watcher
 
-def main():
-    """Run the Flask development server."""
     app = create_app()
+
+    start_corpus_watcher()
     app.run(debug=False)
 
 
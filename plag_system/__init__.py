@@ -1,5 +1,17 @@
-"""Plagiarism system helpers."""
+"""Plagiarism system helpers.
 
-from .checker import analyze_and_sign, analyze_file, annotate_pdf, ensure_keypair
+The checker functions are resolved on first access, so importing a
+submodule such as :mod:`plag_system.corpus_index` does not load the
+checker and its PDF libraries.
+"""
+from __future__ import annotations
+
+import importlib
 
 __all__ = ["analyze_and_sign", "analyze_file", "annotate_pdf", "ensure_keypair"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return getattr(importlib.import_module("plag_system.checker"), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
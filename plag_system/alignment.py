@@ -0,0 +1,113 @@
+"""
+Passage alignment between a submission and one corpus document.
+
+Seed-and-extend over the two gram sequences: every gram of the submission
+that also occurs in the source seeds a diagonal, which is extended while the
+following grams keep matching. A diagonal that has already been extended
+past a seed is not extended again, so each (submission, source) position
+pair is compared at most once per diagonal and the work stays close to
+linear in the document lengths. The runs are then tiled greedily, longest
+first and without overlap on either side, and tiles that follow each other
+in both documents with at most a small gap are merged into one passage.
+"""
+from __future__ import annotations
+
+import os
+from typing import Callable
+
+from plag_system.positions import TokenPositions
+
+MIN_PASSAGE_NGRAMS = int(os.getenv("PLAG_PASSAGE_MIN_NGRAMS", "2"))
+# Grams occurring more often than this in the source make poor seeds.
+MAX_SEED_OCCURRENCES = 64
+
+
+def _runs(
+    submission: TokenPositions,
+    source: TokenPositions,
+    skip: Callable[[int], bool] | None,
+    min_ngrams: int,
+) -> list[tuple[int, int, int]]:
+    occurrences: dict[int, list[int]] = {}
+    for position, gram in enumerate(source.grams):
+        occurrences.setdefault(gram, []).append(position)
+
+    sub_grams, src_grams = submission.grams, source.grams
+    extended_to: dict[int, int] = {}
+    runs = []
+    for sub_pos, gram in enumerate(sub_grams):
+        seeds = occurrences.get(gram)
+        if not seeds or len(seeds) > MAX_SEED_OCCURRENCES or (skip and skip(gram)):
+            continue
+        for src_pos in seeds:
+            diagonal = sub_pos - src_pos
+            if extended_to.get(diagonal, -1) > sub_pos:
+                continue
+            length = 1
+            while (
+                sub_pos + length < len(sub_grams)
+                and src_pos + length < len(src_grams)
+                and sub_grams[sub_pos + length] == src_grams[src_pos + length]
+            ):
+                length += 1
+            extended_to[diagonal] = sub_pos + length
+            if length >= min_ngrams:
+                runs.append((length, sub_pos, src_pos))
+    return runs
+
+
+def _tile(
+    runs: list[tuple[int, int, int]],
+    submission_size: int,
+    source_size: int,
+) -> list[tuple[int, int, int]]:
+    sub_taken = bytearray(submission_size)
+    src_taken = bytearray(source_size)
+    tiles = []
+    for length, sub_pos, src_pos in sorted(runs, key=lambda run: (-run[0], run[1], run[2])):
+        if any(sub_taken[sub_pos : sub_pos + length]):
+            continue
+        if any(src_taken[src_pos : src_pos + length]):
+            continue
+        sub_taken[sub_pos : sub_pos + length] = b"\x01" * length
+        src_taken[src_pos : src_pos + length] = b"\x01" * length
+        tiles.append((sub_pos, src_pos, length))
+    tiles.sort()
+    return tiles
+
+
+def align_passages(
+    submission: TokenPositions,
+    source: TokenPositions,
+    skip: Callable[[int], bool] | None = None,
+    min_ngrams: int = MIN_PASSAGE_NGRAMS,
+) -> list[dict]:
+    """Return the matched passages with character offsets and pages on both sides.
+
+    ``skip`` excludes grams (e.g. stop-grams) from seeding; they still extend
+    a passage that runs through them. Adjacent tiles are merged when they are
+    at most one n-gram apart in both documents, which bridges an edited word.
+    """
+    runs = _runs(submission, source, skip, min_ngrams)
+    tiles = _tile(runs, len(submission.grams), len(source.grams))
+    max_gap = submission.ngram_size
+    merged: list[list[int]] = []
+    for sub_pos, src_pos, length in tiles:
+        if merged:
+            last = merged[-1]
+            sub_gap = sub_pos - last[1]
+            src_gap = src_pos - last[3]
+            if 0 <= sub_gap <= max_gap and 0 <= src_gap <= max_gap:
+                last[1] = sub_pos + length
+                last[3] = src_pos + length
+                last[4] += length
+                continue
+        merged.append([sub_pos, sub_pos + length, src_pos, src_pos + length, length])
+    return [
+        {
+            "submission": submission.span(sub_start, sub_end),
+            "source": source.span(src_start, src_end),
+            "ngrams": matched,
+        }
+        for sub_start, sub_end, src_start, src_end, matched in merged
+    ]
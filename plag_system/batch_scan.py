@@ -0,0 +1,147 @@
+"""
+Offline batch scanning, for the ``plag-checker scan`` command.
+
+Inputs are files, directories (searched recursively for PDFs) and glob
+patterns. Files are scanned in worker processes with
+:func:`plag_system.checker.analyze_and_sign`, and :func:`scan_files`
+yields one result per file in input order as soon as it is ready, so a
+caller can stream JSON Lines while the rest of the batch is still running.
+Submissions scanned this way are not added to the earlier-submissions
+index.
+"""
+from __future__ import annotations
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Sequence
+
+from plag_system.checker import (
+    DEFAULT_CORPUS_DIR,
+    DEFAULT_KEYS_DIR,
+    DEFAULT_RANKING_METRIC,
+    analyze_and_sign,
+    ensure_keypair,
+)
+from plag_system.corpus_index import update_corpus_index
+
+
+@dataclass
+class ScanResult:
+    """The signed report of one file, or the error that stopped its scan."""
+    path: Path
+    report: dict | None = None
+    error: str | None = None
+    annotated_pdf: Path | None = None
+
+    def to_json(self) -> dict:
+        """The JSON Lines record: ``file`` plus the report, or ``file`` and ``error``."""
+        record: dict = {"file": str(self.path)}
+        if self.error is not None:
+            record["error"] = self.error
+            return record
+        if self.annotated_pdf is not None:
+            record["annotated_pdf"] = str(self.annotated_pdf)
+        record.update(self.report or {})
+        return record
+
+
+def expand_inputs(inputs: Sequence[str]) -> tuple[list[Path], list[str]]:
+    """Return the PDFs named by ``inputs`` (deduplicated, in order) and the
+    inputs that matched nothing."""
+    found: list[Path] = []
+    unmatched = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(
+                path for path in Path(item).rglob("*") if path.suffix.lower() == ".pdf"
+            )
+        elif os.path.isfile(item):
+            matches = [Path(item)]
+        else:
+            matches = [
+                Path(match)
+                for match in sorted(glob.glob(item, recursive=True))
+                if os.path.isfile(match)
+            ]
+        if not matches:
+            unmatched.append(item)
+        for path in matches:
+            key = path.resolve()
+            if key not in seen:
+                seen.add(key)
+                found.append(path)
+    return found, unmatched
+
+
+def _annotated_paths(paths: list[Path], annotate_dir: Path) -> list[Path]:
+    """One output name per input: its file name, numbered when names collide."""
+    used: set[str] = set()
+    outputs = []
+    for path in paths:
+        name = f"{path.stem}.annotated.pdf"
+        number = 2
+        while name in used:
+            name = f"{path.stem}-{number}.annotated.pdf"
+            number += 1
+        used.add(name)
+        outputs.append(annotate_dir / name)
+    return outputs
+
+
+def _scan_one(
+    path: Path,
+    corpus_dir: Path,
+    key_dir: Path,
+    metric: str,
+    annotated_pdf: Path | None,
+) -> ScanResult:
+    try:
+        report = analyze_and_sign(
+            path,
+            corpus_dir=corpus_dir,
+            key_dir=key_dir,
+            annotated_pdf_path=annotated_pdf,
+            metric=metric,
+        )
+    except Exception as exc:  # pylint: disable=broad-except
+        # One unreadable PDF must not abort a whole grading run.
+        return ScanResult(path, error=f"{type(exc).__name__}: {exc}")
+    return ScanResult(path, report=report, annotated_pdf=annotated_pdf)
+
+
+def scan_files(  # pylint: disable=too-many-arguments
+    paths: list[Path],
+    corpus_dir: Path | str = DEFAULT_CORPUS_DIR,
+    key_dir: Path | str = DEFAULT_KEYS_DIR,
+    metric: str = DEFAULT_RANKING_METRIC,
+    annotate_dir: Path | str | None = None,
+    jobs: int | None = None,
+) -> Iterator[ScanResult]:
+    """Scan ``paths`` with ``jobs`` worker processes (default: one per CPU).
+
+    The corpus index and the signing key are prepared once beforehand, so
+    the workers only read them. ``annotate_dir`` also writes an annotated
+    PDF for every file.
+    """
+    corpus_dir = Path(corpus_dir)
+    key_dir = Path(key_dir)
+    update_corpus_index(corpus_dir)
+    ensure_keypair(key_dir=key_dir)
+    outputs: list[Path | None] = [None] * len(paths)
+    if annotate_dir is not None:
+        Path(annotate_dir).mkdir(parents=True, exist_ok=True)
+        outputs = list(_annotated_paths(paths, Path(annotate_dir)))
+    arguments = [
+        (path, corpus_dir, key_dir, metric, output) for path, output in zip(paths, outputs)
+    ]
+    jobs = min(jobs or os.cpu_count() or 1, max(len(paths), 1))
+    if jobs == 1:
+        for argument in arguments:
+            yield _scan_one(*argument)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(_scan_one, *zip(*arguments))
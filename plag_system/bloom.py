@@ -0,0 +1,156 @@
+"""
+Bloom filters over segment grams.
+
+Each index segment gets a ``.bloom`` sidecar holding a Bloom filter of its
+gram hashes. Workers keep the filters in memory and skip a segment's
+on-disk binary search for every gram the filter rules out, so a submission's
+non-matching grams (usually most of them) never touch the segment files.
+A filter hit is only a candidate: the postings are still looked up, which
+keeps results exact.
+
+Gram hashes are already uniform 64-bit values, so the ``k`` probe
+positions come from double hashing the two halves of the hash. Filters are
+sized to a power of two bits, which lets a filter be folded in half (OR of
+the two halves) to fit ``PLAG_BLOOM_MAX_BYTES`` at the cost of a higher
+false-positive rate.
+
+File layout (little-endian)::
+
+    header  magic, version, probe count, item count, bit count
+    bits    bit_count / 8 bytes
+"""
+from __future__ import annotations
+
+import math
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Iterable
+
+from plag_system.mmap_index import IndexFormatError
+
+MAGIC = b"PLAGBLM\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+BLOOM_FP_RATE = float(os.getenv("PLAG_BLOOM_FP_RATE", "0.01"))
+BLOOM_MAX_BYTES = int(os.getenv("PLAG_BLOOM_MAX_BYTES", str(64 * 1024 * 1024)))
+MIN_BITS = 64
+
+
+class BloomFilter:
+    """Bit array answering "possibly contains" for 64-bit gram hashes."""
+
+    def __init__(self, bit_count: int, hashes: int, bits: bytearray | None = None) -> None:
+        if bit_count < MIN_BITS or bit_count & (bit_count - 1):
+            raise ValueError("Bloom filter size must be a power of two of at least 64 bits")
+        self.bit_count = bit_count
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray(bit_count // 8)
+        self.items = 0
+
+    @classmethod
+    def for_capacity(cls, items: int, fp_rate: float = BLOOM_FP_RATE) -> "BloomFilter":
+        """Return an empty filter sized for ``items`` grams at ``fp_rate``."""
+        items = max(items, 1)
+        optimal = -items * math.log(fp_rate) / (math.log(2) ** 2)
+        bit_count = max(MIN_BITS, 1 << math.ceil(math.log2(optimal)))
+        # Rounding the size up already lowers the rate; more probes would only cost time.
+        return cls(bit_count, max(1, round(-math.log2(fp_rate))))
+
+    def _positions(self, gram: int) -> Iterable[int]:
+        mask = self.bit_count - 1
+        low = gram & 0xFFFFFFFF
+        step = (gram >> 32) | 1
+        return ((low + probe * step) & mask for probe in range(self.hashes))
+
+    def add(self, gram: int) -> None:
+        """Insert one gram hash."""
+        for position in self._positions(gram):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def update(self, grams: Iterable[int]) -> None:
+        """Insert several gram hashes."""
+        for gram in grams:
+            self.add(gram)
+
+    def __contains__(self, gram: int) -> bool:
+        # Inlined probe loop: this runs for every submission gram and segment.
+        bits = self.bits
+        mask = self.bit_count - 1
+        position = gram & 0xFFFFFFFF
+        step = (gram >> 32) | 1
+        for _ in range(self.hashes):
+            position &= mask
+            if not bits[position >> 3] >> (position & 7) & 1:
+                return False
+            position += step
+        return True
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the bit array in bytes."""
+        return len(self.bits)
+
+    def fold(self) -> None:
+        """Halve the filter in place; every gram it contained still matches."""
+        if self.bit_count <= MIN_BITS:
+            return
+        half = len(self.bits) // 2
+        upper = int.from_bytes(self.bits[half:], "little")
+        lower = int.from_bytes(self.bits[:half], "little")
+        self.bits = bytearray((upper | lower).to_bytes(half, "little"))
+        self.bit_count //= 2
+
+    def false_positive_rate(self) -> float:
+        """Expected false-positive rate for the number of inserted grams."""
+        if not self.items:
+            return 0.0
+        return (1 - math.exp(-self.hashes * self.items / self.bit_count)) ** self.hashes
+
+
+def write_bloom(path: Path | str, bloom: BloomFilter) -> Path:
+    """Write ``bloom`` to ``path`` atomically."""
+    path = Path(path)
+    fd, temp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(HEADER.pack(MAGIC, VERSION, bloom.hashes, bloom.items, bloom.bit_count))
+            handle.write(bloom.bits)
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+    return path
+
+
+def read_bloom(path: Path | str) -> BloomFilter:
+    """Load a filter written by :func:`write_bloom`."""
+    payload = Path(path).read_bytes()
+    if len(payload) < HEADER.size:
+        raise IndexFormatError(f"Bloom filter {path} is truncated")
+    magic, version, hashes, items, bit_count = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise IndexFormatError(f"Bloom filter {path} has an unsupported format")
+    bits = bytearray(payload[HEADER.size :])
+    if len(bits) * 8 != bit_count:
+        raise IndexFormatError(f"Bloom filter {path} is truncated")
+    bloom = BloomFilter(bit_count, hashes, bits)
+    bloom.items = items
+    return bloom
+
+
+def fit_budget(blooms: list[BloomFilter | None], max_bytes: int | None = None) -> None:
+    """Fold the largest filters until together they fit in ``max_bytes``
+    (default ``PLAG_BLOOM_MAX_BYTES``)."""
+    max_bytes = BLOOM_MAX_BYTES if max_bytes is None else max_bytes
+    loaded = [bloom for bloom in blooms if bloom is not None]
+    total = sum(bloom.nbytes for bloom in loaded)
+    while loaded and total > max_bytes:
+        largest = max(loaded, key=lambda bloom: bloom.nbytes)
+        if largest.bit_count <= MIN_BITS:
+            break
+        total -= largest.nbytes // 2
+        largest.fold()
@@ -1,69 +1,58 @@
 """
 Plagiarism checker with report signing.
 Designed for backend module use.
+
+cryptography, pdfplumber, PyPDF2 and reportlab are imported by the
+functions that use them, so importing this module stays cheap for
+processes that never sign or annotate.
 """
 from __future__ import annotations
 
 import hashlib
+import io
 import json
 import logging
 import os
-import re
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable
-
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization import pkcs12
-from cryptography.hazmat.primitives.asymmetric import ed25519
-import pdfplumber
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.lib import colors
-from reportlab.pdfgen import canvas
-
-from plag_system.crypto_storage import decrypt_to_temp, is_encrypted
+from typing import Sequence
+
+from plag_system.alignment import align_passages
+from plag_system.corpus_index import CorpusLookup, get_corpus_index, merge_lookups
+from plag_system.page_cache import page_cache_for
+from plag_system.positions import TokenPositions, write_positions
+from plag_system.sharding import configured_shards, query_shards
+from plag_system.simhash import simhash
+from plag_system.submission_index import submissions_for
+from plag_system.text import (
+    gram_hash,
+    hashed_ngrams as _hashed_ngrams,
+    normalize as _normalize,
+    read_pages as _read_pages,
+    sentences as _sentences,
+)
+from plag_system.timings import StageTimings
 
 DEFAULT_CORPUS_DIR = Path(__file__).resolve().parent / "corpus"
 DEFAULT_KEYS_DIR = Path(__file__).resolve().parent / "keys"
 DEFAULT_KEYSTORE_NAME = "signing_key.p12"
+RANKING_METRICS = ("jaccard", "containment", "overlap")
+DEFAULT_RANKING_METRIC = os.getenv("PLAG_RANKING_METRIC", "jaccard")
+# Matched passages are aligned for this many of the best-ranked sources.
+ALIGN_TOP_K = int(os.getenv("PLAG_ALIGN_TOP_K", "5"))
 _LOGGER = logging.getLogger(__name__)
 
 
-def _read_text(path: Path) -> str:
-    if path.suffix.lower() != ".pdf":
-        raise ValueError("Only PDF files are supported.")
-    with path.open("rb") as file_handle:
-        header = file_handle.read(8)
-    temp_path = decrypt_to_temp(path) if is_encrypted(header) else path
-    try:
-        with pdfplumber.open(str(temp_path)) as pdf:
-            pages = [page.extract_text() or "" for page in pdf.pages]
-    finally:
-        if temp_path != path and temp_path.exists():
-            temp_path.unlink()
-    return "\n".join(pages)
-
-
-def _normalize(text: str) -> str:
-    return " ".join("".join(ch.lower() if ch.isalnum() else " " for ch in text).split())
-
-
-def _ngrams(text: str, n: int = 3) -> set[str]:
-    tokens = _normalize(text).split()
-    if len(tokens) < n:
-        return set()
-    return {" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)}
-
-
-def _sentences(text: str) -> list[str]:
-    parts = re.split(r"(?<=[.!?])\s+", text.strip())
-    return [sentence for sentence in parts if sentence]
+def _jaccard(intersection: int, size_a: int, size_b: int) -> float:
+    union = size_a + size_b - intersection
+    if union <= 0:
+        return 0.0
+    return intersection / union
 
 
-def _jaccard(a: set[str], b: set[str]) -> float:
-    if not a and not b:
-        return 0.0
-    return len(a & b) / len(a | b)
+def _containment(intersection: int, size: int) -> float:
+    return intersection / size if size else 0.0
 
 
 def _get_keystore_password() -> bytes:
@@ -80,6 +69,11 @@ def ensure_keypair(key_dir: Path | str = DEFAULT_KEYS_DIR) -> tuple[Path, bytes]
     """
     Ensure a PKCS#12 keystore exists and return (keystore_path, public_key_pem).
     """
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from cryptography.hazmat.primitives.serialization import pkcs12
+
     key_dir = Path(key_dir)
     key_dir.mkdir(parents=True, exist_ok=True)
     keystore_path = key_dir / DEFAULT_KEYSTORE_NAME
@@ -116,93 +110,383 @@ def ensure_keypair(key_dir: Path | str = DEFAULT_KEYS_DIR) -> tuple[Path, bytes]
 
 @dataclass
 class MatchResult:
-    """Container for a similarity match."""
+    """Container for a similarity match; ``score`` is the ranking metric's value."""
     path: str
     score: float
+    jaccard: float
+    containment: float
+    overlap: int
+    passages: list[dict] = field(default_factory=list)
 
 
-def _iter_corpus_files(corpus_dir: Path) -> Iterable[Path]:
-    if not corpus_dir.exists():
-        return []
-    return [p for p in corpus_dir.iterdir() if p.is_file() and p.suffix.lower() == ".pdf"]
+def _find_near_duplicate(
+    lookup: CorpusLookup,
+    corpus_dir: Path | str,
+    fingerprint: int,
+    submitter: str | None = None,
+) -> dict | None:
+    """Return the closest corpus document or earlier submission by SimHash, if any.
+
+    Earlier submissions of ``submitter`` (their own previous drafts) are skipped.
+    """
+    if lookup.near:
+        document, distance = lookup.near[0]
+        return {"kind": "corpus", "source": document.path, "distance": distance}
+    submission_matches = submissions_for(corpus_dir).query(fingerprint, submitter)
+    if submission_matches:
+        submission_id, distance = submission_matches[0]
+        return {"kind": "submission", "source": submission_id, "distance": distance}
+    return None
+
+
+def is_corpus_copy(near_duplicate: dict | None) -> bool:
+    """Return True when a near-duplicate is of a corpus document.
+
+    Only those are annotated by tinting whole pages; a near-duplicate of an
+    earlier submission still gets the word-level annotation of its matches.
+    """
+    return bool(near_duplicate) and near_duplicate["kind"] == "corpus"
 
 
-def analyze_file(  # pylint: disable=too-many-locals
+def analyze_file(
     file_path: Path | str,
     corpus_dir: Path | str = DEFAULT_CORPUS_DIR,
+    submission_id: str | None = None,
+    metric: str = DEFAULT_RANKING_METRIC,
+    collection_dirs: Sequence[Path | str] | None = None,
+    submitter: str | None = None,
 ) -> dict:
     """
     Analyze a single file against a local corpus and return a JSON-ready report.
+
+    Matches carry Jaccard, containment (share of the submission's n-grams
+    found in the source) and the raw overlap count, all derived from posting
+    hit counts; ``metric`` picks the one matches are ranked by. The top
+    ``ALIGN_TOP_K`` matches also list their matched ``passages`` with
+    character offsets and pages in both documents.
+    ``near_duplicate`` flags a near-verbatim copy of a corpus document or of
+    an earlier submission; passing ``submission_id`` records this file for
+    later submissions to be checked against. Earlier submissions by the same
+    ``submitter`` are not flagged, so a revised draft is not a copy of itself.
+    When ``PLAG_SHARDS`` lists shard
+    servers the corpus is queried through them (see
+    :mod:`plag_system.sharding`) and ``shards`` reports which answered.
+    ``collection_dirs`` compares against these corpus directories (each with
+    its own index) instead of ``corpus_dir``, which still keeps the earlier
+    submissions and the page cache.
     """
-    path = Path(file_path)
-    text = _read_text(path)
-    file_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
-    grams = _ngrams(text)
+    report, _, _ = _analyze(
+        file_path, corpus_dir, submission_id, metric, collection_dirs, submitter=submitter
+    )
+    return report
 
-    corpus_dir = Path(corpus_dir)
+
+@dataclass
+class _Submission:
+    """Extracted text, token positions and gram set of one submission."""
+    path: Path
+    text: str
+    positions: TokenPositions
+    grams: set[int]
+
+    @classmethod
+    def read(cls, file_path: Path | str, corpus_dir: Path | str) -> "_Submission":
+        """Extract ``file_path``, reusing cached page texts beside ``corpus_dir``'s index."""
+        path = Path(file_path)
+        page_cache = page_cache_for(corpus_dir)
+        pages = page_cache.read_pages(path) if page_cache else _read_pages(path)
+        positions = TokenPositions.from_pages(pages)
+        return cls(path, "\n".join(pages), positions, set(positions.grams))
+
+
+def _analyze(
+    file_path: Path | str,
+    corpus_dir: Path | str,
+    submission_id: str | None,
+    metric: str,
+    collection_dirs: Sequence[Path | str] | None = None,
+    timings: StageTimings | None = None,
+    submitter: str | None = None,
+    record: bool = True,
+) -> tuple[dict, set[int], TokenPositions]:
+    """Return the report together with the matched gram hashes and the token positions."""
+    # pylint: disable=too-many-arguments
+    if metric not in RANKING_METRICS:
+        raise ValueError(f"Unknown ranking metric: {metric}")
+    timings = timings or StageTimings()
+    with timings.stage("extraction"):
+        submission = _Submission.read(file_path, corpus_dir)
+    timings.count("pages", len(submission.positions.page_starts))
+    timings.count("bytes_processed", submission.path.stat().st_size)
+    grams = submission.grams
+    with timings.stage("comparison"):
+        fingerprint = simhash(grams)
+        shards = configured_shards()
+        if collection_dirs:
+            lookup = merge_lookups(
+                [
+                    get_corpus_index(directory).lookup(grams, fingerprint)
+                    for directory in collection_dirs
+                ]
+            )
+        elif shards:
+            lookup = query_shards(corpus_dir, shards, grams, fingerprint)
+        else:
+            lookup = get_corpus_index(corpus_dir).lookup(grams, fingerprint)
+        near_duplicate = (
+            _find_near_duplicate(lookup, corpus_dir, fingerprint, submitter) if grams else None
+        )
+        if record and submission_id and grams:
+            submissions_for(corpus_dir).add(submission_id, fingerprint, submitter)
+    timings.count("corpus_documents_scored", len(lookup.candidates))
+    report = _report(submission, lookup, near_duplicate, metric, timings)
+    return report, lookup.matched, submission.positions
+
+
+def record_submission(
+    corpus_dir: Path | str,
+    submission_id: str,
+    positions: TokenPositions,
+    submitter: str | None = None,
+) -> None:
+    """Add a stored submission to the ones later submissions are checked against.
+
+    For callers of :func:`analyze_and_sign` with ``record`` False, once the
+    report has been stored.
+    """
+    grams = set(positions.grams)
+    if grams:
+        submissions_for(corpus_dir).add(submission_id, simhash(grams), submitter)
+
+
+def analyze_batch(
+    file_paths: Sequence[Path | str],
+    corpus_dir: Path | str = DEFAULT_CORPUS_DIR,
+    metric: str = DEFAULT_RANKING_METRIC,
+    collection_dirs: Sequence[Path | str] | None = None,
+) -> list[dict]:
+    """
+    Analyze several files at once, e.g. a whole class or a re-grade after a
+    corpus update, returning the :func:`analyze_file` report of each.
+
+    The corpus is scored for all files in one sparse product
+    (:meth:`CorpusIndex.lookup_batch`) instead of one posting traversal per
+    file. Sharded corpora (``PLAG_SHARDS``) are still queried file by file.
+    Nothing is recorded as an earlier submission.
+    """
+    if metric not in RANKING_METRICS:
+        raise ValueError(f"Unknown ranking metric: {metric}")
+    submissions = [_Submission.read(path, corpus_dir) for path in file_paths]
+    gram_sets = [submission.grams for submission in submissions]
+    fingerprints = [simhash(grams) for grams in gram_sets]
+    shards = configured_shards()
+    if collection_dirs:
+        per_collection = [
+            get_corpus_index(directory).lookup_batch(gram_sets, fingerprints)
+            for directory in collection_dirs
+        ]
+        lookups = [merge_lookups(list(group)) for group in zip(*per_collection)]
+    elif shards:
+        lookups = [
+            query_shards(corpus_dir, shards, grams, fingerprint)
+            for grams, fingerprint in zip(gram_sets, fingerprints)
+        ]
+    else:
+        lookups = get_corpus_index(corpus_dir).lookup_batch(gram_sets, fingerprints)
+    reports = []
+    for submission, lookup, fingerprint in zip(submissions, lookups, fingerprints):
+        near_duplicate = (
+            _find_near_duplicate(lookup, corpus_dir, fingerprint) if submission.grams else None
+        )
+        reports.append(_report(submission, lookup, near_duplicate, metric))
+    return reports
+
+
+def rescore_submission(
+    positions: TokenPositions,
+    lookup: CorpusLookup,
+    sources: set[str],
+) -> dict:
+    """Re-score a stored submission against the current corpus without extracting it again.
+
+    ``lookup`` is the corpus lookup of ``set(positions.grams)``. Returns the
+    updated ``plagiarism_percentage`` and ``matching_ngrams``, plus the
+    matched passages of every candidate whose path is in ``sources``.
+    """
+    scored = len(set(positions.grams)) - len(lookup.excluded)
+    passages = {}
+    for document, _, _ in lookup.candidates:
+        if document.path not in sources:
+            continue
+        source = lookup.positions(document)
+        if source is not None:
+            passages[document.path] = align_passages(
+                positions, source, skip=lookup.skip(document)
+            )
+    return {
+        "plagiarism_percentage": (
+            round((len(lookup.matched) / scored) * 100, 2) if scored else 0.0
+        ),
+        "matching_ngrams": len(lookup.matched),
+        "passages": passages,
+    }
+
+
+def _report(  # pylint: disable=too-many-locals
+    submission: _Submission,
+    lookup: CorpusLookup,
+    near_duplicate: dict | None,
+    metric: str,
+    timings: StageTimings | None = None,
+) -> dict:
+    """Score the corpus candidates of one submission and build its report."""
+    timings = timings or StageTimings()
+    text, positions = submission.text, submission.positions
+    # Stop-grams are left out of the postings and of corpus gram counts alike.
+    scored = len(submission.grams) - len(lookup.excluded)
+    unique_matches = lookup.matched
     matches: list[MatchResult] = []
-    unique_matches: set[str] = set()
-    for corpus_file in _iter_corpus_files(corpus_dir):
-        corpus_text = _read_text(corpus_file)
-        corpus_grams = _ngrams(corpus_text)
-        overlap = grams & corpus_grams
-        unique_matches |= overlap
-        score = _jaccard(grams, corpus_grams)
-        if score > 0:
-            matches.append(MatchResult(path=str(corpus_file), score=round(score, 4)))
-
-    matches.sort(key=lambda item: item.score, reverse=True)
-    top_score = matches[0].score if matches else 0.0
-
-    sentences = _sentences(text)
-    matching_sentences = 0
-    for sentence in sentences:
-        sentence_grams = _ngrams(sentence)
-        if sentence_grams and (sentence_grams & unique_matches):
-            matching_sentences += 1
+    documents = {}
+    with timings.stage("scoring"):
+        for document, intersection, document_scored in lookup.candidates:
+            documents[document.path] = document
+            jaccard = round(_jaccard(intersection, document_scored, document.gram_count), 4)
+            containment = round(_containment(intersection, document_scored), 4)
+            scores = {"jaccard": jaccard, "containment": containment, "overlap": intersection}
+            matches.append(
+                MatchResult(
+                    path=document.path,
+                    score=scores[metric],
+                    jaccard=jaccard,
+                    containment=containment,
+                    overlap=intersection,
+                )
+            )
+        matches.sort(key=lambda item: item.score, reverse=True)
+    with timings.stage("alignment"):
+        for match in matches[:ALIGN_TOP_K]:
+            document = documents[match.path]
+            source = lookup.positions(document)
+            if source is not None:
+                match.passages = align_passages(positions, source, skip=lookup.skip(document))
+    # Overlap counts are not a ratio; report the top match's containment instead.
+    percent_metric = "jaccard" if metric == "jaccard" else "containment"
+    top_score = getattr(matches[0], percent_metric) if matches else 0.0
+
+    with timings.stage("sentence_matching"):
+        sentences = _sentences(text)
+        matching_sentences = 0
+        for sentence in sentences:
+            sentence_grams = _hashed_ngrams(sentence)
+            if sentence_grams and (sentence_grams & unique_matches):
+                matching_sentences += 1
 
     total_sentences = len(sentences)
     non_matching_sentences = max(total_sentences - matching_sentences, 0)
 
     return {
-        "file": str(path),
-        "sha256": file_hash,
+        "file": str(submission.path),
+        "sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
         "word_count": len(_normalize(text).split()),
         "unique_words": len(set(_normalize(text).split())),
         "matches": [match.__dict__ for match in matches[:10]],
+        "ranking_metric": metric,
         "similarity_percent": round(top_score * 100, 2),
         "matching_ngrams": len(unique_matches),
         "plagiarism_percentage": (
-            round((len(unique_matches) / len(grams)) * 100, 2) if grams else 0.0
+            round((len(unique_matches) / scored) * 100, 2) if scored else 0.0
         ),
         "total_sentences": total_sentences,
         "matching_sentences": matching_sentences,
         "non_matching_sentences": non_matching_sentences,
+        "near_duplicate": near_duplicate,
+        "stopgrams": {
+            "max_df": lookup.stopgram_max_df,
+            "corpus_excluded": lookup.stopgram_count,
+            "excluded_ngrams": len(lookup.excluded),
+        },
+        "shards": lookup.shards,
     }
 
 
+def write_matched_grams(path: Path | str, grams: set[int]) -> Path:
+    """Store matched gram hashes so the annotated PDF can be rendered later."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as handle:
+        array("Q", sorted(grams)).tofile(handle)
+    return path
+
+
+def read_matched_grams(path: Path | str) -> set[int]:
+    """Load gram hashes written by :func:`write_matched_grams`."""
+    grams = array("Q")
+    grams.frombytes(Path(path).read_bytes())
+    return set(grams)
+
+
 def analyze_and_sign(
     file_path: Path | str,
     corpus_dir: Path | str = DEFAULT_CORPUS_DIR,
     key_dir: Path | str = DEFAULT_KEYS_DIR,
     annotated_pdf_path: Path | str | None = None,
+    submission_id: str | None = None,
+    metric: str = DEFAULT_RANKING_METRIC,
+    matched_grams_path: Path | str | None = None,
+    collection_dirs: Sequence[Path | str] | None = None,
+    positions_path: Path | str | None = None,
+    timings: StageTimings | None = None,
+    submitter: str | None = None,
+    record: bool = True,
 ) -> dict:
     """
     Analyze the file and sign the report for integrity verification.
+
+    ``matched_grams_path`` stores the matched gram hashes instead of
+    annotating now; pass them to :func:`annotate_pdf` when the annotated PDF
+    is first needed. ``positions_path`` stores the submission's token
+    positions so it can be re-scored later with :func:`rescore_submission`.
+    ``collection_dirs`` and ``submitter`` are passed to :func:`analyze_file`. ``timings``
+    records the duration of each stage (see :mod:`plag_system.timings`); it
+    is never part of the report, so the signed payload does not change.
+    With ``record`` False the submission is not added to the earlier
+    submissions yet; call :func:`record_submission` once the report is stored.
     """
-    report = analyze_file(file_path, corpus_dir=corpus_dir)
-    if annotated_pdf_path:
-        annotate_pdf(file_path, corpus_dir=corpus_dir, output_path=annotated_pdf_path)
-    keystore_path, public_key_pem = ensure_keypair(key_dir=key_dir)
-    password = _get_keystore_password()
-    private_key, _, _ = pkcs12.load_key_and_certificates(
-        keystore_path.read_bytes(),
-        password,
+    # pylint: disable=too-many-arguments,too-many-locals
+    timings = timings or StageTimings()
+    report, matched, positions = _analyze(
+        file_path, corpus_dir, submission_id, metric, collection_dirs, timings, submitter, record
     )
-    if private_key is None:
-        raise ValueError("Signing keystore did not contain a private key.")
-    payload = json.dumps(report, sort_keys=True).encode("utf-8")
-    signature = private_key.sign(payload)
+    with timings.stage("storage"):
+        if matched_grams_path:
+            write_matched_grams(matched_grams_path, matched)
+        if positions_path:
+            write_positions(positions_path, positions)
+    if annotated_pdf_path:
+        with timings.stage("annotation"):
+            if is_corpus_copy(report["near_duplicate"]):
+                annotate_near_duplicate(file_path, report["near_duplicate"], annotated_pdf_path)
+            else:
+                annotate_pdf(
+                    file_path,
+                    corpus_dir=corpus_dir,
+                    output_path=annotated_pdf_path,
+                    matched=matched,
+                )
+    with timings.stage("signing"):
+        # pylint: disable=import-outside-toplevel
+        from cryptography.hazmat.primitives.serialization import pkcs12
+
+        keystore_path, public_key_pem = ensure_keypair(key_dir=key_dir)
+        password = _get_keystore_password()
+        private_key, _, _ = pkcs12.load_key_and_certificates(
+            keystore_path.read_bytes(),
+            password,
+        )
+        if private_key is None:
+            raise ValueError("Signing keystore did not contain a private key.")
+        payload = json.dumps(report, sort_keys=True).encode("utf-8")
+        signature = private_key.sign(payload)
 
     report["signature"] = signature.hex()
     report["public_key"] = public_key_pem.decode("utf-8")
@@ -214,18 +498,28 @@ def annotate_pdf(  # pylint: disable=too-many-locals
     corpus_dir: Path | str = DEFAULT_CORPUS_DIR,
     output_path: Path | str = "annotated.pdf",
     ngram_size: int = 3,
+    matched: set[int] | None = None,
 ) -> Path:
     """
     Generate an annotated PDF highlighting matched n-grams.
+
+    ``matched`` is the set of matched gram hashes from the analysis; without
+    it every n-gram is looked up in the corpus index.
     """
+    # pylint: disable=import-outside-toplevel
+    import pdfplumber
+    from PyPDF2 import PdfReader, PdfWriter
+    from reportlab.lib import colors
+    from reportlab.pdfgen import canvas
+
     file_path = Path(file_path)
     corpus_dir = Path(corpus_dir)
     output_path = Path(output_path)
 
-    corpus_ngrams: set[str] = set()
-    for corpus_file in _iter_corpus_files(corpus_dir):
-        corpus_text = _read_text(corpus_file)
-        corpus_ngrams |= _ngrams(corpus_text, n=ngram_size)
+    if matched is None:
+        is_match = get_corpus_index(corpus_dir, ngram_size=ngram_size).contains
+    else:
+        is_match = matched.__contains__
 
     reader = PdfReader(str(file_path))
     writer = PdfWriter()
@@ -241,7 +535,7 @@ def annotate_pdf(  # pylint: disable=too-many-locals
             marked_indices: set[int] = set()
             for idx in range(len(tokens) - ngram_size + 1):
                 ngram = " ".join(tokens[idx : idx + ngram_size])
-                if ngram and ngram in corpus_ngrams:
+                if ngram and is_match(gram_hash(ngram)):
                     marked_indices.update(range(idx, idx + ngram_size))
 
             overlay_path = output_path.with_suffix(f".overlay.{page_index}.pdf")
@@ -277,3 +571,103 @@ def annotate_pdf(  # pylint: disable=too-many-locals
         writer.write(output_handle)
 
     return output_path
+
+
+def annotate_near_duplicate(
+    file_path: Path | str,
+    near_duplicate: dict,
+    output_path: Path | str = "annotated.pdf",
+) -> Path:
+    """
+    Mark every page of a near-duplicate submission without per-word matching.
+
+    The whole document is a copy, so the pages are tinted and labelled with
+    the source instead of extracting and looking up every n-gram.
+    """
+    # pylint: disable=import-outside-toplevel
+    from PyPDF2 import PdfReader, PdfWriter
+    from reportlab.lib import colors
+    from reportlab.pdfgen import canvas
+
+    output_path = Path(output_path)
+    source = Path(near_duplicate["source"]).name
+    label = (
+        f"Near-duplicate of {near_duplicate['kind']} {source} "
+        f"(SimHash distance {near_duplicate['distance']})"
+    )
+    reader = PdfReader(str(file_path))
+    writer = PdfWriter()
+    overlays: dict[tuple[float, float], object] = {}
+    for base_page in reader.pages:
+        page_width = float(base_page.mediabox.width)
+        page_height = float(base_page.mediabox.height)
+        overlay_page = overlays.get((page_width, page_height))
+        if overlay_page is None:
+            buffer = io.BytesIO()
+            overlay_canvas = canvas.Canvas(buffer, pagesize=(page_width, page_height))
+            overlay_canvas.setFillColor(colors.Color(1, 0.95, 0.4, alpha=0.35))
+            overlay_canvas.rect(0, 0, page_width, page_height, fill=1, stroke=0)
+            overlay_canvas.setFillColor(colors.Color(0.6, 0, 0))
+            overlay_canvas.drawString(24, page_height - 24, label)
+            overlay_canvas.save()
+            overlay_page = PdfReader(buffer).pages[0]
+            overlays[(page_width, page_height)] = overlay_page
+        base_page.merge_page(overlay_page)
+        writer.add_page(base_page)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open("wb") as output_handle:
+        writer.write(output_handle)
+
+    return output_path
+
+
+def annotate_source_pdf(
+    source_path: Path | str,
+    positions: TokenPositions,
+    spans: list[tuple[int, int]],
+    output_path: Path | str = "annotated_source.pdf",
+) -> Path:
+    """
+    Highlight matched passages on a corpus document.
+
+    ``spans`` are source character spans from a report's ``passages``; the
+    word boxes come from the positions stored when the document was indexed,
+    so the source PDF is not extracted again.
+    """
+    # pylint: disable=import-outside-toplevel
+    from PyPDF2 import PdfReader, PdfWriter
+    from reportlab.lib import colors
+    from reportlab.pdfgen import canvas
+
+    output_path = Path(output_path)
+    boxes: dict[int, list] = {}
+    for start, end in spans:
+        for page_number, page_boxes in positions.boxes_between(start, end).items():
+            boxes.setdefault(page_number, []).extend(page_boxes)
+
+    reader = PdfReader(str(source_path))
+    writer = PdfWriter()
+    for page_number, base_page in enumerate(reader.pages, start=1):
+        if page_number in boxes:
+            left = float(base_page.mediabox.left)
+            page_top = float(base_page.mediabox.top)
+            buffer = io.BytesIO()
+            overlay_canvas = canvas.Canvas(
+                buffer,
+                pagesize=(float(base_page.mediabox.right), page_top),
+            )
+            overlay_canvas.setFillColor(colors.Color(1, 0.95, 0.4, alpha=0.35))
+            for x0, top, x1, bottom in boxes[page_number]:
+                overlay_canvas.rect(
+                    left + x0, page_top - bottom, x1 - x0, bottom - top, fill=1, stroke=0
+                )
+            overlay_canvas.save()
+            base_page.merge_page(PdfReader(buffer).pages[0])
+        writer.add_page(base_page)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with output_path.open("wb") as output_handle:
+        writer.write(output_handle)
+
+    return output_path
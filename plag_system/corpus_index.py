@@ -0,0 +1,613 @@
+"""
+Corpus fingerprint index shared across scans.
+
+Extracting every corpus PDF is by far the most expensive part of a scan, so
+the n-gram fingerprints of the corpus are kept in a segmented, memory-mapped
+index next to the corpus (see :mod:`plag_system.index_store`). Corpus uploads
+and deletions update it incrementally, every worker process maps the same
+segment files, and a worker notices another process's update by a cheap
+``stat`` of the manifest.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable
+
+from plag_system.bloom import BloomFilter, fit_budget
+from plag_system.index_store import (
+    MAX_DEAD_RATIO,
+    MAX_SEGMENTS,
+    IndexStore,
+    Manifest,
+    compact_in_background,
+    compact_now,
+    is_live,
+    stopgrams_due,
+)
+from plag_system.mmap_index import IndexFormatError, MappedIndex
+from plag_system.positions import TokenPositions, read_positions
+from plag_system.simhash import MAX_DISTANCE, SimHashIndex
+from plag_system.sparse import CsrMatrix, intersection_counts
+from plag_system.text import DEFAULT_NGRAM_SIZE
+
+_LOGGER = logging.getLogger(__name__)
+
+INDEX_DIR_NAME = ".index"
+LEGACY_INDEX_FILE = "corpus.idx"
+
+CorpusSignature = tuple[tuple[str, int, int], ...]
+# ``(shard number, shard count)`` of a partitioned index; None indexes everything.
+Shard = tuple[int, int]
+
+
+@dataclass(frozen=True)
+class CorpusDocument:
+    """A live document of the corpus as recorded in the index."""
+    path: str
+    size: int
+    mtime_ns: int
+    gram_count: int
+    content_hash: int = 0
+    simhash: int = 0
+
+
+def iter_corpus_files(corpus_dir: Path) -> Iterable[Path]:
+    """Return the PDF files directly inside the corpus directory."""
+    if not corpus_dir.exists():
+        return []
+    return [p for p in corpus_dir.iterdir() if p.is_file() and p.suffix.lower() == ".pdf"]
+
+
+def shard_of(name: str, shard_count: int) -> int:
+    """Return the shard a corpus file belongs to (stable across processes)."""
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % shard_count
+
+
+def corpus_signature(corpus_dir: Path | str, shard: Shard | None = None) -> CorpusSignature:
+    """Return a cheap (name, size, mtime) listing used to detect corpus changes.
+
+    With ``shard`` only the files of that shard are listed.
+    """
+    entries = []
+    for path in iter_corpus_files(Path(corpus_dir)):
+        if shard is not None and shard_of(path.name, shard[1]) != shard[0]:
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((path.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sorted(entries))
+
+
+def index_dir_for(corpus_dir: Path | str) -> Path:
+    """Return where the index of ``corpus_dir`` is stored.
+
+    ``PLAG_INDEX_DIR`` overrides the location; otherwise the index lives in
+    a hidden directory inside the corpus, falling back to the temp directory
+    when the corpus is read-only.
+    """
+    corpus_dir = Path(corpus_dir).resolve()
+    override = os.getenv("PLAG_INDEX_DIR")
+    if override:
+        digest = hashlib.sha256(str(corpus_dir).encode("utf-8")).hexdigest()[:16]
+        return Path(override) / digest
+    local = corpus_dir / INDEX_DIR_NAME
+    if os.access(corpus_dir, os.W_OK) or local.exists():
+        return local
+    digest = hashlib.sha256(str(corpus_dir).encode("utf-8")).hexdigest()[:16]
+    return Path(tempfile.gettempdir()) / f"plag-index-{digest}"
+
+
+def store_for(
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    shard: Shard | None = None,
+) -> IndexStore:
+    """Return the index store of ``corpus_dir`` for the given n-gram size (and shard)."""
+    name = f"n{ngram_size}" if shard is None else f"n{ngram_size}-s{shard[0]}of{shard[1]}"
+    return IndexStore(index_dir_for(corpus_dir) / name, ngram_size)
+
+
+@dataclass
+class CorpusLookup:
+    """What a scan needs from the corpus for one submission's gram set.
+
+    Produced by :meth:`CorpusIndex.lookup`, or merged from several shards by
+    :func:`plag_system.sharding.query_shards`.
+    """
+    # (document, grams it shares with the submission, scored submission grams)
+    candidates: list[tuple[CorpusDocument, int, int]]
+    matched: set[int]
+    excluded: set[int]
+    near: list[tuple[CorpusDocument, int]]
+    stopgram_count: int
+    stopgram_max_df: int | None
+    positions: Callable[[CorpusDocument], TokenPositions | None]
+    skip: Callable[[CorpusDocument], Callable[[int], bool]]
+    shards: dict | None = None
+
+
+def merge_lookups(lookups: list[CorpusLookup]) -> CorpusLookup:
+    """Combine the lookups of disjoint indexes (shards or collections) into one.
+
+    Each candidate keeps the scored gram count of the index it came from,
+    and positions and stop-grams are answered by that index.
+    """
+    owners: dict[str, CorpusLookup] = {}
+    candidates: list[tuple[CorpusDocument, int, int]] = []
+    near: list[tuple[CorpusDocument, int]] = []
+    for lookup in lookups:
+        for candidate in lookup.candidates:
+            owners[candidate[0].path] = lookup
+            candidates.append(candidate)
+        near.extend(lookup.near)
+    # Same order as a single index: by document name.
+    candidates.sort(key=lambda candidate: candidate[0].path)
+    near.sort(key=lambda item: (item[1], item[0].path))
+    max_dfs = [lookup.stopgram_max_df for lookup in lookups if lookup.stopgram_max_df is not None]
+    return CorpusLookup(
+        candidates=candidates,
+        matched=set().union(*(lookup.matched for lookup in lookups)),
+        excluded=set().union(*(lookup.excluded for lookup in lookups)),
+        near=near,
+        stopgram_count=sum(lookup.stopgram_count for lookup in lookups),
+        stopgram_max_df=max(max_dfs) if max_dfs else None,
+        positions=lambda document: owners[document.path].positions(document),
+        skip=lambda document: owners[document.path].skip(document),
+    )
+
+
+class CorpusIndex:
+    """Read-only query view over the committed segments of one corpus index."""
+
+    def __init__(
+        self,
+        corpus_dir: Path,
+        manifest: Manifest,
+        segments: list[tuple[int, MappedIndex]],
+        token: tuple[int, int] | None,
+        stopgrams: array | None = None,
+        store: IndexStore | None = None,
+        shard: Shard | None = None,
+    ) -> None:
+        # pylint: disable=too-many-arguments
+        self.corpus_dir = corpus_dir
+        self.store = store
+        self.shard = shard
+        self.stopgrams = stopgrams if stopgrams is not None else array("Q")
+        # Document-frequency cutoff the stop-grams were computed with, if any.
+        self.stopgram_max_df: int | None = manifest.stopgrams.get("max_df")
+        self.manifest = manifest
+        self.generation = manifest.generation
+        self.ngram_size = manifest.ngram_size
+        self.token = token
+        self.segments = [mapped for _, mapped in segments]
+
+        live = []
+        self._local_ids: list[list[int]] = []
+        for segment_index, (seq, mapped) in enumerate(segments):
+            self._local_ids.append([-1] * len(mapped.documents))
+            for local_id, doc in enumerate(mapped.documents):
+                if is_live(doc.name, seq, manifest):
+                    live.append((doc.name, segment_index, local_id, doc))
+        live.sort(key=lambda item: item[0])
+
+        self.documents: list[CorpusDocument] = []
+        for doc_id, (name, segment_index, local_id, doc) in enumerate(live):
+            self._local_ids[segment_index][local_id] = doc_id
+            self.documents.append(
+                CorpusDocument(
+                    path=str(corpus_dir / name),
+                    size=doc.size,
+                    mtime_ns=doc.mtime_ns,
+                    gram_count=doc.gram_count,
+                    content_hash=doc.content_hash,
+                    simhash=doc.simhash,
+                )
+            )
+        self.dead_documents = sum(ids.count(-1) for ids in self._local_ids)
+        # Duplicate file name -> name of the indexed document with the same text.
+        self.aliases = {name: canonical for name, (canonical, *_) in manifest.aliases.items()}
+        known = [(name, doc.size, doc.mtime_ns) for name, _, _, doc in live]
+        known.extend((name, size, mtime_ns) for name, (size, mtime_ns) in manifest.skipped.items())
+        known.extend(
+            (name, size, mtime_ns) for name, (_, size, mtime_ns) in manifest.aliases.items()
+        )
+        self.signature: CorpusSignature = tuple(sorted(known))
+        self._simhash_index: SimHashIndex[int] | None = None
+        self._blooms: list[BloomFilter | None] | None = None
+
+    @property
+    def blooms(self) -> list[BloomFilter | None]:
+        """Per-segment Bloom filters, loaded on first use and folded to the memory budget."""
+        if self._blooms is None:
+            blooms = self.store.load_blooms(self.manifest) if self.store else []
+            blooms.extend([None] * (len(self.segments) - len(blooms)))
+            fit_budget(blooms)
+            self._blooms = blooms
+        return self._blooms
+
+    def is_stopgram(self, gram: int) -> bool:
+        """Return True for grams too common in the corpus to be scored."""
+        position = bisect.bisect_left(self.stopgrams, gram)
+        return position < len(self.stopgrams) and self.stopgrams[position] == gram
+
+    def _live_postings(self, gram: int) -> Iterable[int]:
+        for mapped, local_ids, bloom in zip(self.segments, self._local_ids, self.blooms):
+            # A Bloom miss is definite; a hit is confirmed by the postings.
+            if bloom is not None and gram not in bloom:
+                continue
+            for local_id in mapped.postings(gram):
+                doc_id = local_ids[local_id]
+                if doc_id >= 0:
+                    yield doc_id
+
+    def contains(self, gram: int) -> bool:
+        """Return True when any live corpus document contains ``gram`` (stop-grams excluded)."""
+        if self.is_stopgram(gram):
+            return False
+        return next(iter(self._live_postings(gram)), None) is not None
+
+    def overlap_counts(self, grams: Iterable[int]) -> tuple[dict[int, int], set[int]]:
+        """Per-document hit counts for ``grams`` plus the set of matched grams.
+
+        Stop-grams are skipped.
+        """
+        counts: dict[int, int] = {}
+        matched: set[int] = set()
+        for gram in grams:
+            if self.is_stopgram(gram):
+                continue
+            for doc_id in self._live_postings(gram):
+                matched.add(gram)
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+        return counts, matched
+
+    @property
+    def gram_count(self) -> int:
+        """Distinct grams across segments (an upper bound when segments overlap)."""
+        return sum(mapped.gram_count for mapped in self.segments)
+
+    def needs_compaction(self) -> bool:
+        """Return True when deltas or tombstoned documents have piled up."""
+        total = len(self.documents) + self.dead_documents
+        return (
+            len(self.segments) > MAX_SEGMENTS
+            or (bool(total) and self.dead_documents / total > MAX_DEAD_RATIO)
+            or stopgrams_due(self.manifest, len(self.documents))
+        )
+
+    def positions(self, document: CorpusDocument) -> TokenPositions | None:
+        """Return the token positions stored for ``document`` at index time, if any."""
+        if self.store is None:
+            return None
+        try:
+            return read_positions(self.store.positions_path(document.content_hash))
+        except (OSError, IndexFormatError):
+            return None
+
+    def lookup(self, grams: set[int], fingerprint: int) -> CorpusLookup:
+        """Score ``grams`` against the corpus; stop-grams are excluded."""
+        excluded = {gram for gram in grams if self.is_stopgram(gram)}
+        scored = len(grams) - len(excluded)
+        counts, matched = self.overlap_counts(grams - excluded)
+        return CorpusLookup(
+            candidates=[
+                (self.documents[doc_id], intersection, scored)
+                for doc_id, intersection in sorted(counts.items())
+            ],
+            matched=matched,
+            excluded=excluded,
+            near=self.near_duplicates(fingerprint) if grams else [],
+            stopgram_count=len(self.stopgrams),
+            stopgram_max_df=self.stopgram_max_df,
+            positions=self.positions,
+            skip=lambda _document: self.is_stopgram,
+        )
+
+    def lookup_batch(
+        self,
+        gram_sets: list[set[int]],
+        fingerprints: list[int],
+    ) -> list[CorpusLookup]:
+        """:meth:`lookup` for several submissions at once.
+
+        The submissions' grams form a sparse submission x gram matrix that is
+        multiplied with the gram x document incidence of the corpus (see
+        :mod:`plag_system.sparse`), so every distinct gram's postings are read
+        once for the whole batch.
+        """
+        excluded_sets = [
+            {gram for gram in grams if self.is_stopgram(gram)} for grams in gram_sets
+        ]
+        vocabulary = sorted(set().union(*gram_sets) - set().union(*excluded_sets))
+        columns = {gram: column for column, gram in enumerate(vocabulary)}
+        incidence = CsrMatrix.from_rows(
+            (sorted(set(self._live_postings(gram))) for gram in vocabulary),
+            len(self.documents),
+        )
+        submissions = CsrMatrix.from_rows(
+            (
+                sorted(columns[gram] for gram in grams - excluded)
+                for grams, excluded in zip(gram_sets, excluded_sets)
+            ),
+            len(vocabulary),
+        )
+        lookups = []
+        for number, counts in enumerate(intersection_counts(submissions, incidence)):
+            grams, excluded = gram_sets[number], excluded_sets[number]
+            scored = len(grams) - len(excluded)
+            lookups.append(
+                CorpusLookup(
+                    candidates=[
+                        (self.documents[doc_id], intersection, scored)
+                        for doc_id, intersection in sorted(counts.items())
+                    ],
+                    matched={
+                        vocabulary[column]
+                        for column in submissions.row(number)
+                        if incidence.indptr[column + 1] > incidence.indptr[column]
+                    },
+                    excluded=excluded,
+                    near=self.near_duplicates(fingerprints[number]) if grams else [],
+                    stopgram_count=len(self.stopgrams),
+                    stopgram_max_df=self.stopgram_max_df,
+                    positions=self.positions,
+                    skip=lambda _document: self.is_stopgram,
+                )
+            )
+        return lookups
+
+    def near_duplicates(self, fingerprint: int) -> list[tuple[CorpusDocument, int]]:
+        """Return live documents whose SimHash is within ``MAX_DISTANCE`` bits, closest first."""
+        if self._simhash_index is None:
+            lookup: SimHashIndex[int] = SimHashIndex()
+            for doc_id, doc in enumerate(self.documents):
+                if doc.gram_count:
+                    lookup.add(doc_id, doc.simhash)
+            self._simhash_index = lookup
+        return [
+            (self.documents[doc_id], distance)
+            for doc_id, distance in self._simhash_index.query(fingerprint)
+        ]
+
+    def duplicates(self, max_distance: int = MAX_DISTANCE) -> dict:
+        """Report exact duplicates (aliases) and near-duplicate document pairs."""
+        groups: dict[str, list[str]] = {}
+        for name, canonical in sorted(self.aliases.items()):
+            groups.setdefault(canonical, []).append(name)
+        near = []
+        seen: SimHashIndex[int] = SimHashIndex(max_distance)
+        for doc_id, doc in enumerate(self.documents):
+            if not doc.gram_count:
+                continue
+            for other_id, distance in seen.query(doc.simhash):
+                near.append(
+                    {
+                        "files": [Path(self.documents[other_id].path).name, Path(doc.path).name],
+                        "distance": distance,
+                    }
+                )
+            seen.add(doc_id, doc.simhash)
+        near.sort(key=lambda pair: (pair["distance"], pair["files"]))
+        return {
+            "exact": [
+                {"file": canonical, "duplicates": names}
+                for canonical, names in sorted(groups.items())
+            ],
+            "near": near,
+        }
+
+    def is_current(self) -> bool:
+        """Return True when the corpus directory matches the indexed documents."""
+        return corpus_signature(self.corpus_dir, self.shard) == self.signature
+
+
+def _listing_diff(corpus_dir: Path, index: CorpusIndex) -> tuple[list[str], list[str]]:
+    on_disk = {
+        name: (size, mtime_ns)
+        for name, size, mtime_ns in corpus_signature(corpus_dir, index.shard)
+    }
+    indexed = {name: (size, mtime_ns) for name, size, mtime_ns in index.signature}
+    added = [name for name, stat in on_disk.items() if indexed.get(name) != stat]
+    removed = [name for name in indexed if name not in on_disk]
+    return added, removed
+
+
+_CACHE: dict[tuple[str, int, Shard | None], CorpusIndex] = {}
+_CACHE_LOCK = threading.Lock()
+# Queries answered by a cached view, and queries that had to refresh it.
+_CACHE_STATS = {"hits": 0, "misses": 0}
+# Resolved corpus directories whose listing queries do not compare with the index.
+_UNVERIFIED_LISTINGS: set[str] = set()
+
+
+def _reset_after_fork() -> None:
+    """Replace the cache lock, which a parent thread may have held at fork time."""
+    global _CACHE_LOCK  # pylint: disable=global-statement
+    _CACHE_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def set_listing_verification(enabled: bool, corpus_dir: Path | str) -> None:
+    """Choose whether queries of ``corpus_dir`` compare its listing with the index.
+
+    A corpus watcher that batches out-of-band changes turns this off for the
+    directory it watches so a scan never pays for (or races with) a
+    half-finished bulk copy; other corpora, such as collections, keep it.
+    """
+    key = str(Path(corpus_dir).resolve())
+    if enabled:
+        _UNVERIFIED_LISTINGS.discard(key)
+    else:
+        _UNVERIFIED_LISTINGS.add(key)
+
+
+def _verifies_listing(corpus_dir: Path | str) -> bool:
+    return str(Path(corpus_dir).resolve()) not in _UNVERIFIED_LISTINGS
+
+
+def update_corpus_index(
+    corpus_dir: Path | str,
+    added: Iterable[str] | None = None,
+    removed: Iterable[str] | None = None,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    reconcile: bool = True,
+    shard: Shard | None = None,
+    background_compaction: bool = True,
+) -> CorpusIndex:
+    """Apply corpus changes to the index and return a fresh view.
+
+    ``added``/``removed`` are corpus file names. When both are None the
+    index is reconciled with the directory listing instead, unless
+    ``reconcile`` is False and the index has been built before. A ``shard``
+    index only holds the files :func:`shard_of` assigns to it. Without
+    ``background_compaction`` a due compaction runs before returning.
+    """
+    # pylint: disable=too-many-arguments
+    corpus_dir = Path(corpus_dir)
+    store = store_for(corpus_dir, ngram_size, shard)
+    if shard is not None:
+        added = None if added is None else [n for n in added if shard_of(n, shard[1]) == shard[0]]
+    with store.lock():
+        manifest = store.recover(corpus_dir)
+        # Single-file index written by earlier releases.
+        (store.index_dir.parent / LEGACY_INDEX_FILE).unlink(missing_ok=True)
+        index = CorpusIndex(
+            corpus_dir,
+            manifest,
+            store.open_segments(manifest),
+            None,
+            store.load_stopgrams(manifest),
+            store,
+            shard,
+        )
+        if added is None and removed is None and (reconcile or not manifest.generation):
+            added, removed = _listing_diff(corpus_dir, index)
+        updated = store.update(corpus_dir, manifest, added=added or (), removed=removed or ())
+        if updated is not manifest:
+            index = CorpusIndex(
+                corpus_dir,
+                updated,
+                store.open_segments(updated),
+                None,
+                store.load_stopgrams(updated),
+                store,
+                shard,
+            )
+        index.token = store.change_token()
+    if index.needs_compaction():
+        if background_compaction:
+            compact_in_background(store)
+        elif compact_now(store):
+            with store.lock():
+                manifest = store.read_manifest()
+                index = CorpusIndex(
+                    corpus_dir,
+                    manifest,
+                    store.open_segments(manifest),
+                    None,
+                    store.load_stopgrams(manifest),
+                    store,
+                    shard,
+                )
+                index.token = store.change_token()
+    with _CACHE_LOCK:
+        _CACHE[(str(corpus_dir.resolve()), ngram_size, shard)] = index
+    return index
+
+
+def get_corpus_index(
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    verify_listing: bool | None = None,
+    shard: Shard | None = None,
+) -> CorpusIndex:
+    """Return an up-to-date index view for ``corpus_dir``.
+
+    The cached view is reused while the manifest is unchanged and the corpus
+    listing matches; otherwise pending and out-of-band changes are applied
+    incrementally. ``verify_listing`` overrides the directory's setting from
+    :func:`set_listing_verification`. Stale views are left for the garbage
+    collector since in-flight scans on other threads may still be reading them.
+    """
+    key = (str(Path(corpus_dir).resolve()), ngram_size, shard)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+    if verify_listing is None:
+        verify_listing = key[0] not in _UNVERIFIED_LISTINGS
+    current = (
+        cached is not None
+        and cached.token == store_for(corpus_dir, ngram_size, shard).change_token()
+        and (not verify_listing or cached.is_current())
+    )
+    with _CACHE_LOCK:
+        _CACHE_STATS["hits" if current else "misses"] += 1
+    if current:
+        return cached
+    return update_corpus_index(
+        corpus_dir,
+        ngram_size=ngram_size,
+        reconcile=verify_listing,
+        shard=shard,
+    )
+
+
+def index_cache_stats() -> tuple[int, int]:
+    """Hits and misses of this process's cached index views."""
+    with _CACHE_LOCK:
+        return _CACHE_STATS["hits"], _CACHE_STATS["misses"]
+
+
+def add_corpus_documents(
+    corpus_dir: Path | str,
+    names: Iterable[str],
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+) -> CorpusIndex:
+    """Index newly added (or replaced) corpus files."""
+    return update_corpus_index(corpus_dir, added=list(names), removed=[], ngram_size=ngram_size)
+
+
+def remove_corpus_documents(
+    corpus_dir: Path | str,
+    names: Iterable[str],
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+) -> CorpusIndex:
+    """Tombstone deleted corpus files."""
+    return update_corpus_index(corpus_dir, added=[], removed=list(names), ngram_size=ngram_size)
+
+
+def preload_corpus_index(
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+) -> CorpusIndex:
+    """Open (building if needed) the index ahead of time, e.g. in a pre-fork master.
+
+    A due compaction runs on the calling thread, so no compaction thread is
+    alive when the master forks.
+    """
+    index = update_corpus_index(
+        corpus_dir,
+        ngram_size=ngram_size,
+        reconcile=_verifies_listing(corpus_dir),
+        background_compaction=False,
+    )
+    _LOGGER.info(
+        "Corpus index loaded: %d documents, generation %d",
+        len(index.documents),
+        index.generation,
+    )
+    return index
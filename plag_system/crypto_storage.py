@@ -6,8 +6,6 @@ import os
 import tempfile
 from pathlib import Path
 
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-
 MAGIC = b"PLAGENC1"
 NONCE_SIZE = 12
 DATA_KEY_SIZE = 32
@@ -25,12 +23,38 @@ def _ensure_master_key() -> bytes:
     if key_path.exists():
         return key_path.read_bytes()
     key = os.urandom(DATA_KEY_SIZE)
-    fd = os.open(str(key_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
-    with os.fdopen(fd, "wb") as handle:
-        handle.write(key)
+    fd, temp_name = tempfile.mkstemp(dir=str(key_path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(key)
+        # Linking fails if another process created the key first; use theirs.
+        os.link(temp_name, key_path)
+    except FileExistsError:
+        return key_path.read_bytes()
+    finally:
+        os.unlink(temp_name)
     return key
 
 
+def _aesgcm(key: bytes):
+    """Return an AES-GCM cipher; cryptography is imported on first use."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(key)
+
+
+def encrypt_bytes(plaintext: bytes) -> bytes:
+    """Encrypt data with a wrapped per-file key."""
+    master_key = _ensure_master_key()
+    data_key = os.urandom(DATA_KEY_SIZE)
+    wrap_nonce = os.urandom(NONCE_SIZE)
+    data_nonce = os.urandom(NONCE_SIZE)
+    wrapped_key = _aesgcm(master_key).encrypt(wrap_nonce, data_key, None)
+    ciphertext = _aesgcm(data_key).encrypt(data_nonce, plaintext, None)
+    return MAGIC + wrap_nonce + data_nonce + wrapped_key + ciphertext
+
+
 def decrypt_if_needed(payload: bytes) -> bytes:
     """Decrypt payload if it has the encryption header."""
     if not payload.startswith(MAGIC):
@@ -44,8 +68,8 @@ def decrypt_if_needed(payload: bytes) -> bytes:
     offset += WRAPPED_KEY_SIZE
     ciphertext = payload[offset:]
     master_key = _ensure_master_key()
-    data_key = AESGCM(master_key).decrypt(wrap_nonce, wrapped_key, None)
-    return AESGCM(data_key).decrypt(data_nonce, ciphertext, None)
+    data_key = _aesgcm(master_key).decrypt(wrap_nonce, wrapped_key, None)
+    return _aesgcm(data_key).decrypt(data_nonce, ciphertext, None)
 
 
 def is_encrypted(payload: bytes) -> bool:
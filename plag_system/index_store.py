@@ -0,0 +1,598 @@
+"""
+Segmented corpus index with a write-ahead log.
+
+An index directory holds::
+
+    manifest.json      committed state: segments, tombstones, aliases, generation
+    seg-NNNNNNNN.idx   immutable mmap segments (see plag_system.mmap_index)
+    seg-NNNNNNNN.bloom Bloom filter of each segment's grams (see plag_system.bloom)
+    stop-NNNNNNNN.bin  sorted uint64 stop-gram hashes
+    positions/         per-document token positions (see plag_system.positions)
+    wal.log            JSON-lines journal of index updates
+    lock               flock target serialising writers across processes
+
+Adding documents writes their postings to a new delta segment and deleting
+them records a tombstone. Every update is journaled in ``wal.log`` before it
+is applied and only takes effect when the manifest is atomically replaced,
+so a crash mid-update leaves the previous state intact and the pending
+journal entry is replayed by the next writer. Compaction merges all live
+documents into a single base segment and truncates the journal.
+
+A document copy stored in a segment with sequence number ``seq`` is live
+while ``seq >= tombstones.get(name, 0)``; re-adding a document tombstones
+its older copies at the new sequence number.
+
+A file whose normalized text matches a live document is recorded as an
+alias of it instead of getting postings of its own. When the aliased
+document changes or goes away its aliases are indexed afresh, the first of
+them taking over the postings.
+
+Compaction also computes the document frequency of every gram. Grams found
+in more than ``PLAG_STOPGRAM_MAX_DF`` of the documents (boilerplate such as
+"one of the") become stop-grams: they are dropped from the postings and from
+every document's gram count, and later deltas are filtered the same way.
+Stop-grams are sticky since their postings are gone; changing the cutoff
+rebuilds the index.
+"""
+from __future__ import annotations
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Collection, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+from plag_system.bloom import BLOOM_FP_RATE, BloomFilter, read_bloom, write_bloom
+from plag_system.mmap_index import IndexedDocument, IndexFormatError, MappedIndex, write_index
+from plag_system.positions import TokenPositions, write_positions
+from plag_system.simhash import SimHashIndex, simhash
+from plag_system.text import content_hash, read_layout
+
+_LOGGER = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 4
+MANIFEST_NAME = "manifest.json"
+WAL_NAME = "wal.log"
+LOCK_NAME = "lock"
+POSITIONS_DIR = "positions"
+MAX_SEGMENTS = int(os.getenv("PLAG_INDEX_MAX_SEGMENTS", "8"))
+MAX_DEAD_RATIO = float(os.getenv("PLAG_INDEX_MAX_DEAD_RATIO", "0.3"))
+STOPGRAM_MAX_DF = float(os.getenv("PLAG_STOPGRAM_MAX_DF", "0.5"))
+STOPGRAM_MIN_DOCUMENTS = int(os.getenv("PLAG_STOPGRAM_MIN_DOCUMENTS", "20"))
+
+
+@dataclass
+class Manifest:
+    """Committed state of a segmented index."""
+    ngram_size: int
+    generation: int = 0
+    last_seq: int = 0
+    segments: list[dict] = field(default_factory=list)
+    tombstones: dict[str, int] = field(default_factory=dict)
+    skipped: dict[str, list[int]] = field(default_factory=dict)
+    aliases: dict[str, list] = field(default_factory=dict)
+    stopgrams: dict = field(default_factory=dict)
+
+    def to_json(self) -> dict:
+        """Return the JSON form written to ``manifest.json``."""
+        return {
+            "version": MANIFEST_VERSION,
+            "ngram_size": self.ngram_size,
+            "generation": self.generation,
+            "last_seq": self.last_seq,
+            "segments": self.segments,
+            "tombstones": self.tombstones,
+            "skipped": self.skipped,
+            "aliases": self.aliases,
+            "stopgrams": self.stopgrams,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Manifest":
+        """Parse a manifest, rejecting other versions."""
+        if data.get("version") != MANIFEST_VERSION:
+            raise IndexFormatError("Unsupported index manifest version")
+        return cls(
+            ngram_size=int(data["ngram_size"]),
+            generation=int(data["generation"]),
+            last_seq=int(data["last_seq"]),
+            segments=list(data["segments"]),
+            tombstones={str(k): int(v) for k, v in data["tombstones"].items()},
+            skipped={str(k): list(v) for k, v in data.get("skipped", {}).items()},
+            aliases={str(k): list(v) for k, v in data.get("aliases", {}).items()},
+            stopgrams=dict(data.get("stopgrams", {})),
+        )
+
+
+def _bloom_name(segment_file: str) -> str:
+    return segment_file.rsplit(".", 1)[0] + ".bloom"
+
+
+def is_live(name: str, seq: int, manifest: Manifest) -> bool:
+    """Return True when the copy of ``name`` in segment ``seq`` is live."""
+    return seq >= manifest.tombstones.get(name, 0)
+
+
+def stopgrams_due(manifest: Manifest, live_documents: int) -> bool:
+    """Return True when the corpus is large enough for a first stop-gram table."""
+    return not manifest.stopgrams and live_documents >= STOPGRAM_MIN_DOCUMENTS
+
+
+def _write_atomic(path: Path, payload: bytes) -> None:
+    fd, temp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(payload)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def fingerprint_document(
+    path: Path,
+    ngram_size: int,
+) -> tuple[IndexedDocument, set[int], TokenPositions]:
+    """Extract one corpus file into index metadata, gram hashes and token positions."""
+    stat = path.stat()
+    pages, char_boxes = read_layout(path)
+    text = "\n".join(pages)
+    positions = TokenPositions.from_pages(pages, ngram_size, char_boxes)
+    grams = set(positions.grams)
+    meta = IndexedDocument(
+        path.name,
+        len(grams),
+        stat.st_size,
+        stat.st_mtime_ns,
+        content_hash=content_hash(text),
+        simhash=simhash(grams),
+    )
+    return meta, grams, positions
+
+
+class IndexStore:
+    """Writer side of a segmented index directory."""
+
+    def __init__(self, index_dir: Path | str, ngram_size: int) -> None:
+        self.index_dir = Path(index_dir)
+        self.ngram_size = ngram_size
+        self.manifest_path = self.index_dir / MANIFEST_NAME
+        self.wal_path = self.index_dir / WAL_NAME
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """Hold the cross-process writer lock."""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        with (self.index_dir / LOCK_NAME).open("a+b") as lock_handle:
+            if fcntl is not None:
+                fcntl.flock(lock_handle.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_handle.fileno(), fcntl.LOCK_UN)
+
+    def change_token(self) -> tuple[int, int] | None:
+        """Return a cheap token that changes whenever the manifest is replaced."""
+        try:
+            stat = self.manifest_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def read_manifest(self) -> Manifest | None:
+        """Return the committed manifest, or None when the index is missing or unusable."""
+        try:
+            data = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            manifest = Manifest.from_json(data)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if manifest.ngram_size != self.ngram_size:
+            return None
+        return manifest
+
+    def open_segments(self, manifest: Manifest) -> list[tuple[int, MappedIndex]]:
+        """Map every segment referenced by ``manifest``."""
+        return [
+            (int(segment["seq"]), MappedIndex(self.index_dir / segment["file"]))
+            for segment in manifest.segments
+        ]
+
+    def load_blooms(self, manifest: Manifest) -> list[BloomFilter | None]:
+        """Return the Bloom filter of each segment, None where there is none."""
+        blooms: list[BloomFilter | None] = []
+        for segment in manifest.segments:
+            try:
+                blooms.append(read_bloom(self.index_dir / _bloom_name(segment["file"])))
+            except (OSError, IndexFormatError):
+                blooms.append(None)
+        return blooms
+
+    def _write_segment(
+        self,
+        segment_file: str,
+        entries: list[tuple[IndexedDocument, Iterable[int]]],
+        generation: int,
+    ) -> None:
+        write_index(
+            self.index_dir / segment_file,
+            entries,
+            ngram_size=self.ngram_size,
+            generation=generation,
+        )
+        grams: set[int] = set()
+        for _, document_grams in entries:
+            grams.update(document_grams)
+        self._write_bloom(segment_file, grams)
+
+    def _write_bloom(self, segment_file: str, grams: Collection[int]) -> None:
+        if BLOOM_FP_RATE <= 0:
+            return
+        bloom = BloomFilter.for_capacity(len(grams), BLOOM_FP_RATE)
+        bloom.update(grams)
+        write_bloom(self.index_dir / _bloom_name(segment_file), bloom)
+
+    def _backfill_blooms(self, manifest: Manifest) -> None:
+        """Write Bloom filters for segments from before they were introduced."""
+        if BLOOM_FP_RATE <= 0:
+            return
+        for segment in manifest.segments:
+            if (self.index_dir / _bloom_name(segment["file"])).exists():
+                continue
+            mapped = MappedIndex(self.index_dir / segment["file"])
+            try:
+                self._write_bloom(segment["file"], mapped.grams)
+            finally:
+                mapped.close()
+
+    def positions_path(self, document_hash: int) -> Path:
+        """Return the positions sidecar of the document with ``document_hash``."""
+        return self.index_dir / POSITIONS_DIR / f"{document_hash:016x}.pos"
+
+    def load_stopgrams(self, manifest: Manifest) -> array:
+        """Return the sorted stop-gram hashes referenced by ``manifest``."""
+        stopgrams = array("Q")
+        if manifest.stopgrams.get("file"):
+            stopgrams.frombytes((self.index_dir / manifest.stopgrams["file"]).read_bytes())
+        return stopgrams
+
+    def _write_manifest(self, manifest: Manifest) -> None:
+        payload = json.dumps(manifest.to_json(), indent=1, sort_keys=True).encode("utf-8")
+        _write_atomic(self.manifest_path, payload)
+
+    def _journal(self, record: dict) -> None:
+        line = json.dumps(record, sort_keys=True).encode("utf-8") + b"\n"
+        with self.wal_path.open("a+b") as wal_handle:
+            if wal_handle.seek(0, os.SEEK_END):
+                wal_handle.seek(-1, os.SEEK_END)
+                if wal_handle.read(1) != b"\n":
+                    # Terminate a line torn by a crash so this record stays parseable.
+                    line = b"\n" + line
+            wal_handle.write(line)
+            wal_handle.flush()
+            os.fsync(wal_handle.fileno())
+
+    def _journal_records(self) -> list[dict]:
+        if not self.wal_path.exists():
+            return []
+        records = []
+        with self.wal_path.open("rb") as wal_handle:
+            for line in wal_handle:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A line torn by a crash during the append.
+                    continue
+        return records
+
+    # -- updates (callers hold ``lock()``) --------------------------------
+
+    def recover(self, corpus_dir: Path) -> Manifest:
+        """Load the manifest, replaying journaled updates that never committed."""
+        manifest = self.read_manifest()
+        cutoff = manifest.stopgrams.get("ratio", STOPGRAM_MAX_DF) if manifest else STOPGRAM_MAX_DF
+        if cutoff != STOPGRAM_MAX_DF:
+            _LOGGER.info("Stop-gram cutoff changed, rebuilding index %s", self.index_dir)
+            manifest = None
+        if manifest is None:
+            manifest = self._reset()
+        for record in self._journal_records():
+            if record.get("op") == "update" and record["seq"] > manifest.last_seq:
+                _LOGGER.info("Replaying index update %s", record["seq"])
+                manifest = self._apply(
+                    corpus_dir,
+                    manifest,
+                    added=record.get("add", []),
+                    removed=record.get("delete", []),
+                    seq=record["seq"],
+                )
+        self._remove_orphans(manifest)
+        self._backfill_blooms(manifest)
+        return manifest
+
+    def _reset(self) -> Manifest:
+        """Start an empty index, discarding unusable leftovers."""
+        manifest = Manifest(ngram_size=self.ngram_size)
+        if self.wal_path.exists():
+            self.wal_path.unlink()
+        shutil.rmtree(self.index_dir / POSITIONS_DIR, ignore_errors=True)
+        self._write_manifest(manifest)
+        return manifest
+
+    def update(
+        self,
+        corpus_dir: Path,
+        manifest: Manifest,
+        added: Iterable[str] = (),
+        removed: Iterable[str] = (),
+    ) -> Manifest:
+        """Journal and apply one batch of added/removed corpus file names."""
+        added = sorted(set(added))
+        removed = sorted(set(removed) - set(added))
+        if not added and not removed:
+            return manifest
+        seq = manifest.last_seq + 1
+        self._journal({"op": "update", "seq": seq, "add": added, "delete": removed})
+        manifest = self._apply(corpus_dir, manifest, added=added, removed=removed, seq=seq)
+        self._journal({"op": "commit", "seq": seq, "generation": manifest.generation})
+        return manifest
+
+    def _apply(  # pylint: disable=too-many-arguments
+        self,
+        corpus_dir: Path,
+        manifest: Manifest,
+        added: Iterable[str],
+        removed: Iterable[str],
+        seq: int,
+    ) -> Manifest:
+        # pylint: disable=too-many-locals
+        entries: list[tuple[IndexedDocument, set[int]]] = []
+        skipped = dict(manifest.skipped)
+        tombstones = dict(manifest.tombstones)
+        aliases = dict(manifest.aliases)
+        added = list(added)
+        changed = set(added) | set(removed)
+        # Aliases of a changed document may no longer share its text.
+        added.extend(
+            sorted(
+                name for name, (canonical, *_) in aliases.items()
+                if canonical in changed and name not in changed
+            )
+        )
+        for name in [*removed, *added]:
+            tombstones[name] = seq
+            skipped.pop(name, None)
+            aliases.pop(name, None)
+
+        stopgrams = set(self.load_stopgrams(manifest))
+        by_content: dict[int, str] = {}
+        near = SimHashIndex()
+        for segment_seq, mapped in self.open_segments(manifest):
+            for doc in mapped.documents:
+                if doc.gram_count and segment_seq >= tombstones.get(doc.name, 0):
+                    by_content[doc.content_hash] = doc.name
+                    near.add(doc.name, doc.simhash)
+
+        for name in added:
+            path = corpus_dir / name
+            if not path.is_file():
+                continue
+            try:
+                meta, grams, positions = fingerprint_document(path, self.ngram_size)
+            except Exception as exc:  # pylint: disable=broad-except
+                _LOGGER.warning("Skipping unreadable corpus file %s: %s", name, exc)
+                stat = path.stat()
+                skipped[name] = [stat.st_size, stat.st_mtime_ns]
+                continue
+            canonical = by_content.get(meta.content_hash) if meta.gram_count else None
+            if canonical is not None:
+                _LOGGER.info("Corpus file %s duplicates %s, stored as an alias", name, canonical)
+                aliases[name] = [canonical, meta.size, meta.mtime_ns]
+                continue
+            if meta.gram_count:
+                for other, distance in near.query(meta.simhash):
+                    _LOGGER.info(
+                        "Corpus file %s is a near-duplicate of %s (distance %d)",
+                        name,
+                        other,
+                        distance,
+                    )
+                by_content[meta.content_hash] = name
+                near.add(name, meta.simhash)
+            if stopgrams:
+                grams = grams - stopgrams
+                meta = replace(meta, gram_count=len(grams))
+            write_positions(self.positions_path(meta.content_hash), positions)
+            entries.append((meta, grams))
+
+        generation = manifest.generation + 1
+        segments = list(manifest.segments)
+        if entries:
+            segment_file = f"seg-{generation:08d}.idx"
+            self._write_segment(segment_file, entries, generation)
+            segments.append({"file": segment_file, "seq": seq})
+        updated = Manifest(
+            ngram_size=self.ngram_size,
+            generation=generation,
+            last_seq=seq,
+            segments=segments,
+            tombstones=tombstones,
+            skipped=skipped,
+            aliases=aliases,
+            stopgrams=manifest.stopgrams,
+        )
+        self._write_manifest(updated)
+        return updated
+
+    def needs_compaction(self, manifest: Manifest) -> bool:
+        """Return True when segments or dead documents have piled up."""
+        if len(manifest.segments) > MAX_SEGMENTS:
+            return True
+        total = dead = 0
+        for seq, mapped in self.open_segments(manifest):
+            for doc in mapped.documents:
+                total += 1
+                dead += not is_live(doc.name, seq, manifest)
+        return bool(total) and (
+            dead / total > MAX_DEAD_RATIO or stopgrams_due(manifest, total - dead)
+        )
+
+    def compact(self, manifest: Manifest) -> Manifest:
+        """Merge every live document into one base segment, dropping stop-grams."""
+        entries: list[tuple[IndexedDocument, list[int]]] = []
+        for seq, mapped in self.open_segments(manifest):
+            for doc, grams in zip(mapped.documents, mapped.document_grams()):
+                if is_live(doc.name, seq, manifest):
+                    entries.append((doc, grams))
+        entries.sort(key=lambda entry: entry[0].name)
+        generation = manifest.generation + 1
+
+        stopgrams = set(self.load_stopgrams(manifest))
+        stop_info = manifest.stopgrams
+        if len(entries) >= STOPGRAM_MIN_DOCUMENTS:
+            max_df = int(STOPGRAM_MAX_DF * len(entries))
+            frequency = Counter(gram for _, grams in entries for gram in grams)
+            stopgrams.update(gram for gram, count in frequency.items() if count > max_df)
+            stop_file = f"stop-{generation:08d}.bin"
+            _write_atomic(self.index_dir / stop_file, array("Q", sorted(stopgrams)).tobytes())
+            stop_info = {
+                "file": stop_file,
+                "ratio": STOPGRAM_MAX_DF,
+                "max_df": max_df,
+                "documents": len(entries),
+                "count": len(stopgrams),
+            }
+        if stopgrams:
+            filtered = []
+            for doc, grams in entries:
+                kept = [gram for gram in grams if gram not in stopgrams]
+                filtered.append((replace(doc, gram_count=len(kept)), kept))
+            entries = filtered
+
+        segment_file = f"seg-{generation:08d}.idx"
+        self._write_segment(segment_file, entries, generation)
+        compacted = Manifest(
+            ngram_size=self.ngram_size,
+            generation=generation,
+            last_seq=manifest.last_seq,
+            segments=[{"file": segment_file, "seq": manifest.last_seq}],
+            tombstones={},
+            skipped=manifest.skipped,
+            aliases=manifest.aliases,
+            stopgrams=stop_info,
+        )
+        self._write_manifest(compacted)
+        # Committed updates are folded into the base segment; keep only
+        # entries a crashed writer left for replay.
+        pending = [
+            record for record in self._journal_records()
+            if record.get("seq", 0) > compacted.last_seq
+        ]
+        _write_atomic(
+            self.wal_path,
+            b"".join(json.dumps(r, sort_keys=True).encode("utf-8") + b"\n" for r in pending),
+        )
+        self._remove_orphans(compacted)
+        live_positions = {self.positions_path(doc.content_hash).name for doc, _ in entries}
+        for path in (self.index_dir / POSITIONS_DIR).glob("*.pos"):
+            if path.name not in live_positions:
+                path.unlink(missing_ok=True)
+        _LOGGER.info("Compacted index %s into generation %d", self.index_dir, generation)
+        return compacted
+
+    def install(self, staging: Path, manifest: Manifest) -> None:
+        """Replace the index with the files in ``staging`` described by ``manifest``.
+
+        The old manifest and journal are removed first, so a crash part way
+        leaves an empty index to rebuild rather than a mix of both.
+        """
+        self.manifest_path.unlink(missing_ok=True)
+        self.wal_path.unlink(missing_ok=True)
+        shutil.rmtree(self.index_dir / POSITIONS_DIR, ignore_errors=True)
+        for path in sorted(staging.rglob("*")):
+            if path.is_file():
+                target = self.index_dir / path.relative_to(staging)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+        self._write_manifest(manifest)
+        self._remove_orphans(manifest)
+
+    def _remove_orphans(self, manifest: Manifest) -> None:
+        """Delete segment files the manifest no longer references.
+
+        Readers that still map a removed segment keep working: the inode
+        lives on until their mapping is closed.
+        """
+        referenced = {segment["file"] for segment in manifest.segments}
+        referenced.update(_bloom_name(segment["file"]) for segment in manifest.segments)
+        referenced.add(manifest.stopgrams.get("file"))
+        for pattern in ("seg-*.idx", "seg-*.bloom", "stop-*.bin"):
+            for path in self.index_dir.glob(pattern):
+                if path.name not in referenced:
+                    path.unlink(missing_ok=True)
+        for path in [
+            *self.index_dir.glob("*.tmp"),
+            *(self.index_dir / POSITIONS_DIR).glob("*.tmp"),
+        ]:
+            path.unlink(missing_ok=True)
+
+
+_COMPACTING: set[str] = set()
+_COMPACTING_LOCK = threading.Lock()
+
+
+def _reset_after_fork() -> None:
+    """Forget compaction threads of the parent, which do not exist in a forked child."""
+    global _COMPACTING_LOCK  # pylint: disable=global-statement
+    _COMPACTING_LOCK = threading.Lock()
+    _COMPACTING.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def compact_now(store: IndexStore) -> bool:
+    """Compact ``store`` on the calling thread if it needs it; returns True when it did."""
+    with store.lock():
+        manifest = store.read_manifest()
+        if manifest is None or not store.needs_compaction(manifest):
+            return False
+        store.compact(manifest)
+    return True
+
+
+def compact_in_background(store: IndexStore) -> bool:
+    """Start a compaction thread for ``store`` unless one is already running."""
+    key = str(store.index_dir)
+    with _COMPACTING_LOCK:
+        if key in _COMPACTING:
+            return False
+        _COMPACTING.add(key)
+
+    def _run() -> None:
+        try:
+            compact_now(store)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Index compaction failed for %s", key)
+        finally:
+            with _COMPACTING_LOCK:
+                _COMPACTING.discard(key)
+
+    threading.Thread(target=_run, name="plag-index-compaction", daemon=True).start()
+    return True
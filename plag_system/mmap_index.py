@@ -0,0 +1,252 @@
+"""
+Memory-mapped on-disk corpus index.
+
+File layout (every section 8-byte aligned)::
+
+    header      magic, version, byte-order mark, n-gram size, corpus
+                generation, document count, gram count, section offsets
+    doc table   one fixed-size record per document (name offset/length,
+                gram count, file size, mtime, content hash, SimHash)
+    names       UTF-8 document names
+    grams       sorted uint64 gram hashes
+    offsets     uint64[gram_count + 1] start of each gram's postings
+    postings    uint32 document ids
+
+The header and doc table are little-endian; the gram, offset and posting
+arrays are in the writer's native byte order so readers can cast them in
+place. The byte-order mark is stored in native order too, so an index
+written on a platform of the other endianness is rejected.
+
+Readers ``mmap`` the file and binary-search the gram array in place, so
+opening an index costs a header parse and every worker process shares the
+same page cache instead of holding a private copy.
+"""
+from __future__ import annotations
+
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+MAGIC = b"PLAGIDX\x00"
+VERSION = 2
+BYTE_ORDER_MARK = 0x01020304
+# Packed in native order, like the arrays it vouches for.
+NATIVE_MARK = struct.Struct("=I").pack(BYTE_ORDER_MARK)
+HEADER = struct.Struct("<8sI4sIIQQQQQQQQ")
+DOC_RECORD = struct.Struct("<QIIQqQQ")
+
+
+class IndexFormatError(ValueError):
+    """Raised when an index file is missing, truncated or from another version."""
+
+
+@dataclass(frozen=True)
+class IndexedDocument:
+    """Metadata of one document stored in the doc table."""
+    name: str
+    gram_count: int
+    size: int
+    mtime_ns: int
+    content_hash: int = 0
+    simhash: int = 0
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_index(
+    path: Path | str,
+    documents: list[tuple[IndexedDocument, Iterable[int]]],
+    ngram_size: int,
+    generation: int,
+) -> Path:
+    """Write ``documents`` (metadata, gram hashes) to ``path`` atomically."""
+    path = Path(path)
+    postings_by_gram: dict[int, list[int]] = {}
+    for doc_id, (_, grams) in enumerate(documents):
+        for gram in grams:
+            postings_by_gram.setdefault(gram, []).append(doc_id)
+    sorted_grams = sorted(postings_by_gram)
+
+    grams_array = array("Q", sorted_grams)
+    offsets_array = array("Q", [0])
+    postings_array = array("I")
+    for gram in sorted_grams:
+        postings_array.extend(postings_by_gram[gram])
+        offsets_array.append(len(postings_array))
+
+    names = bytearray()
+    doc_table = bytearray()
+    for meta, _ in documents:
+        encoded = meta.name.encode("utf-8")
+        doc_table += DOC_RECORD.pack(
+            len(names),
+            len(encoded),
+            meta.gram_count,
+            meta.size,
+            meta.mtime_ns,
+            meta.content_hash,
+            meta.simhash,
+        )
+        names += encoded
+
+    doc_table_offset = _align(HEADER.size)
+    names_offset = _align(doc_table_offset + len(doc_table))
+    grams_offset = _align(names_offset + len(names))
+    offsets_offset = _align(grams_offset + grams_array.itemsize * len(grams_array))
+    postings_offset = _align(offsets_offset + offsets_array.itemsize * len(offsets_array))
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        NATIVE_MARK,
+        ngram_size,
+        len(documents),
+        generation,
+        len(sorted_grams),
+        doc_table_offset,
+        names_offset,
+        grams_offset,
+        offsets_offset,
+        postings_offset,
+        0,
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            for offset, chunk in (
+                (0, header),
+                (doc_table_offset, bytes(doc_table)),
+                (names_offset, bytes(names)),
+                (grams_offset, grams_array.tobytes()),
+                (offsets_offset, offsets_array.tobytes()),
+                (postings_offset, postings_array.tobytes()),
+            ):
+                handle.write(b"\x00" * (offset - handle.tell()))
+                handle.write(chunk)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+    return path
+
+
+class MappedIndex:
+    """Read-only view over an index file; lookups never copy the arrays."""
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        try:
+            with self.path.open("rb") as handle:
+                self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            raise IndexFormatError(f"Cannot open index {self.path}: {exc}") from exc
+        if len(self._mmap) < HEADER.size:
+            self._mmap.close()
+            raise IndexFormatError(f"Index {self.path} is truncated")
+        (
+            magic,
+            version,
+            byte_order,
+            self.ngram_size,
+            doc_count,
+            self.generation,
+            gram_count,
+            doc_table_offset,
+            names_offset,
+            grams_offset,
+            offsets_offset,
+            postings_offset,
+            _,
+        ) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise IndexFormatError(f"Index {self.path} has an unsupported format")
+        if byte_order != NATIVE_MARK:
+            self._mmap.close()
+            raise IndexFormatError(f"Index {self.path} was written on another platform")
+
+        view = memoryview(self._mmap)
+        self._grams = view[grams_offset : grams_offset + 8 * gram_count].cast("Q")
+        self._offsets = view[offsets_offset : offsets_offset + 8 * (gram_count + 1)].cast("Q")
+        postings_count = self._offsets[gram_count] if gram_count else 0
+        self._postings = view[postings_offset : postings_offset + 4 * postings_count].cast("I")
+        view.release()
+
+        self.documents: list[IndexedDocument] = []
+        for doc_id in range(doc_count):
+            name_offset, name_len, *fields = DOC_RECORD.unpack_from(
+                self._mmap, doc_table_offset + doc_id * DOC_RECORD.size
+            )
+            start = names_offset + name_offset
+            name = self._mmap[start : start + name_len].decode("utf-8")
+            self.documents.append(IndexedDocument(name, *fields))
+
+    @property
+    def gram_count(self) -> int:
+        """Number of distinct grams in the index."""
+        return len(self._grams)
+
+    @property
+    def grams(self) -> memoryview:
+        """The sorted gram hashes (a view into the mapping)."""
+        return self._grams
+
+    def _position(self, gram: int) -> int:
+        position = bisect.bisect_left(self._grams, gram)
+        if position < len(self._grams) and self._grams[position] == gram:
+            return position
+        return -1
+
+    def contains(self, gram: int) -> bool:
+        """Return True when any document contains ``gram``."""
+        return self._position(gram) >= 0
+
+    def postings(self, gram: int) -> memoryview:
+        """Return the ids of documents containing ``gram`` (empty when absent)."""
+        position = self._position(gram)
+        if position < 0:
+            return self._postings[0:0]
+        return self._postings[self._offsets[position] : self._offsets[position + 1]]
+
+    def overlap_counts(self, grams: Iterable[int]) -> tuple[dict[int, int], set[int]]:
+        """Count, per document, how many of ``grams`` it contains.
+
+        Returns ``(counts, matched)`` where ``matched`` holds the grams found
+        in at least one document.
+        """
+        counts: dict[int, int] = {}
+        matched: set[int] = set()
+        for gram in grams:
+            postings = self.postings(gram)
+            if not len(postings):  # pylint: disable=use-implicit-booleaness-not-len
+                continue
+            matched.add(gram)
+            for doc_id in postings:
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+        return counts, matched
+
+    def document_grams(self) -> list[list[int]]:
+        """Invert the postings back into per-document gram lists."""
+        per_doc: list[list[int]] = [[] for _ in self.documents]
+        for position, gram in enumerate(self._grams):
+            for doc_id in self._postings[self._offsets[position] : self._offsets[position + 1]]:
+                per_doc[doc_id].append(gram)
+        return per_doc
+
+    def close(self) -> None:
+        """Release the mapping."""
+        for view in (self._grams, self._offsets, self._postings):
+            view.release()
+        self._mmap.close()
@@ -0,0 +1,215 @@
+"""
+Per-page text extraction cache for resubmitted documents.
+
+Students resubmit the same draft with small edits, and pdfplumber's layout
+analysis is most of a scan's cost. Each page is keyed by a hash of what
+determines its text: the decoded content stream, the fonts it uses
+(``/BaseFont``, ``/Encoding`` and ``/ToUnicode`` map, since subset fonts
+re-number glyphs between exports) and any form XObjects it draws. PyPDF2
+computes those keys without layout analysis, and only pages whose key is
+not cached are extracted again. Everything after extraction (grams,
+scoring, alignment) is recomputed from the page texts, because grams span
+page boundaries and scores are set-based over the whole document.
+
+Entries are encrypted like the rest of the stored files and evicted
+least-recently-used once there are more than ``PLAG_PAGE_CACHE_SIZE``.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from plag_system.corpus_index import store_for
+from plag_system.crypto_storage import decrypt_if_needed, encrypt_bytes
+from plag_system.text import DEFAULT_NGRAM_SIZE, plain_pdf
+
+PAGE_CACHE_SIZE = int(os.getenv("PLAG_PAGE_CACHE_SIZE", "4096"))
+PAGES_DIR = "pages"
+# Font entries that decide which characters the glyph codes map to.
+_FONT_ENTRIES = ("/Encoding", "/ToUnicode", "/DescendantFonts")
+_LOGGER = logging.getLogger(__name__)
+
+
+def _canonical(obj, depth: int = 4) -> bytes:
+    """Serialize a PDF object by value (indirect references resolved, streams decoded)."""
+    obj = obj.get_object() if hasattr(obj, "get_object") else obj
+    if hasattr(obj, "get_data"):
+        return obj.get_data()
+    if depth <= 0:
+        return b"?"
+    if isinstance(obj, dict):
+        return b"{" + b",".join(
+            str(key).encode("utf-8") + b":" + _canonical(value, depth - 1)
+            for key, value in sorted(obj.items())
+        ) + b"}"
+    if isinstance(obj, list):
+        return b"[" + b",".join(_canonical(item, depth - 1) for item in obj) + b"]"
+    return str(obj).encode("utf-8")
+
+
+def _object_digest(ref, memo: dict, serialize) -> bytes:
+    """Digest of a (usually shared) font or form object, memoised by reference."""
+    ref_id = (ref.idnum, ref.generation) if hasattr(ref, "idnum") else None
+    if ref_id is not None and ref_id in memo:
+        return memo[ref_id]
+    digest = hashlib.blake2b(serialize(ref.get_object()), digest_size=16).digest()
+    if ref_id is not None:
+        memo[ref_id] = digest
+    return digest
+
+
+def _font_bytes(font) -> bytes:
+    parts = [str(font.get("/BaseFont")).encode("utf-8")]
+    parts.extend(_canonical(font[entry]) for entry in _FONT_ENTRIES if entry in font)
+    return b"\0".join(parts)
+
+
+def _form_bytes(xobject) -> bytes:
+    return xobject.get_data() if xobject.get("/Subtype") == "/Form" else b""
+
+
+def page_key(page, memo: dict | None = None) -> str | None:
+    """Return the cache key of a PyPDF2 page, or None when it cannot be hashed.
+
+    ``memo`` shares font and form digests between pages of one document.
+    """
+    memo = {} if memo is None else memo
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        contents = page.get_contents()
+        digest.update(contents.get_data() if contents is not None else b"")
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else {}
+        for kind, serialize in (("/Font", _font_bytes), ("/XObject", _form_bytes)):
+            entries = resources.get(kind)
+            for name, ref in sorted((entries.get_object() if entries else {}).items()):
+                digest.update(f"\0{kind} {name}".encode("utf-8"))
+                digest.update(_object_digest(ref, memo.setdefault(kind, {}), serialize))
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return digest.hexdigest()
+
+
+class PageCache:
+    """Directory of encrypted page texts keyed by :func:`page_key`."""
+
+    def __init__(self, cache_dir: Path | str, max_entries: int = PAGE_CACHE_SIZE) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.txt"
+
+    def get(self, key: str) -> str | None:
+        """Return the cached text of a page, or None."""
+        # pylint: disable=import-outside-toplevel
+        from cryptography.exceptions import InvalidTag
+
+        path = self._path(key)
+        try:
+            text = decrypt_if_needed(path.read_bytes()).decode("utf-8")
+            os.utime(path)
+        except (OSError, ValueError, InvalidTag):
+            # Unreadable or encrypted under another master key: extract again.
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        """Store a page's text, evicting the least recently used entries when full."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=str(self.cache_dir), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(encrypt_bytes(text.encode("utf-8")))
+            os.replace(temp_name, self._path(key))
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.unlink(temp_name)
+            raise
+        with self._lock:
+            self._puts += 1
+            # Listing the directory on every put would dominate small scans.
+            if self._puts % 64 == 0:
+                self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries beyond ``max_entries``."""
+        entries = []
+        for path in self.cache_dir.glob("*.txt"):
+            try:
+                entries.append((path.stat().st_mtime_ns, path))
+            except FileNotFoundError:
+                continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries :]:
+            path.unlink(missing_ok=True)
+
+    def read_pages(self, path: Path) -> list[str]:
+        """Return each page's text like :func:`plag_system.text.read_pages`,
+        extracting only the pages that are not cached."""
+        # pylint: disable=import-outside-toplevel
+        import pdfplumber
+        from PyPDF2 import PdfReader
+
+        with plain_pdf(path) as readable:
+            try:
+                memo: dict = {}
+                keys = [page_key(page, memo) for page in PdfReader(str(readable)).pages]
+            except Exception:  # pylint: disable=broad-except
+                # PyPDF2 rejects some files pdfplumber can still read.
+                keys = []
+            texts = [self.get(key) if key else None for key in keys]
+            missing = [number for number, text in enumerate(texts) if text is None]
+            if missing or not keys:
+                with pdfplumber.open(str(readable)) as pdf:
+                    if len(pdf.pages) != len(keys):
+                        keys = [None] * len(pdf.pages)
+                        texts = [None] * len(pdf.pages)
+                        missing = list(range(len(pdf.pages)))
+                    for number in missing:
+                        texts[number] = pdf.pages[number].extract_text() or ""
+                        if keys[number]:
+                            self.put(keys[number], texts[number])
+        _LOGGER.debug("Page cache: %d of %d pages extracted", len(missing), len(texts))
+        return texts
+
+
+_CACHES: dict[str, PageCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def page_cache_for(
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+) -> PageCache | None:
+    """Return the (process-wide) page cache kept beside ``corpus_dir``'s index.
+
+    Returns None when ``PLAG_PAGE_CACHE_SIZE`` is 0.
+    """
+    if PAGE_CACHE_SIZE <= 0:
+        return None
+    path = store_for(corpus_dir, ngram_size).index_dir / PAGES_DIR
+    with _CACHES_LOCK:
+        cache = _CACHES.get(str(path))
+        if cache is None:
+            cache = _CACHES[str(path)] = PageCache(path)
+    return cache
+
+
+def page_cache_stats() -> tuple[int, int]:
+    """Hits and misses of this process's page caches."""
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+    return sum(cache.hits for cache in caches), sum(cache.misses for cache in caches)
@@ -0,0 +1,189 @@
+"""
+Token positions of a document, for passage alignment.
+
+Postings only say which documents contain a gram. To report *where* two
+documents match, each corpus document also gets a small sidecar file
+(written at index time, native byte order)::
+
+    header       magic, version, n-gram size, token count, page count, flags
+    page starts  uint32[page_count] character offset of each page
+    token starts uint32[token_count]
+    token ends   uint32[token_count]
+    grams        uint64[token_count - n + 1] gram starting at each token
+    boxes        float32[token_count * 4] x0, top, x1, bottom of each token
+                 in PDF points on its page (NaN when unknown; only present
+                 when the ``FLAG_BOXES`` flag is set)
+
+Offsets refer to the pages joined by newlines, as produced by
+:func:`plag_system.text.read_text`. Boxes let a matched source passage be
+highlighted on the original PDF without extracting its layout again.
+"""
+from __future__ import annotations
+
+import bisect
+import math
+import os
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+
+from plag_system.mmap_index import IndexFormatError
+from plag_system.text import DEFAULT_NGRAM_SIZE, Box, gram_sequence, tokenize
+
+MAGIC = b"PLAGPOS\x00"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIII")
+FLAG_BOXES = 1
+
+
+@dataclass
+class TokenPositions:
+    """Token spans, page starts and n-gram sequence of one document's text."""
+    ngram_size: int
+    page_starts: array
+    starts: array
+    ends: array
+    grams: array
+    boxes: array | None = None
+
+    @classmethod
+    def from_pages(
+        cls,
+        pages: list[str],
+        ngram_size: int = DEFAULT_NGRAM_SIZE,
+        char_boxes: list[list[Box | None]] | None = None,
+    ) -> "TokenPositions":
+        """Tokenize extracted pages, keeping character offsets.
+
+        ``char_boxes`` (see :func:`plag_system.text.read_layout`) adds the
+        bounding box of every token.
+        """
+        page_starts = array("I")
+        offset = 0
+        for page in pages:
+            page_starts.append(offset)
+            offset += len(page) + 1
+        tokens = tokenize("\n".join(pages))
+        positions = cls(
+            ngram_size=ngram_size,
+            page_starts=page_starts,
+            starts=array("I", (start for _, start, _ in tokens)),
+            ends=array("I", (end for _, _, end in tokens)),
+            grams=array("Q", gram_sequence([token for token, _, _ in tokens], n=ngram_size)),
+        )
+        if char_boxes is not None:
+            positions.boxes = array("f")
+            for _, start, end in tokens:
+                positions.boxes.extend(positions._token_box(char_boxes, start, end))
+        return positions
+
+    def _token_box(
+        self,
+        char_boxes: list[list[Box | None]],
+        start: int,
+        end: int,
+    ) -> tuple[float, float, float, float]:
+        page = self.page_of(start) - 1
+        page_start = self.page_starts[page]
+        boxes = [
+            box
+            for box in char_boxes[page][start - page_start : end - page_start]
+            if box is not None
+        ]
+        if not boxes:
+            return (math.nan,) * 4
+        return (
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        )
+
+    def page_of(self, offset: int) -> int:
+        """Return the 1-based page holding character ``offset``."""
+        return max(bisect.bisect_right(self.page_starts, offset), 1)
+
+    def span(self, first_gram: int, end_gram: int) -> dict:
+        """Character span and page of the grams ``[first_gram, end_gram)``."""
+        start = self.starts[first_gram]
+        end = self.ends[end_gram + self.ngram_size - 2]
+        return {"start": start, "end": end, "page": self.page_of(start)}
+
+    def boxes_between(self, start: int, end: int) -> dict[int, list[Box]]:
+        """Boxes of the tokens inside the character span ``[start, end)``, by 1-based page."""
+        found: dict[int, list[Box]] = {}
+        if self.boxes is None:
+            return found
+        first = bisect.bisect_left(self.starts, start)
+        last = bisect.bisect_right(self.ends, end)
+        for token in range(first, last):
+            box = tuple(self.boxes[4 * token : 4 * token + 4])
+            if math.isnan(box[0]):
+                continue
+            found.setdefault(self.page_of(self.starts[token]), []).append(box)
+        return found
+
+
+def write_positions(path: Path | str, positions: TokenPositions) -> Path:
+    """Write ``positions`` to ``path`` atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(
+                HEADER.pack(
+                    MAGIC,
+                    VERSION,
+                    positions.ngram_size,
+                    len(positions.starts),
+                    len(positions.page_starts),
+                    FLAG_BOXES if positions.boxes is not None else 0,
+                )
+            )
+            for section in (
+                positions.page_starts,
+                positions.starts,
+                positions.ends,
+                positions.grams,
+                positions.boxes,
+            ):
+                if section is not None:
+                    section.tofile(handle)
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+    return path
+
+
+def read_positions(path: Path | str) -> TokenPositions:
+    """Load a positions sidecar written by :func:`write_positions`."""
+    return parse_positions(Path(path).read_bytes(), path)
+
+
+def parse_positions(payload: bytes, path: Path | str = "<bytes>") -> TokenPositions:
+    """Decode the bytes of a positions sidecar; ``path`` is only used in errors."""
+    if len(payload) < HEADER.size:
+        raise IndexFormatError(f"Positions file {path} is truncated")
+    magic, version, ngram_size, token_count, page_count, flags = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise IndexFormatError(f"Positions file {path} has an unsupported format")
+    gram_count = max(token_count - ngram_size + 1, 0)
+    sections = []
+    offset = HEADER.size
+    layout = [("I", page_count), ("I", token_count), ("I", token_count), ("Q", gram_count)]
+    if flags & FLAG_BOXES:
+        layout.append(("f", 4 * token_count))
+    for typecode, count in layout:
+        section = array(typecode)
+        end = offset + section.itemsize * count
+        if end > len(payload):
+            raise IndexFormatError(f"Positions file {path} is truncated")
+        section.frombytes(payload[offset:end])
+        sections.append(section)
+        offset = end
+    return TokenPositions(ngram_size, *sections)
@@ -0,0 +1,420 @@
+"""
+Sharded corpus index with scatter-gather queries.
+
+A large corpus can be split into ``N`` shards: :func:`corpus_index.shard_of`
+assigns every corpus file to one shard by a hash of its name, and each shard
+keeps its own segmented index (``n3-s0of4``, ...) over its files only. A
+shard server (``plag-checker shard --shard 0/4 --listen unix:/run/s0.sock``)
+answers queries for one shard over HTTP on a Unix socket or a local TCP
+port:
+
+    POST /query       {"grams": [...], "simhash": int} -> candidates, matched
+                      grams, the submission's stop-grams in this shard and
+                      SimHash near-duplicates
+    POST /positions   {"name": str} -> the document's positions sidecar
+    GET  /health      document count and generation
+
+Scans fan the query out to every address in ``PLAG_SHARDS`` in parallel and
+merge the answers into one :class:`~plag_system.corpus_index.CorpusLookup`.
+A shard that has not answered within ``PLAG_SHARD_TIMEOUT`` seconds (or
+fails) is left out, and the report lists it under ``shards``, so one slow
+shard delays a scan by at most the timeout instead of failing it. When fewer
+than ``PLAG_SHARD_QUORUM`` shards answer (default 1), the query raises
+:class:`ShardUnavailableError` rather than report a partial score as
+complete. Stop-grams are computed per shard, so each candidate is scored
+against the submission grams that count in its own shard.
+"""
+from __future__ import annotations
+
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from plag_system.corpus_index import (
+    CorpusDocument,
+    CorpusLookup,
+    Shard,
+    get_corpus_index,
+    merge_lookups,
+)
+from plag_system.mmap_index import IndexFormatError
+from plag_system.positions import TokenPositions, parse_positions
+
+_T = TypeVar("_T")
+
+SHARD_TIMEOUT = float(os.getenv("PLAG_SHARD_TIMEOUT", "5"))
+# Fewest shards that must answer for a query to count.
+SHARD_QUORUM = int(os.getenv("PLAG_SHARD_QUORUM", "1"))
+_LOGGER = logging.getLogger(__name__)
+
+
+class ShardUnavailableError(RuntimeError):
+    """Raised when fewer shards answer a query than the quorum."""
+
+
+def configured_shards() -> list[str]:
+    """Return the shard server addresses from ``PLAG_SHARDS`` (comma-separated)."""
+    addresses = os.getenv("PLAG_SHARDS", "").split(",")
+    return [address.strip() for address in addresses if address.strip()]
+
+
+def parse_shard(spec: str) -> Shard:
+    """Parse ``"i/n"`` into ``(i, n)``."""
+    try:
+        number, count = (int(part) for part in spec.split("/"))
+    except ValueError as exc:
+        raise ValueError(f"Shard must look like 'i/n', got {spec!r}") from exc
+    if count < 1 or not 0 <= number < count:
+        raise ValueError(f"Shard {spec!r} is out of range")
+    return number, count
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ShardClient:
+    """Client for one shard server (``unix:/path`` or ``host:port``)."""
+
+    def __init__(self, address: str, timeout: float = SHARD_TIMEOUT) -> None:
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix:"):
+            return _UnixHTTPConnection(self.address[len("unix:") :], self.timeout)
+        host, _, port = self.address.removeprefix("http://").rpartition(":")
+        return http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: dict | None = None) -> bytes | None:
+        connection = self._connection()
+        try:
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise OSError(f"Shard {self.address} answered {response.status}")
+        return data
+
+    def query(self, grams: list[int], fingerprint: int) -> dict:
+        """Send a submission's grams and SimHash to the shard."""
+        data = self._request("POST", "/query", {"grams": grams, "simhash": fingerprint})
+        return json.loads(data or b"{}")
+
+    def positions(self, name: str) -> TokenPositions | None:
+        """Fetch the positions sidecar of a document held by this shard."""
+        data = self._request("POST", "/positions", {"name": name})
+        if data is None:
+            return None
+        try:
+            return parse_positions(data, f"{self.address}/{name}")
+        except IndexFormatError:
+            return None
+
+    def health(self) -> dict:
+        """Return the shard's document count and generation."""
+        return json.loads(self._request("GET", "/health") or b"{}")
+
+
+def _scatter(
+    addresses: list[str],
+    call: Callable[[ShardClient], _T],
+    timeout: float,
+    quorum: int | None,
+) -> tuple[list[tuple[ShardClient, _T]], list[str]]:
+    """Run ``call`` against every shard in parallel.
+
+    Returns the answers that arrived in time and the addresses that failed;
+    raises :class:`ShardUnavailableError` when fewer than ``quorum`` answered.
+    """
+    clients = [ShardClient(address, timeout) for address in addresses]
+    executor = ThreadPoolExecutor(max_workers=max(len(clients), 1))
+    futures = {executor.submit(call, client): client for client in clients}
+    done, _ = wait(futures, timeout=timeout)
+    # Do not wait for stragglers; their sockets time out on their own.
+    executor.shutdown(wait=False)
+
+    answers = []
+    failed = []
+    for future, client in futures.items():
+        try:
+            if future not in done:
+                raise TimeoutError(f"no answer within {timeout}s")
+            answers.append((client, future.result()))
+        except Exception as exc:  # pylint: disable=broad-except
+            _LOGGER.warning("Shard %s left out of the query: %s", client.address, exc)
+            failed.append(client.address)
+    needed = min(max(SHARD_QUORUM if quorum is None else quorum, 1), len(clients))
+    if len(answers) < needed:
+        raise ShardUnavailableError(
+            f"{len(answers)} of {len(clients)} shards answered, {needed} needed"
+        )
+    return answers, failed
+
+
+def query_shards(
+    corpus_dir: Path | str,
+    addresses: list[str],
+    grams: set[int],
+    fingerprint: int,
+    timeout: float = SHARD_TIMEOUT,
+    quorum: int | None = None,
+) -> CorpusLookup:
+    """Query every shard in parallel and merge the answers that arrive in time.
+
+    ``quorum`` defaults to ``PLAG_SHARD_QUORUM``.
+    """
+    # pylint: disable=too-many-arguments
+    corpus_dir = Path(corpus_dir)
+    gram_list = sorted(grams)
+
+    def _query(client: ShardClient) -> CorpusLookup:
+        return _shard_lookup(corpus_dir, client, client.query(gram_list, fingerprint), len(grams))
+
+    answers, failed = _scatter(addresses, _query, timeout, quorum)
+    lookup = merge_lookups([answer for _, answer in answers])
+    lookup.shards = {
+        "queried": len(addresses),
+        "answered": len(answers),
+        "failed": failed,
+    }
+    return lookup
+
+
+def shard_positions(
+    addresses: list[str],
+    name: str,
+    timeout: float = SHARD_TIMEOUT,
+    quorum: int | None = None,
+) -> TokenPositions | None:
+    """Ask every shard for the positions of corpus file ``name``; None when none holds it."""
+    answers, _ = _scatter(addresses, lambda client: client.positions(name), timeout, quorum)
+    return next((positions for _, positions in answers if positions is not None), None)
+
+
+def _shard_lookup(
+    corpus_dir: Path,
+    client: ShardClient,
+    answer: dict,
+    gram_count: int,
+) -> CorpusLookup:
+    """Turn one shard's answer into a lookup whose positions come from that shard."""
+    excluded = set(answer["stopgrams"])
+    scored = gram_count - len(excluded)
+
+    def positions(document: CorpusDocument) -> TokenPositions | None:
+        try:
+            return client.positions(Path(document.path).name)
+        except (OSError, ValueError) as exc:
+            _LOGGER.warning(
+                "No positions for %s from shard %s: %s", document.path, client.address, exc
+            )
+            return None
+
+    return CorpusLookup(
+        candidates=[
+            (_document(corpus_dir, record), record["overlap"], scored)
+            for record in answer["candidates"]
+        ],
+        matched=set(answer["matched"]),
+        excluded=excluded,
+        near=[(_document(corpus_dir, record), record["distance"]) for record in answer["near"]],
+        stopgram_count=answer["stopgram_count"],
+        stopgram_max_df=answer.get("max_df"),
+        positions=positions,
+        skip=lambda _document: excluded.__contains__,
+    )
+
+
+def _document(corpus_dir: Path, record: dict) -> CorpusDocument:
+    return CorpusDocument(
+        path=str(corpus_dir / record["name"]),
+        size=record["size"],
+        mtime_ns=record["mtime_ns"],
+        gram_count=record["gram_count"],
+        content_hash=record["content_hash"],
+        simhash=record["simhash"],
+    )
+
+
+def _record(document: CorpusDocument, **extra) -> dict:
+    return {
+        "name": Path(document.path).name,
+        "size": document.size,
+        "mtime_ns": document.mtime_ns,
+        "gram_count": document.gram_count,
+        "content_hash": document.content_hash,
+        "simhash": document.simhash,
+        **extra,
+    }
+
+
+class ShardRequestHandler(BaseHTTPRequestHandler):
+    """Answers queries against the shard index of its server."""
+
+    server: "ShardHTTPServer" | "ShardUnixServer"
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload: dict, status: int = 200) -> None:
+        self._send(status, json.dumps(payload).encode("utf-8"))
+
+    def _index(self):
+        return get_corpus_index(self.server.corpus_dir, shard=self.server.shard)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serve ``/health``."""
+        if self.path != "/health":
+            self._send_json({"error": "Not found"}, 404)
+            return
+        index = self._index()
+        self._send_json(
+            {
+                "shard": list(self.server.shard),
+                "documents": len(index.documents),
+                "generation": index.generation,
+            }
+        )
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        """Serve ``/query`` and ``/positions``."""
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json({"error": "Invalid JSON"}, 400)
+            return
+        if self.path == "/query":
+            self._send_json(self._query(payload))
+        elif self.path == "/positions":
+            self._positions(str(payload.get("name", "")))
+        else:
+            self._send_json({"error": "Not found"}, 404)
+
+    def _query(self, payload: dict) -> dict:
+        index = self._index()
+        lookup = index.lookup(set(payload.get("grams", [])), int(payload.get("simhash", 0)))
+        return {
+            "shard": list(self.server.shard),
+            "candidates": [
+                _record(document, overlap=overlap) for document, overlap, _ in lookup.candidates
+            ],
+            "matched": sorted(lookup.matched),
+            "stopgrams": sorted(lookup.excluded),
+            "stopgram_count": lookup.stopgram_count,
+            "max_df": lookup.stopgram_max_df,
+            "near": [_record(document, distance=distance) for document, distance in lookup.near],
+        }
+
+    def _positions(self, name: str) -> None:
+        index = self._index()
+        document = next((doc for doc in index.documents if Path(doc.path).name == name), None)
+        if document is None or index.store is None:
+            self._send_json({"error": "Not found"}, 404)
+            return
+        try:
+            body = index.store.positions_path(document.content_hash).read_bytes()
+        except OSError:
+            self._send_json({"error": "Not found"}, 404)
+            return
+        self._send(200, body, "application/octet-stream")
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address.
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format: str, *args) -> None:  # pylint: disable=redefined-builtin
+        _LOGGER.debug("shard %s: " + format, self.server.shard, *args)
+
+
+class ShardHTTPServer(ThreadingHTTPServer):
+    """Shard server on a TCP port."""
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], corpus_dir: Path, shard: Shard) -> None:
+        self.corpus_dir = corpus_dir
+        self.shard = shard
+        super().__init__(address, ShardRequestHandler)
+
+
+class ShardUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Shard server on a Unix socket."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, corpus_dir: Path, shard: Shard) -> None:
+        self.corpus_dir = corpus_dir
+        self.shard = shard
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, ShardRequestHandler)
+
+
+def make_shard_server(
+    corpus_dir: Path | str,
+    shard: Shard,
+    listen: str,
+) -> ShardHTTPServer | ShardUnixServer:
+    """Create (and bind) a server for ``shard`` on ``unix:/path`` or ``host:port``."""
+    corpus_dir = Path(corpus_dir)
+    if listen.startswith("unix:"):
+        return ShardUnixServer(listen[len("unix:") :], corpus_dir, shard)
+    host, _, port = listen.rpartition(":")
+    return ShardHTTPServer((host or "127.0.0.1", int(port)), corpus_dir, shard)
+
+
+def serve_shard(corpus_dir: Path | str, shard: Shard, listen: str) -> None:
+    """Build the shard index and serve it until interrupted."""
+    server = make_shard_server(corpus_dir, shard, listen)
+    index = get_corpus_index(server.corpus_dir, shard=shard)
+    _LOGGER.info(
+        "Serving shard %d/%d (%d documents) on %s",
+        shard[0],
+        shard[1],
+        len(index.documents),
+        listen,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def start_shard_thread(
+    corpus_dir: Path | str,
+    shard: Shard,
+    listen: str,
+) -> ShardHTTPServer | ShardUnixServer:
+    """Serve ``shard`` from a daemon thread (tests and single-box setups)."""
+    server = make_shard_server(corpus_dir, shard, listen)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,68 @@
+"""
+SimHash fingerprints for near-duplicate detection.
+
+A document's SimHash is the bitwise majority vote of its 64-bit gram hashes,
+so documents sharing most of their n-grams get fingerprints a few bits apart.
+:class:`SimHashIndex` finds fingerprints within a small Hamming distance
+without comparing every pair: the 64 bits are split into ``max_distance + 1``
+blocks and, by the pigeonhole principle, two fingerprints that differ in at
+most ``max_distance`` bits agree exactly on at least one block, so one hash
+table per block yields every candidate.
+"""
+from __future__ import annotations
+
+import os
+from typing import Generic, Iterable, TypeVar
+
+SIMHASH_BITS = 64
+MAX_DISTANCE = int(os.getenv("PLAG_SIMHASH_DISTANCE", "3"))
+
+KeyT = TypeVar("KeyT")
+
+
+def simhash(grams: Iterable[int]) -> int:
+    """Return the 64-bit SimHash of a set of gram hashes (0 when empty)."""
+    grams = list(grams)
+    if not grams:
+        return 0
+    fingerprint = 0
+    for bit in range(SIMHASH_BITS):
+        ones = sum((gram >> bit) & 1 for gram in grams)
+        if 2 * ones > len(grams):
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Number of differing bits between two fingerprints."""
+    return bin(first ^ second).count("1")
+
+
+class SimHashIndex(Generic[KeyT]):
+    """Multi-table index answering "which fingerprints are within k bits"."""
+
+    def __init__(self, max_distance: int = MAX_DISTANCE) -> None:
+        self.max_distance = max_distance
+        blocks = max_distance + 1
+        edges = [SIMHASH_BITS * i // blocks for i in range(blocks + 1)]
+        self._blocks = [
+            (start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])
+        ]
+        self._tables: list[dict[int, list[tuple[KeyT, int]]]] = [{} for _ in self._blocks]
+
+    def add(self, key: KeyT, fingerprint: int) -> None:
+        """Index ``fingerprint`` under ``key``."""
+        for table, (shift, mask) in zip(self._tables, self._blocks):
+            table.setdefault((fingerprint >> shift) & mask, []).append((key, fingerprint))
+
+    def query(self, fingerprint: int) -> list[tuple[KeyT, int]]:
+        """Return ``(key, distance)`` pairs within ``max_distance``, closest first."""
+        found: dict[KeyT, int] = {}
+        for table, (shift, mask) in zip(self._tables, self._blocks):
+            for key, candidate in table.get((fingerprint >> shift) & mask, ()):
+                if key in found:
+                    continue
+                distance = hamming_distance(fingerprint, candidate)
+                if distance <= self.max_distance:
+                    found[key] = distance
+        return sorted(found.items(), key=lambda item: (item[1], str(item[0])))
@@ -0,0 +1,279 @@
+"""
+Export and import of corpus index snapshots.
+
+A new node would otherwise extract every corpus PDF before it can score
+anything. A snapshot is a tar archive of one index directory (manifest,
+segments, Bloom filters, stop-grams and positions sidecars) preceded by
+``snapshot.json``::
+
+    format       "plag-index-snapshot" and the snapshot version
+    parameters   n-gram size, tokenizer version, stop-gram cutoff, shard and
+                 the on-disk format versions the index was written with
+    generation   index generation at export time
+    documents    [name, size, mtime_ns, sha256] of every indexed corpus file
+    files        sha256 of every archived file
+
+Importing refuses a snapshot whose parameters differ from the running
+configuration, since its fingerprints would never match this checker's,
+and verifies every checksum before the current index is touched. Corpus
+files whose bytes match a snapshot document get the recorded mtime, so
+the index treats them as already fingerprinted; any other file is indexed
+the usual way on the next scan. Submissions and the page cache stay local.
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path, PurePosixPath
+
+from plag_system import bloom, mmap_index, positions
+from plag_system.corpus_index import Shard, iter_corpus_files, store_for, update_corpus_index
+from plag_system.index_store import (
+    MANIFEST_NAME,
+    MANIFEST_VERSION,
+    POSITIONS_DIR,
+    STOPGRAM_MAX_DF,
+    Manifest,
+    is_live,
+)
+from plag_system.text import DEFAULT_NGRAM_SIZE, TOKENIZER_VERSION
+
+SNAPSHOT_FORMAT = "plag-index-snapshot"
+SNAPSHOT_VERSION = 1
+HEADER_NAME = "snapshot.json"
+_CHUNK = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    """A snapshot is unreadable, corrupt or built with other parameters."""
+
+
+def snapshot_parameters(
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    shard: Shard | None = None,
+) -> dict:
+    """Return the parameters a snapshot must share with this checker."""
+    return {
+        "ngram_size": ngram_size,
+        "tokenizer_version": TOKENIZER_VERSION,
+        "stopgram_max_df": STOPGRAM_MAX_DF,
+        "shard": list(shard) if shard is not None else None,
+        "manifest_version": MANIFEST_VERSION,
+        "index_version": mmap_index.VERSION,
+        "positions_version": positions.VERSION,
+        "bloom_version": bloom.VERSION,
+    }
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _index_files(index_dir: Path, manifest: Manifest) -> list[str]:
+    names = [MANIFEST_NAME]
+    for segment in manifest.segments:
+        names.append(segment["file"])
+        bloom_file = segment["file"].rsplit(".", 1)[0] + ".bloom"
+        if (index_dir / bloom_file).exists():
+            names.append(bloom_file)
+    if manifest.stopgrams.get("file"):
+        names.append(manifest.stopgrams["file"])
+    names.extend(
+        f"{POSITIONS_DIR}/{path.name}"
+        for path in sorted((index_dir / POSITIONS_DIR).glob("*.pos"))
+    )
+    return names
+
+
+def _indexed_files(manifest: Manifest, index_dir: Path) -> dict[str, tuple[int, int]]:
+    """Return ``name -> (size, mtime_ns)`` of every corpus file the manifest accounts for."""
+    indexed: dict[str, tuple[int, int]] = {}
+    for segment in manifest.segments:
+        mapped = mmap_index.MappedIndex(index_dir / segment["file"])
+        try:
+            for document in mapped.documents:
+                if is_live(document.name, int(segment["seq"]), manifest):
+                    indexed[document.name] = (document.size, document.mtime_ns)
+        finally:
+            mapped.close()
+    for name, (_, size, mtime_ns) in manifest.aliases.items():
+        indexed[name] = (size, mtime_ns)
+    for name, (size, mtime_ns) in manifest.skipped.items():
+        indexed[name] = (size, mtime_ns)
+    return indexed
+
+
+def export_snapshot(
+    corpus_dir: Path | str,
+    output: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    shard: Shard | None = None,
+) -> dict:
+    """Bring the index of ``corpus_dir`` up to date and write it to ``output``.
+
+    Returns the snapshot header.
+    """
+    corpus_dir = Path(corpus_dir)
+    output = Path(output)
+    update_corpus_index(corpus_dir, ngram_size=ngram_size, shard=shard)
+    store = store_for(corpus_dir, ngram_size, shard)
+    with store.lock():
+        manifest = store.read_manifest()
+        if manifest is None:
+            raise SnapshotError(f"No usable index for {corpus_dir}")
+        names = _index_files(store.index_dir, manifest)
+        indexed = _indexed_files(manifest, store.index_dir)
+        documents = []
+        for path in iter_corpus_files(corpus_dir):
+            stat = path.stat()
+            if indexed.get(path.name) == (stat.st_size, stat.st_mtime_ns):
+                documents.append([path.name, stat.st_size, stat.st_mtime_ns, _sha256(path)])
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created": int(time.time()),
+            "parameters": snapshot_parameters(ngram_size, shard),
+            "generation": manifest.generation,
+            "documents": sorted(documents),
+            "files": {name: _sha256(store.index_dir / name) for name in names},
+        }
+        output.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=str(output.parent), suffix=".tmp")
+        os.close(fd)
+        try:
+            with tarfile.open(temp_name, "w") as archive:
+                payload = json.dumps(header, indent=1, sort_keys=True).encode("utf-8")
+                info = tarfile.TarInfo(HEADER_NAME)
+                info.size = len(payload)
+                info.mtime = header["created"]
+                archive.addfile(info, io.BytesIO(payload))
+                for name in names:
+                    archive.add(str(store.index_dir / name), arcname=name, recursive=False)
+            os.replace(temp_name, output)
+        except BaseException:
+            if os.path.exists(temp_name):
+                os.unlink(temp_name)
+            raise
+    return header
+
+
+def read_snapshot_header(archive: tarfile.TarFile) -> dict:
+    """Return the parsed ``snapshot.json`` of an open snapshot archive."""
+    try:
+        member = archive.getmember(HEADER_NAME)
+        handle = archive.extractfile(member)
+        header = json.loads(handle.read()) if handle is not None else None
+    except (KeyError, ValueError) as exc:
+        raise SnapshotError("Not an index snapshot: snapshot.json is missing or invalid") from exc
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Not an index snapshot")
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {header.get('version')}")
+    return header
+
+
+def _safe_name(name: str) -> bool:
+    path = PurePosixPath(name)
+    return not path.is_absolute() and ".." not in path.parts and len(path.parts) <= 2
+
+
+def _extract(archive: tarfile.TarFile, files: dict, staging: Path) -> None:
+    """Extract and checksum every listed file into ``staging``."""
+    found = set()
+    for member in archive.getmembers():
+        if member.name == HEADER_NAME:
+            continue
+        if member.name not in files or not member.isfile() or not _safe_name(member.name):
+            raise SnapshotError(f"Unexpected snapshot entry {member.name}")
+        source = archive.extractfile(member)
+        target = staging / member.name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        with target.open("wb") as handle:
+            for chunk in iter(lambda: source.read(_CHUNK), b""):
+                digest.update(chunk)
+                handle.write(chunk)
+        if digest.hexdigest() != files[member.name]:
+            raise SnapshotError(f"Checksum mismatch for {member.name}")
+        found.add(member.name)
+    missing = set(files) - found
+    if missing:
+        raise SnapshotError(f"Snapshot is missing {', '.join(sorted(missing))}")
+
+
+def import_snapshot(
+    snapshot: Path | str,
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+    shard: Shard | None = None,
+) -> dict:
+    """Replace the index of ``corpus_dir`` with the one in ``snapshot``.
+
+    Returns the snapshot header plus ``matched``, the number of corpus files
+    recognised as already indexed. Raises :class:`SnapshotError` without
+    touching the current index when the snapshot is corrupt or its
+    parameters differ from this checker's.
+    """
+    corpus_dir = Path(corpus_dir)
+    expected = snapshot_parameters(ngram_size, shard)
+    try:
+        archive = tarfile.open(str(snapshot), "r")
+    except (OSError, tarfile.TarError) as exc:
+        raise SnapshotError(f"Cannot read snapshot {snapshot}: {exc}") from exc
+    with archive:
+        header = read_snapshot_header(archive)
+        recorded = header.get("parameters") or {}
+        differing = sorted(
+            key
+            for key in expected.keys() | recorded.keys()
+            if recorded.get(key) != expected.get(key)
+        )
+        if differing:
+            details = ", ".join(
+                f"{key}={recorded.get(key)!r} (expected {expected.get(key)!r})"
+                for key in differing
+            )
+            raise SnapshotError(f"Snapshot parameters do not match this checker: {details}")
+        store = store_for(corpus_dir, ngram_size, shard)
+        with store.lock():
+            staging = Path(tempfile.mkdtemp(prefix=".snapshot-", dir=str(store.index_dir)))
+            try:
+                try:
+                    _extract(archive, header["files"], staging)
+                except (KeyError, OSError, tarfile.TarError) as exc:
+                    raise SnapshotError(f"Snapshot is corrupt: {exc}") from exc
+                try:
+                    data = json.loads((staging / MANIFEST_NAME).read_text(encoding="utf-8"))
+                    manifest = Manifest.from_json(data)
+                except (OSError, ValueError, KeyError, TypeError) as exc:
+                    raise SnapshotError(f"Snapshot manifest is invalid: {exc}") from exc
+                (staging / MANIFEST_NAME).unlink()
+                header["matched"] = _adopt_corpus_files(corpus_dir, header["documents"])
+                store.install(staging, manifest)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
+    return header
+
+
+def _adopt_corpus_files(corpus_dir: Path, documents: list) -> int:
+    """Give local corpus files identical to snapshot documents the recorded mtime."""
+    matched = 0
+    for name, size, mtime_ns, sha256 in documents:
+        path = corpus_dir / name
+        if Path(name).name != name or not path.is_file():
+            continue
+        if path.stat().st_size != size or _sha256(path) != sha256:
+            continue
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        matched += 1
+    return matched
@@ -0,0 +1,90 @@
+"""
+Sparse 0/1 matrices in compressed sparse row (CSR) form, for batch scoring.
+
+Scoring a batch of submissions is one sparse product: the submission x gram
+matrix times the gram x document incidence of the corpus gives every
+(submission, document) intersection count. Each distinct gram's postings are
+read once for the whole batch instead of once per submission.
+
+Matrices are pairs of ``array("q")`` (row pointers and column indices).
+NumPy is used for the product when it is installed; otherwise a plain loop
+computes the same counts.
+"""
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import Iterable
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+
+@dataclass
+class CsrMatrix:
+    """A 0/1 matrix: row ``i`` holds columns ``indices[indptr[i]:indptr[i + 1]]``."""
+    indptr: array
+    indices: array
+    column_count: int
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Iterable[int]], column_count: int) -> "CsrMatrix":
+        """Build a matrix from the column indices of each row."""
+        indptr = array("q", [0])
+        indices = array("q")
+        for row in rows:
+            indices.extend(row)
+            indptr.append(len(indices))
+        return cls(indptr, indices, column_count)
+
+    @property
+    def row_count(self) -> int:
+        """Number of rows."""
+        return len(self.indptr) - 1
+
+    def row(self, number: int) -> array:
+        """Column indices of row ``number``."""
+        return self.indices[self.indptr[number] : self.indptr[number + 1]]
+
+
+def intersection_counts(left: CsrMatrix, right: CsrMatrix) -> list[dict[int, int]]:
+    """Return the product ``left x right`` as one ``{column: count}`` dict per row of ``left``.
+
+    ``left``'s columns index ``right``'s rows.
+    """
+    if numpy is not None:
+        return _numpy_counts(left, right)
+    results = []
+    right_indptr, right_indices = right.indptr, right.indices
+    for number in range(left.row_count):
+        counts: dict[int, int] = {}
+        for middle in left.row(number):
+            for column in right_indices[right_indptr[middle] : right_indptr[middle + 1]]:
+                counts[column] = counts.get(column, 0) + 1
+        results.append(counts)
+    return results
+
+
+def _numpy_counts(left: CsrMatrix, right: CsrMatrix) -> list[dict[int, int]]:
+    left_indptr = numpy.frombuffer(left.indptr, dtype=numpy.int64)
+    left_indices = numpy.frombuffer(left.indices, dtype=numpy.int64)
+    right_indptr = numpy.frombuffer(right.indptr, dtype=numpy.int64)
+    right_indices = numpy.frombuffer(right.indices, dtype=numpy.int64)
+    results: list[dict[int, int]] = [{} for _ in range(left.row_count)]
+    # Expand every (row, middle) entry of ``left`` into the columns of ``right``'s row.
+    starts = right_indptr[left_indices]
+    lengths = right_indptr[left_indices + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return results
+    rows = numpy.repeat(numpy.arange(left.row_count, dtype=numpy.int64), numpy.diff(left_indptr))
+    offsets = numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+    columns = right_indices[offsets + numpy.arange(total, dtype=numpy.int64)]
+    keys = numpy.repeat(rows, lengths) * max(right.column_count, 1) + columns
+    unique, counts = numpy.unique(keys, return_counts=True)
+    row_ids, column_ids = numpy.divmod(unique, max(right.column_count, 1))
+    for row, column, count in zip(row_ids.tolist(), column_ids.tolist(), counts.tolist()):
+        results[row][column] = count
+    return results
@@ -0,0 +1,101 @@
+"""
+SimHash fingerprints of earlier submissions.
+
+Every scanned submission appends one JSON line (id, SimHash, submitter) to
+``submissions.jsonl`` next to the corpus index. A student's own earlier
+drafts are left out of their lookups, so a revised resubmission is not
+flagged as a copy of itself. Worker processes tail the
+file into an in-memory :class:`~plag_system.simhash.SimHashIndex`, so a new
+submission is checked against every earlier one without re-reading them.
+Lines are small single ``O_APPEND`` writes, which keeps concurrent writers
+from interleaving.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from plag_system.corpus_index import store_for
+from plag_system.simhash import SimHashIndex
+from plag_system.text import DEFAULT_NGRAM_SIZE
+
+SUBMISSIONS_NAME = "submissions.jsonl"
+
+
+class SubmissionIndex:
+    """Append-only log of submission SimHashes with a near-duplicate lookup."""
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self._lookup: SimHashIndex[str] = SimHashIndex()
+        self._submitters: dict[str, str | None] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size < self._offset:
+            # The log was replaced; start over.
+            self._lookup = SimHashIndex(self._lookup.max_distance)
+            self._submitters = {}
+            self._offset = 0
+        if size == self._offset:
+            return
+        with self.path.open("rb") as handle:
+            handle.seek(self._offset)
+            chunk = handle.read(size - self._offset)
+        # Leave a partially written last line for the next refresh.
+        complete = chunk.rfind(b"\n") + 1
+        for line in chunk[:complete].splitlines():
+            try:
+                record = json.loads(line)
+                self._lookup.add(str(record["id"]), int(record["simhash"]))
+                # Lines written by earlier releases have no submitter.
+                self._submitters[str(record["id"])] = record.get("submitter")
+            except (ValueError, KeyError, TypeError):
+                continue
+        self._offset += complete
+
+    def query(self, fingerprint: int, submitter: str | None = None) -> list[tuple[str, int]]:
+        """Return ``(submission id, distance)`` pairs of near-duplicate submissions,
+        leaving out the earlier submissions of ``submitter``."""
+        with self._lock:
+            self._refresh()
+            return [
+                (submission_id, distance)
+                for submission_id, distance in self._lookup.query(fingerprint)
+                if submitter is None or self._submitters.get(submission_id) != submitter
+            ]
+
+    def add(self, submission_id: str, fingerprint: int, submitter: str | None = None) -> None:
+        """Record a submission's fingerprint (and who submitted it) for later lookups."""
+        record = {"id": submission_id, "simhash": fingerprint, "submitter": submitter}
+        line = json.dumps(record).encode("utf-8") + b"\n"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(str(self.path), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+
+_INDEXES: dict[str, SubmissionIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def submissions_for(
+    corpus_dir: Path | str,
+    ngram_size: int = DEFAULT_NGRAM_SIZE,
+) -> SubmissionIndex:
+    """Return the (process-wide) submission index kept beside ``corpus_dir``'s index."""
+    path = store_for(corpus_dir, ngram_size).index_dir / SUBMISSIONS_NAME
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(str(path))
+        if index is None:
+            index = _INDEXES[str(path)] = SubmissionIndex(path)
+    return index
@@ -3,13 +3,58 @@ Tests for plagiarism checker module.
 """
 from __future__ import annotations
 
+import io
 import json
 import os
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
 from pathlib import Path
 
+import pdfplumber
+import pytest
 from reportlab.pdfgen import canvas
 
-from plag_system.checker import analyze_and_sign, analyze_file, ensure_keypair
+from plag_system import bloom as bloom_module
+from plag_system import corpus_index as corpus_index_module
+from plag_system import index_store
+from plag_system import sparse as sparse_module
+from plag_system.alignment import align_passages
+from plag_system.bloom import BloomFilter, fit_budget
+from plag_system.checker import analyze_and_sign, analyze_batch, analyze_file, ensure_keypair
+from plag_system.corpus_index import (
+    add_corpus_documents,
+    get_corpus_index,
+    preload_corpus_index,
+    remove_corpus_documents,
+    set_listing_verification,
+    shard_of,
+    store_for,
+)
+from plag_system.mmap_index import (
+    NATIVE_MARK,
+    IndexedDocument,
+    IndexFormatError,
+    MappedIndex,
+    write_index,
+)
+from plag_system.page_cache import PageCache
+from plag_system.positions import TokenPositions
+from plag_system.sharding import (
+    ShardUnavailableError,
+    query_shards,
+    shard_positions,
+    start_shard_thread,
+)
+from plag_system.simhash import SimHashIndex, hamming_distance, simhash
+from plag_system.snapshot import SnapshotError, export_snapshot, import_snapshot
+from plag_system.text import gram_hash
+from plag_system.timings import StageTimings
+from plag_checker_app.__main__ import main as cli_main
+from benchmarks.corpus_gen import generate as generate_corpus
+from benchmarks.run import compare as compare_benchmarks
 
 
 def _write_pdf(path: Path, content: str) -> None:
@@ -59,6 +104,644 @@ def test_analyze_and_sign(tmp_path: Path) -> None:
     assert json.loads(json.dumps(report))
 
 
+def test_stage_timings_stay_out_of_the_signed_report(tmp_path: Path) -> None:
+    """Timings are recorded per stage without changing the report or its signature."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "corpus.pdf", "A second sample document to check similarity.")
+    target_file = tmp_path / "target.pdf"
+    _write_pdf(target_file, "A second sample document to check similarity and timings.")
+    os.environ["PLAG_KEYSTORE_PASSWORD"] = "test-password"
+
+    plain = analyze_and_sign(target_file, corpus_dir=corpus_dir, key_dir=tmp_path / "keys")
+    timings = StageTimings()
+    timed = analyze_and_sign(
+        target_file,
+        corpus_dir=corpus_dir,
+        key_dir=tmp_path / "keys",
+        annotated_pdf_path=tmp_path / "annotated.pdf",
+        timings=timings,
+    )
+
+    assert timed == plain
+    signed = {key: value for key, value in timed.items() if key not in ("signature", "public_key")}
+    load_pem_public_key(timed["public_key"].encode()).verify(
+        bytes.fromhex(timed["signature"]), json.dumps(signed, sort_keys=True).encode("utf-8")
+    )
+    result = timings.to_json()
+    assert set(result["stages_ms"]) == {
+        "extraction",
+        "comparison",
+        "scoring",
+        "alignment",
+        "sentence_matching",
+        "storage",
+        "annotation",
+        "signing",
+    }
+    assert result["total_ms"] == pytest.approx(sum(result["stages_ms"].values()), abs=0.01)
+    assert result["pages"] == 1
+    assert result["corpus_documents_scored"] == 1
+    assert result["bytes_processed"] == target_file.stat().st_size
+
+
+def test_near_duplicate_submissions_are_flagged(tmp_path: Path) -> None:
+    """Near-verbatim copies of corpus documents and earlier submissions are flagged."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    words = [f"term{number}" for number in range(120)]
+    lines = [" ".join(words[start : start + 12]) for start in range(0, len(words), 12)]
+    source = corpus_dir / "source.pdf"
+    canvas_obj = canvas.Canvas(str(source))
+    for row, line in enumerate(lines):
+        canvas_obj.drawString(72, 720 - 14 * row, line)
+    canvas_obj.save()
+
+    copy = tmp_path / "copy.pdf"
+    canvas_obj = canvas.Canvas(str(copy))
+    for row, line in enumerate(lines):
+        canvas_obj.drawString(72, 720 - 14 * row, line.replace("term60", "changed"))
+    canvas_obj.save()
+
+    os.environ["PLAG_KEYSTORE_PASSWORD"] = "test-password"
+    annotated = tmp_path / "annotated.pdf"
+    report = analyze_and_sign(
+        copy,
+        corpus_dir=corpus_dir,
+        key_dir=tmp_path / "keys",
+        annotated_pdf_path=annotated,
+        submission_id="first",
+    )
+    assert report["near_duplicate"]["kind"] == "corpus"
+    assert report["near_duplicate"]["source"].endswith("source.pdf")
+    assert annotated.read_bytes().startswith(b"%PDF")
+
+    unrelated = tmp_path / "unrelated.pdf"
+    _write_pdf(unrelated, "Completely different words that share nothing with the corpus at all.")
+    assert analyze_file(unrelated, corpus_dir=corpus_dir, submission_id="second")[
+        "near_duplicate"
+    ] is None
+    report = analyze_file(unrelated, corpus_dir=corpus_dir)
+    assert report["near_duplicate"] == {"kind": "submission", "source": "second", "distance": 0}
+
+
+def test_own_resubmission_is_not_a_near_duplicate(tmp_path: Path) -> None:
+    """A student's own earlier draft is skipped; another student's copy keeps word annotation."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "source.pdf", "Unrelated corpus text about distant galaxies and stars.")
+    draft = tmp_path / "draft.pdf"
+    _write_pdf(draft, "My essay explains photosynthesis in leaves using light and water.")
+
+    analyze_file(draft, corpus_dir=corpus_dir, submission_id="draft-1", submitter="alice")
+    report = analyze_file(draft, corpus_dir=corpus_dir, submission_id="draft-2", submitter="alice")
+    assert report["near_duplicate"] is None
+
+    os.environ["PLAG_KEYSTORE_PASSWORD"] = "test-password"
+    annotated = tmp_path / "annotated.pdf"
+    report = analyze_and_sign(
+        draft,
+        corpus_dir=corpus_dir,
+        key_dir=tmp_path / "keys",
+        annotated_pdf_path=annotated,
+        submitter="bob",
+    )
+    assert report["near_duplicate"]["kind"] == "submission"
+    with pdfplumber.open(annotated) as pdf:
+        assert "Near-duplicate of" not in (pdf.pages[0].extract_text() or "")
+
+
+def test_ranking_metric_selects_match_order(tmp_path: Path) -> None:
+    """Containment favours a long source a short submission was copied from."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    copied = "the quick brown fox jumps over the lazy dog near the river bank"
+    canvas_obj = canvas.Canvas(str(corpus_dir / "long.pdf"))
+    canvas_obj.drawString(72, 720, copied)
+    for row in range(4):
+        filler = " ".join(f"filler{row}x{column}" for column in range(10))
+        canvas_obj.drawString(72, 700 - 14 * row, filler)
+    canvas_obj.save()
+    _write_pdf(corpus_dir / "short.pdf", "the quick brown fox jumps over")
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, copied)
+
+    by_jaccard = analyze_file(target, corpus_dir=corpus_dir)
+    assert by_jaccard["ranking_metric"] == "jaccard"
+    assert Path(by_jaccard["matches"][0]["path"]).name == "short.pdf"
+
+    by_containment = analyze_file(target, corpus_dir=corpus_dir, metric="containment")
+    top = by_containment["matches"][0]
+    assert Path(top["path"]).name == "long.pdf"
+    assert top["score"] == top["containment"] == 1.0
+    assert top["overlap"] == 11
+    assert top["jaccard"] < top["containment"]
+    assert by_containment["similarity_percent"] == 100.0
+
+    by_overlap = analyze_file(target, corpus_dir=corpus_dir, metric="overlap")
+    assert [match["score"] for match in by_overlap["matches"]] == [11, 4]
+
+    try:
+        analyze_file(target, corpus_dir=corpus_dir, metric="cosine")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown ranking metric was accepted")
+
+
+def test_align_passages_reports_offsets_and_bridges_edits() -> None:
+    """Copied passages are found on both sides, across a single edited word."""
+    copied = "the quick brown fox jumps over the lazy dog near the quiet river bank"
+    edited = copied.replace("lazy", "sleepy")
+    source_pages = ["An unrelated opening page.", f"Some intro. {copied}. The end."]
+    submission_text = f"My essay starts here. {edited}! Thanks."
+    submission = TokenPositions.from_pages([submission_text])
+    source = TokenPositions.from_pages(source_pages)
+
+    passages = align_passages(submission, source)
+    assert len(passages) == 1
+    passage = passages[0]
+    sub_span, src_span = passage["submission"], passage["source"]
+    assert submission_text[sub_span["start"] : sub_span["end"]] == edited
+    assert "\n".join(source_pages)[src_span["start"] : src_span["end"]] == copied
+    assert sub_span["page"] == 1
+    assert src_span["page"] == 2
+    assert passage["ngrams"] == len(copied.split()) - 2 - 3
+
+
+def test_analyze_file_reports_matched_passages(tmp_path: Path) -> None:
+    """Top matches carry aligned passages from the stored corpus positions."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(
+        corpus_dir / "source.pdf",
+        "Cells divide by mitosis into two identical daughter cells.",
+    )
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, "Biology notes: cells divide by mitosis into two identical daughter cells.")
+
+    report = analyze_file(target, corpus_dir=corpus_dir)
+    passages = report["matches"][0]["passages"]
+    assert len(passages) == 1
+    assert passages[0]["source"]["start"] == 0
+    assert passages[0]["submission"]["start"] == len("Biology notes: ")
+
+    index = get_corpus_index(corpus_dir)
+    stored = index.positions(index.documents[0])
+    boxes = stored.boxes_between(passages[0]["source"]["start"], passages[0]["source"]["end"])
+    assert list(boxes) == [1]
+    assert len(boxes[1]) == len(stored.starts)
+    assert all(x0 < x1 and top < bottom for x0, top, x1, bottom in boxes[1])
+
+
+def test_page_cache_extracts_only_changed_pages(tmp_path: Path, monkeypatch) -> None:
+    """A resubmission with one edited page only re-extracts that page."""
+    def write_draft(path: Path, pages: list[str]) -> None:
+        canvas_obj = canvas.Canvas(str(path))
+        for text in pages:
+            canvas_obj.drawString(72, 720, text)
+            canvas_obj.showPage()
+        canvas_obj.save()
+
+    extracted = []
+    original = pdfplumber.page.Page.extract_text
+
+    def counting_extract(page, *args, **kwargs):
+        extracted.append(page.page_number)
+        return original(page, *args, **kwargs)
+
+    monkeypatch.setattr(pdfplumber.page.Page, "extract_text", counting_extract)
+    cache = PageCache(tmp_path / "pages")
+    pages = ["an introduction page", "the first argument", "a short conclusion"]
+    write_draft(tmp_path / "draft1.pdf", pages)
+    assert cache.read_pages(tmp_path / "draft1.pdf") == pages
+    assert extracted == [1, 2, 3]
+
+    extracted.clear()
+    pages[1] = "the first argument, revised"
+    write_draft(tmp_path / "draft2.pdf", pages)
+    assert cache.read_pages(tmp_path / "draft2.pdf") == pages
+    assert extracted == [2]
+    assert all(
+        not entry.read_bytes().startswith(b"the") for entry in (tmp_path / "pages").iterdir()
+    )
+
+
+def test_bloom_filter_has_no_false_negatives_after_folding() -> None:
+    """Folding trades false positives for memory but never loses a gram."""
+    grams = [gram_hash(f"gram number {number}") for number in range(2000)]
+    bloom = BloomFilter.for_capacity(len(grams), fp_rate=0.01)
+    bloom.update(grams)
+    others = [gram_hash(f"other gram {number}") for number in range(2000)]
+    assert sum(gram in bloom for gram in others) < 60
+    size = bloom.nbytes
+    fit_budget([bloom], max_bytes=size // 4)
+    assert bloom.nbytes == size // 4
+    assert all(gram in bloom for gram in grams)
+
+
+def test_bloom_prefilter_keeps_results_exact(tmp_path: Path, monkeypatch) -> None:
+    """Segment Bloom filters only skip lookups; matches stay the same."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "a.pdf", "Photosynthesis converts light energy into chemical energy.")
+    _write_pdf(corpus_dir / "b.pdf", "Mitochondria are the powerhouse of the eukaryotic cell.")
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, "Plants: photosynthesis converts light energy into sugar.")
+
+    index = get_corpus_index(corpus_dir)
+    assert all(bloom is not None for bloom in index.blooms)
+    filtered = analyze_file(target, corpus_dir=corpus_dir)["matches"]
+
+    # A tiny budget folds the filters until nearly every gram is a false positive.
+    monkeypatch.setattr(bloom_module, "BLOOM_MAX_BYTES", 8)
+    index._blooms = None  # pylint: disable=protected-access
+    assert sum(bloom.nbytes for bloom in index.blooms) == 8
+    assert analyze_file(target, corpus_dir=corpus_dir)["matches"] == filtered
+    assert filtered[0]["path"].endswith("a.pdf")
+
+
+def test_sharded_index_matches_single_index(tmp_path: Path, monkeypatch) -> None:
+    """Scatter-gather over shard servers gives the single-index report."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    topics = ["rivers carve deep canyons", "volcanoes release molten rock", "glaciers move slowly"]
+    for number, topic in enumerate(topics * 2):
+        _write_pdf(corpus_dir / f"doc{number}.pdf", f"Geology note {number}: {topic} over time.")
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, "My essay: rivers carve deep canyons and volcanoes release molten rock.")
+    local = analyze_file(target, corpus_dir=corpus_dir)
+    assert {shard_of(f"doc{number}.pdf", 2) for number in range(6)} == {0, 1}
+
+    servers = [
+        start_shard_thread(corpus_dir, (number, 2), f"unix:{tmp_path / f's{number}.sock'}")
+        for number in range(2)
+    ]
+    silent = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    silent.bind(str(tmp_path / "slow.sock"))
+    silent.listen()
+    try:
+        addresses = [f"unix:{tmp_path / f's{number}.sock'}" for number in range(2)]
+        monkeypatch.setenv("PLAG_SHARDS", ",".join(addresses))
+        sharded = analyze_file(target, corpus_dir=corpus_dir)
+        assert sharded["matches"] == local["matches"]
+        assert sharded["matches"][0]["passages"]
+        assert sharded["shards"] == {"queried": 2, "answered": 2, "failed": []}
+
+        # A shard that never answers is dropped after the timeout.
+        slow = f"unix:{tmp_path / 'slow.sock'}"
+        lookup = query_shards(corpus_dir, [*addresses, slow], {1, 2}, 0, timeout=0.5)
+        assert lookup.shards == {"queried": 3, "answered": 2, "failed": [slow]}
+        # Below the quorum, or with no shard answering, the query fails instead.
+        with pytest.raises(ShardUnavailableError):
+            query_shards(corpus_dir, [*addresses, slow], {1, 2}, 0, timeout=0.5, quorum=3)
+        with pytest.raises(ShardUnavailableError):
+            query_shards(corpus_dir, [slow], {1, 2}, 0, timeout=0.5)
+
+        positions = shard_positions([*addresses, slow], "doc1.pdf", timeout=0.5)
+        assert positions is not None and positions.grams
+        assert shard_positions(addresses, "missing.pdf") is None
+    finally:
+        silent.close()
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def test_index_snapshot_bootstraps_another_node(tmp_path: Path, monkeypatch) -> None:
+    """An imported snapshot serves scans without extracting the corpus again."""
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    _write_pdf(source_dir / "a.pdf", "Tectonic plates drift across the mantle very slowly.")
+    _write_pdf(source_dir / "b.pdf", "Coral reefs grow in warm and shallow tropical seas.")
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, "Essay: tectonic plates drift across the mantle over ages.")
+    expected = analyze_file(target, corpus_dir=source_dir)["matches"]
+    snapshot = tmp_path / "index.tar"
+    header = export_snapshot(source_dir, snapshot)
+    assert len(header["documents"]) == 2
+
+    node_dir = tmp_path / "node"
+    shutil.copytree(source_dir, node_dir, ignore=shutil.ignore_patterns(".index"))
+    for path in node_dir.iterdir():
+        os.utime(path, (1, 1))
+    with pytest.raises(SnapshotError, match="ngram_size"):
+        import_snapshot(snapshot, node_dir, ngram_size=4)
+    assert import_snapshot(snapshot, node_dir)["matched"] == 2
+
+    def _no_extraction(*_args, **_kwargs):
+        raise AssertionError("corpus file extracted again")
+
+    monkeypatch.setattr(index_store, "fingerprint_document", _no_extraction)
+    matches = analyze_file(target, corpus_dir=node_dir)["matches"]
+    assert [(Path(m["path"]).name, m["score"]) for m in matches] == [
+        (Path(m["path"]).name, m["score"]) for m in expected
+    ]
+
+    # A tampered archive is refused before the installed index is touched.
+    corrupt = tmp_path / "corrupt.tar"
+    with tarfile.open(snapshot) as original, tarfile.open(corrupt, "w") as copy:
+        for member in original.getmembers():
+            data = original.extractfile(member).read()
+            if member.name.endswith(".idx"):
+                data = data[:-1] + bytes([data[-1] ^ 1])
+            copy.addfile(member, io.BytesIO(data))
+    with pytest.raises(SnapshotError, match="Checksum"):
+        import_snapshot(corrupt, node_dir)
+    assert analyze_file(target, corpus_dir=node_dir)["matches"] == matches
+
+
+def test_batch_scoring_matches_single_file_reports(tmp_path: Path, monkeypatch) -> None:
+    """The sparse batch product gives every file its analyze_file report."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "a.pdf", "Ocean currents move heat from the equator toward the poles.")
+    _write_pdf(corpus_dir / "b.pdf", "Ocean currents and winds shape the climate of coastal towns.")
+    _write_pdf(corpus_dir / "c.pdf", "Deserts receive very little rain during the whole year.")
+    targets = []
+    for number, text in enumerate(
+        [
+            "Ocean currents move heat from the equator, and winds shape the climate.",
+            "Deserts receive very little rain; ocean currents move heat.",
+            "An unrelated essay about medieval castle architecture.",
+        ]
+    ):
+        targets.append(tmp_path / f"target{number}.pdf")
+        _write_pdf(targets[-1], text)
+
+    expected = [analyze_file(target, corpus_dir=corpus_dir) for target in targets]
+    assert analyze_batch(targets, corpus_dir=corpus_dir) == expected
+    monkeypatch.setattr(sparse_module, "numpy", None)
+    assert analyze_batch(targets, corpus_dir=corpus_dir) == expected
+    assert [len(report["matches"]) for report in expected] == [2, 2, 0]
+
+
+def test_scan_command_writes_json_lines_and_threshold_status(tmp_path: Path) -> None:
+    """`plag-checker scan` signs one report per line; the exit status reflects the threshold."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "source.pdf", "Volcanic ash cools the planet for several years after.")
+    submissions = tmp_path / "submissions"
+    (submissions / "late").mkdir(parents=True)
+    _write_pdf(submissions / "copy.pdf", "Volcanic ash cools the planet for several years after.")
+    _write_pdf(submissions / "late" / "own.pdf", "My own essay on medieval castle architecture.")
+    (submissions / "broken.pdf").write_bytes(b"not a pdf")
+    os.environ["PLAG_KEYSTORE_PASSWORD"] = "test-password"
+    output = tmp_path / "reports.jsonl"
+    common = ["--corpus", str(corpus_dir), "--keys", str(tmp_path / "keys"), "-o", str(output)]
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli_main(
+            ["scan", str(submissions / "late"), str(submissions / "c*.pdf"), *common,
+             "--jobs", "2", "--threshold", "50", "--annotate", str(tmp_path / "annotated")]
+        )
+    assert exit_info.value.code == 1
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [Path(record["file"]).name for record in records] == ["own.pdf", "copy.pdf"]
+    assert [record["plagiarism_percentage"] for record in records] == [0.0, 100.0]
+    assert all(record["signature"] for record in records)
+    assert Path(records[1]["annotated_pdf"]).read_bytes().startswith(b"%PDF")
+
+    with pytest.raises(SystemExit) as exit_info:
+        cli_main(["scan", str(submissions / "late"), *common, "--threshold", "50"])
+    assert exit_info.value.code == 0
+    with pytest.raises(SystemExit) as exit_info:
+        cli_main(["scan", str(submissions), *common])
+    assert exit_info.value.code == 2
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    names = [Path(record["file"]).name for record in records]
+    assert names == ["broken.pdf", "copy.pdf", "own.pdf"]
+    assert "error" in records[0]
+
+
+def test_synthetic_corpus_plants_detectable_passages(tmp_path: Path) -> None:
+    """Benchmark corpora are reproducible, and their planted sources are found."""
+    sizes = {"documents": 4, "pages": 1, "words_per_page": 120, "submissions": 2, "seed": 7}
+    corpus = generate_corpus(tmp_path / "a", passage_words=30, **sizes)
+    again = generate_corpus(tmp_path / "b", passage_words=30, **sizes)
+    assert [s.sources for s in corpus.submissions] == [s.sources for s in again.submissions]
+    for submission in corpus.submissions:
+        report = analyze_file(submission.path, corpus_dir=corpus.corpus_dir)
+        matched = {Path(match["path"]).name for match in report["matches"]}
+        assert set(submission.sources) <= matched
+
+    baseline = {"scales": {"small": {"analyze_file_s": 0.2, "encrypt_mb_per_s": 500.0}}}
+    slower = {"scales": {"small": {"analyze_file_s": 0.3, "encrypt_mb_per_s": 480.0}}}
+    assert compare_benchmarks(slower, baseline, 0.25) == [
+        "small.analyze_file_s: 0.2 -> 0.3 (+50% worse)"
+    ]
+    assert not compare_benchmarks(baseline, baseline, 0.25)
+
+
+def test_corpus_index_cached_until_corpus_changes(tmp_path: Path) -> None:
+    """The corpus index is reused until a corpus file is added."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "first.pdf", "The first corpus document for caching.")
+
+    index = get_corpus_index(corpus_dir)
+    assert get_corpus_index(corpus_dir) is index
+    assert len(index.documents) == 1
+
+    _write_pdf(corpus_dir / "second.pdf", "The second corpus document for caching.")
+    rebuilt = get_corpus_index(corpus_dir)
+    assert rebuilt is not index
+    assert len(rebuilt.documents) == 2
+    assert index.documents[0] in rebuilt.documents
+
+
+def test_incremental_index_updates_and_compaction(tmp_path: Path) -> None:
+    """Uploads add delta segments, deletes tombstone, compaction merges."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "a.pdf", "Alpha beta gamma delta epsilon.")
+    base = get_corpus_index(corpus_dir)
+    assert len(base.segments) == 1
+
+    _write_pdf(corpus_dir / "b.pdf", "Beta gamma delta zeta eta.")
+    added = add_corpus_documents(corpus_dir, ["b.pdf"])
+    assert len(added.segments) == 2
+    assert [Path(doc.path).name for doc in added.documents] == ["a.pdf", "b.pdf"]
+
+    (corpus_dir / "a.pdf").unlink()
+    removed = remove_corpus_documents(corpus_dir, ["a.pdf"])
+    assert [Path(doc.path).name for doc in removed.documents] == ["b.pdf"]
+    assert removed.dead_documents == 1
+
+    store = store_for(corpus_dir)
+    with store.lock():
+        compacted = store.compact(store.read_manifest())
+    assert len(compacted.segments) == 1
+    assert not compacted.tombstones
+    reopened = get_corpus_index(corpus_dir)
+    assert len(reopened.segments) == 1
+    assert [Path(doc.path).name for doc in reopened.documents] == ["b.pdf"]
+
+
+def test_index_replays_uncommitted_journal_entry(tmp_path: Path) -> None:
+    """An update journaled before a crash is applied by the next open."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    _write_pdf(corpus_dir / "a.pdf", "Alpha beta gamma delta epsilon.")
+    get_corpus_index(corpus_dir)
+    store = store_for(corpus_dir)
+    last_seq = store.read_manifest().last_seq
+
+    _write_pdf(corpus_dir / "b.pdf", "Beta gamma delta zeta eta.")
+    with store.wal_path.open("a", encoding="utf-8") as wal_handle:
+        wal_handle.write(json.dumps({"op": "update", "seq": last_seq + 1, "add": ["b.pdf"]}))
+        wal_handle.write("\n")
+
+    index = get_corpus_index(corpus_dir)
+    assert store.read_manifest().last_seq == last_seq + 1
+    assert [Path(doc.path).name for doc in index.documents] == ["a.pdf", "b.pdf"]
+
+
+def test_mmap_index_roundtrip(tmp_path: Path) -> None:
+    """An index file can be queried in place after being written."""
+    index_path = tmp_path / "corpus.idx"
+    write_index(
+        index_path,
+        [
+            (IndexedDocument("a.pdf", 3, 10, 1), [5, 1, 9]),
+            (IndexedDocument("b.pdf", 2, 20, 2), [9, 2]),
+        ],
+        ngram_size=3,
+        generation=7,
+    )
+    mapped = MappedIndex(index_path)
+    assert mapped.generation == 7
+    assert [doc.name for doc in mapped.documents] == ["a.pdf", "b.pdf"]
+    assert list(mapped.postings(9)) == [0, 1]
+    assert not mapped.contains(4)
+    counts, matched = mapped.overlap_counts([1, 2, 9, 100])
+    assert counts == {0: 2, 1: 2}
+    assert matched == {1, 2, 9}
+    assert mapped.document_grams() == [[1, 5, 9], [2, 9]]
+    mapped.close()
+
+    # An index from a platform of the other endianness carries a swapped mark.
+    payload = bytearray(index_path.read_bytes())
+    assert payload[12:16] == NATIVE_MARK
+    payload[12:16] = NATIVE_MARK[::-1]
+    index_path.write_bytes(bytes(payload))
+    with pytest.raises(IndexFormatError, match="another platform"):
+        MappedIndex(index_path)
+
+    index_path.write_bytes(b"not an index")
+    try:
+        MappedIndex(index_path)
+    except IndexFormatError:
+        pass
+    else:
+        raise AssertionError("corrupt index was accepted")
+
+
+def test_duplicate_corpus_files_are_aliased(tmp_path: Path) -> None:
+    """A copy of an indexed document becomes an alias and takes over on delete."""
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    text = "Duplicate detection keeps the corpus free of repeated documents."
+    _write_pdf(corpus_dir / "original.pdf", text)
+    _write_pdf(corpus_dir / "other.pdf", "An unrelated document about something else entirely.")
+    get_corpus_index(corpus_dir)
+
+    _write_pdf(corpus_dir / "copy.pdf", text.upper())
+    index = add_corpus_documents(corpus_dir, ["copy.pdf"])
+    assert index.aliases == {"copy.pdf": "original.pdf"}
+    assert [Path(doc.path).name for doc in index.documents] == ["original.pdf", "other.pdf"]
+    assert index.duplicates()["exact"] == [{"file": "original.pdf", "duplicates": ["copy.pdf"]}]
+    assert get_corpus_index(corpus_dir) is index
+
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, text)
+    assert len(analyze_file(target, corpus_dir=corpus_dir)["matches"]) == 1
+
+    (corpus_dir / "original.pdf").unlink()
+    index = remove_corpus_documents(corpus_dir, ["original.pdf"])
+    assert not index.aliases
+    assert [Path(doc.path).name for doc in index.documents] == ["copy.pdf", "other.pdf"]
+
+
+def test_high_document_frequency_grams_are_not_scored(tmp_path: Path, monkeypatch) -> None:
+    """Compaction turns grams shared by most documents into unscored stop-grams."""
+    monkeypatch.setattr(index_store, "STOPGRAM_MIN_DOCUMENTS", 3)
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    boilerplate = "Submit your assignment before the deadline."
+    _write_pdf(corpus_dir / "a.pdf", f"{boilerplate} Apples grow on tall trees.")
+    _write_pdf(corpus_dir / "b.pdf", f"{boilerplate} Rivers flow into the sea.")
+    _write_pdf(corpus_dir / "c.pdf", f"{boilerplate} Mountains rise above clouds.")
+    assert get_corpus_index(corpus_dir).needs_compaction()
+
+    store = store_for(corpus_dir)
+    with store.lock():
+        compacted = store.compact(store.read_manifest())
+    assert compacted.stopgrams["max_df"] == 1
+    assert compacted.stopgrams["count"] == 4
+
+    target = tmp_path / "target.pdf"
+    _write_pdf(target, f"{boilerplate} Rivers flow into the sea.")
+    report = analyze_file(target, corpus_dir=corpus_dir)
+    assert report["stopgrams"]["max_df"] == 1
+    assert report["stopgrams"]["excluded_ngrams"] == 4
+    assert [Path(match["path"]).name for match in report["matches"]] == ["b.pdf"]
+
+
+def test_preload_compacts_on_the_calling_thread(tmp_path: Path, monkeypatch) -> None:
+    """A pre-fork preload finishes a due compaction instead of leaving a thread behind."""
+    monkeypatch.setattr(index_store, "STOPGRAM_MIN_DOCUMENTS", 3)
+    started: list = []
+    monkeypatch.setattr(corpus_index_module, "compact_in_background", started.append)
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    boilerplate = "Submit your assignment before the deadline."
+    _write_pdf(corpus_dir / "a.pdf", f"{boilerplate} Apples grow on tall trees.")
+    _write_pdf(corpus_dir / "b.pdf", f"{boilerplate} Rivers flow into the sea.")
+    _write_pdf(corpus_dir / "c.pdf", f"{boilerplate} Mountains rise above clouds.")
+
+    index = preload_corpus_index(corpus_dir)
+    assert not started
+    assert not index.needs_compaction()
+    assert index.manifest.stopgrams["count"] == 4
+    assert get_corpus_index(corpus_dir) is index
+
+
+def test_listing_verification_is_per_directory(tmp_path: Path) -> None:
+    """Turning listing checks off for a watched corpus leaves other corpora checked."""
+    watched, collection = tmp_path / "watched", tmp_path / "collection"
+    for corpus_dir in (watched, collection):
+        corpus_dir.mkdir()
+        _write_pdf(corpus_dir / "a.pdf", "Tectonic plates drift across the mantle very slowly.")
+        get_corpus_index(corpus_dir)
+    set_listing_verification(False, watched)
+    try:
+        for corpus_dir in (watched, collection):
+            _write_pdf(corpus_dir / "b.pdf", "Coral reefs grow in warm and shallow tropical seas.")
+        assert len(get_corpus_index(watched).documents) == 1
+        assert len(get_corpus_index(collection).documents) == 2
+    finally:
+        set_listing_verification(True, watched)
+    assert len(get_corpus_index(watched).documents) == 2
+
+
+def test_simhash_index_finds_near_fingerprints() -> None:
+    """Fingerprints within the distance are found, distant ones are not."""
+    grams = set(range(1, 2000, 7))
+    base = simhash(grams)
+    assert simhash(grams) == base
+    assert hamming_distance(base, simhash(grams | {3, 5})) <= 3
+
+    index: SimHashIndex[str] = SimHashIndex(max_distance=3)
+    index.add("near", base ^ 0b101)
+    index.add("far", base ^ 0xFFFF)
+    index.add("other", ~base & (2**64 - 1))
+    assert index.query(base) == [("near", 2)]
+
+
 def test_ensure_keypair_idempotent(tmp_path: Path) -> None:
     """Ensure keypair creation is idempotent."""
     os.environ["PLAG_KEYSTORE_PASSWORD"] = "test-password"
@@ -72,6 +755,21 @@ def test_ensure_keypair_idempotent(tmp_path: Path) -> None:
     assert public_key
 
 
+def test_importing_the_checker_defers_pdf_and_crypto_libraries() -> None:
+    """pdfplumber, PyPDF2, reportlab and cryptography load on first use only."""
+    code = (
+        "import sys, plag_system, plag_system.checker; "
+        "print(sorted({name.split('.')[0] for name in sys.modules} & "
+        "{'pdfplumber', 'PyPDF2', 'reportlab', 'cryptography'}))"
+    )
+    root = Path(__file__).resolve().parents[1]
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
+    assert callable(__import__("plag_system").analyze_file)
+
+
 if __name__ == "__main__":
     test_analyze_file_basic(Path("._tmp"))
     test_analyze_and_sign(Path("._tmp"))
@@ -0,0 +1,137 @@
+"""
+Text extraction and n-gram fingerprint helpers.
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import re
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+from plag_system.crypto_storage import decrypt_to_temp, is_encrypted
+
+if TYPE_CHECKING:  # pdfplumber is imported on first extraction.
+    import pdfplumber
+
+DEFAULT_NGRAM_SIZE = 3
+# Bump whenever normalize(), tokenize() or gram_hash() change their output:
+# fingerprints computed by another version no longer match.
+TOKENIZER_VERSION = 1
+
+
+Box = tuple[float, float, float, float]
+
+
+@contextlib.contextmanager
+def plain_pdf(path: Path) -> Iterator[Path]:
+    """Yield a readable path for a (possibly encrypted) PDF."""
+    if path.suffix.lower() != ".pdf":
+        raise ValueError("Only PDF files are supported.")
+    with path.open("rb") as file_handle:
+        header = file_handle.read(8)
+    temp_path = decrypt_to_temp(path) if is_encrypted(header) else path
+    try:
+        yield temp_path
+    finally:
+        if temp_path != path and temp_path.exists():
+            temp_path.unlink()
+
+
+@contextlib.contextmanager
+def open_pdf(path: Path) -> Iterator[pdfplumber.PDF]:
+    """Open a (possibly encrypted) PDF with pdfplumber."""
+    import pdfplumber  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+    with plain_pdf(path) as readable, pdfplumber.open(str(readable)) as pdf:
+        yield pdf
+
+
+def read_pages(path: Path) -> list[str]:
+    """Return the extracted text of each page of a (possibly encrypted) PDF."""
+    with open_pdf(path) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def read_layout(path: Path) -> tuple[list[str], list[list[Box | None]]]:
+    """Return the text of each page plus the ``(x0, top, x1, bottom)`` box of every
+    character of that text (None for inserted spaces and newlines)."""
+    pages = []
+    boxes = []
+    with open_pdf(path) as pdf:
+        for page in pdf.pages:
+            # extract_text() renders this same text map.
+            textmap = page.get_textmap()
+            page_boxes: list[Box | None] = []
+            for chars, obj in textmap.tuples:
+                box = (obj["x0"], obj["top"], obj["x1"], obj["bottom"]) if obj else None
+                page_boxes.extend([box] * len(chars))
+            pages.append(textmap.as_string)
+            boxes.append(page_boxes)
+    return pages, boxes
+
+
+def read_text(path: Path) -> str:
+    """Return the extracted text of a PDF with pages joined by newlines."""
+    return "\n".join(read_pages(path))
+
+
+def normalize(text: str) -> str:
+    """Lowercase text and collapse every non-alphanumeric run to one space."""
+    return " ".join("".join(ch.lower() if ch.isalnum() else " " for ch in text).split())
+
+
+def tokenize(text: str) -> list[tuple[str, int, int]]:
+    """Return ``(token, start, end)`` for the tokens :func:`normalize` produces.
+
+    Offsets are character positions in ``text``, so matched n-grams can be
+    traced back to the original passage.
+    """
+    tokens = []
+    start = None
+    for offset, ch in enumerate(text):
+        if ch.isalnum():
+            if start is None:
+                start = offset
+        elif start is not None:
+            tokens.append(("".join(c.lower() for c in text[start:offset]), start, offset))
+            start = None
+    if start is not None:
+        tokens.append(("".join(c.lower() for c in text[start:]), start, len(text)))
+    return tokens
+
+
+def gram_sequence(tokens: list[str], n: int = DEFAULT_NGRAM_SIZE) -> list[int]:
+    """Return the fingerprint of the n-gram starting at each token, in order."""
+    return [gram_hash(" ".join(tokens[i : i + n])) for i in range(len(tokens) - n + 1)]
+
+
+def ngrams(text: str, n: int = DEFAULT_NGRAM_SIZE) -> set[str]:
+    """Return the set of word n-grams of the normalized text."""
+    tokens = normalize(text).split()
+    if len(tokens) < n:
+        return set()
+    return {" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)}
+
+
+def sentences(text: str) -> list[str]:
+    """Split text into sentences on terminal punctuation."""
+    parts = re.split(r"(?<=[.!?])\s+", text.strip())
+    return [sentence for sentence in parts if sentence]
+
+
+def gram_hash(gram: str) -> int:
+    """Return a stable unsigned 64-bit fingerprint of an n-gram."""
+    digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def content_hash(text: str) -> int:
+    """Return a 64-bit fingerprint of the normalized text, for exact duplicates."""
+    digest = hashlib.blake2b(normalize(text).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def hashed_ngrams(text: str, n: int = DEFAULT_NGRAM_SIZE) -> set[int]:
+    """Return the 64-bit fingerprints of the text's word n-grams."""
+    return {gram_hash(gram) for gram in ngrams(text, n=n)}
@@ -0,0 +1,44 @@
+"""
+Per-stage timings of one scan.
+
+:func:`plag_system.checker.analyze_and_sign` records how long extraction,
+corpus comparison, alignment, sentence matching, annotation and signing
+took, and the ``/scan`` route adds storage encryption. Durations come from
+``time.perf_counter``, so they are monotonic and unaffected by clock
+changes. A stage entered more than once accumulates.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class StageTimings:
+    """Durations of the stages of one scan and counts of what they processed."""
+
+    def __init__(self) -> None:
+        self.stages: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the ``with`` block as stage ``name``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+
+    def count(self, name: str, value: int) -> None:
+        """Add ``value`` to counter ``name`` (pages, bytes, documents...)."""
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def to_json(self) -> dict:
+        """Stage durations in milliseconds, their total, and the counters."""
+        return {
+            "stages_ms": {name: round(value * 1000, 3) for name, value in self.stages.items()},
+            "total_ms": round(sum(self.stages.values()) * 1000, 3),
+            **self.counts,
+        }